@@ -68,6 +68,13 @@ def main():
     # Parse input args
     parser = argparse.ArgumentParser(
         description='Post from Atom/RSS feeds to various client types.')
+    parser.add_argument(
+        'mode',
+        nargs='?',
+        choices=['run', 'prune'],
+        default='run',
+        help='run: publish new entries (default); prune: forget published '
+        'entries which are no longer needed, and compact the database')
     parser.add_argument(
         '-t',
         '--testing',
@@ -75,6 +82,16 @@ def main():
         const='feedspora',
         default=None,
         help='execute test runs; no actual posting done')
+    parser.add_argument(
+        '--days',
+        type=int,
+        default=None,
+        help='prune: forget entries published more than DAYS days ago '
+        '(defaults to the retention_days setting)')
+    parser.add_argument(
+        '--window',
+        action='store_true',
+        help='prune: forget entries which are no longer in their feed')
     args = parser.parse_args()
 
     # root name of config and DB files, optionally modified by the --testing
@@ -88,11 +105,18 @@ def main():
         if 'enabled' not in feed or feed['enabled']:
             connect_feed(feed)
 
+    feedspora.set_db_file(root_name + '.db')
+    if 'settings' in config:
+        feedspora.set_settings(config['settings'])
+    feedspora.set_testing(args.testing is not None)
+
+    if args.mode == 'prune':
+        feedspora.prune(args.days, args.window)
+        return
+
     for account in config['accounts']:
         if 'enabled' not in account or account['enabled']:
             connect_client(account, args.testing)
-    feedspora.set_db_file(root_name + '.db')
-    feedspora.set_testing(args.testing is not None)
     feedspora.run()
 
 
@@ -0,0 +1,176 @@
+"""
+Circuit breakers: clients and feed hosts which keep failing are left alone
+for a while, instead of waiting for each call to time out.
+
+After breaker_threshold consecutive failures, the breaker of a client or
+host opens: calls are skipped right away for breaker_cooldown seconds. It
+then lets a single call through (half-open), and closes if it succeeds or
+opens again if it fails. Breakers, along with their statistics, are kept in
+the state store from one run to the next.
+
+The breakers of a run are held by a CircuitBreakers instance the runner
+shares with its clients and feeds.
+"""
+
+import logging
+import threading
+import time
+
+from feedspora.common_config import runner_settings
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half-open'
+
+DEFAULTS = {'breaker_threshold': 5,
+            'breaker_cooldown': 300,
+           }
+
+
+class CircuitOpen(Exception):
+    '''
+    A call was skipped because its breaker is open: it should be attempted
+    again after retry_after seconds
+    '''
+
+    def __init__(self, name, retry_after):
+        '''
+        Initialize
+        :param name: name of the breaker
+        :param retry_after:
+        '''
+        super().__init__("Circuit breaker %s is open" % name)
+        self.retry_after = retry_after
+
+
+class CircuitBreakers:
+    '''
+    Circuit breakers, by name ('client <name>' or 'host <host>')
+    '''
+
+    def __init__(self, settings=None, clock=time.time):
+        '''
+        Initialize, with all breakers closed
+        :param settings: runner settings (number of consecutive failures
+                         opening a breaker, number of seconds it stays open)
+        :param clock: function returning the current time (epoch)
+        '''
+        self._settings = runner_settings(settings, DEFAULTS)
+        self._clock = clock
+        self._breakers = {}
+        # Breakers as last loaded or returned by pop_changes, by name
+        self._saved = {}
+        self._lock = threading.Lock()
+
+    def load_states(self, states):
+        '''
+        Load the breakers kept in the state store (see get_states). A breaker
+        left half-open lets a call through again.
+        :param states: dict of the breakers, by name
+        '''
+        with self._lock:
+            for name, state in states.items():
+                self._breakers[name] = dict(state)
+                if state['state'] == HALF_OPEN:
+                    self._breakers[name].update(state=OPEN, opened_until=0)
+                self._saved[name] = dict(self._breakers[name])
+
+    def get_states(self):
+        '''
+        Return the breakers to store, by name
+        '''
+        with self._lock:
+            return {name: dict(breaker)
+                    for name, breaker in self._breakers.items()}
+
+    def pop_changes(self):
+        '''
+        Return the breakers which changed since they were loaded or since
+        the last call, by name
+        '''
+        with self._lock:
+            changes = {name: dict(breaker)
+                       for name, breaker in self._breakers.items()
+                       if breaker != self._saved.get(name)}
+            self._saved.update(changes)
+
+            return changes
+
+    def _get(self, name):
+        '''
+        Return the breaker with the specified name (with _lock held)
+        :param name:
+        '''
+        if name not in self._breakers:
+            self._breakers[name] = {
+                'state': CLOSED, 'failures': 0, 'opened_until': 0,
+                'successes_total': 0, 'failures_total': 0, 'trips': 0,
+                'skipped': 0}
+
+        return self._breakers[name]
+
+    def check(self, name):
+        '''
+        Raise CircuitOpen if calls with the specified breaker must be skipped
+        :param name:
+        '''
+        with self._lock:
+            breaker = self._get(name)
+            now = self._clock()
+            if breaker['state'] == OPEN and breaker['opened_until'] <= now:
+                logging.info("Circuit breaker %s half-open, trying again",
+                             name)
+                breaker['state'] = HALF_OPEN
+                return
+            if breaker['state'] != CLOSED:
+                # Open, or half-open with a call in progress
+                breaker['skipped'] += 1
+                raise CircuitOpen(name,
+                                  max(breaker['opened_until'] - now, 0) or
+                                  self._settings['breaker_cooldown'])
+
+    def release(self, name):
+        '''
+        Record that a call let through wasn't made after all, so that the
+        next one is let through if the breaker is half-open
+        :param name:
+        '''
+        with self._lock:
+            breaker = self._get(name)
+            if breaker['state'] == HALF_OPEN:
+                breaker.update(state=OPEN, opened_until=0)
+
+    def succeeded(self, name):
+        '''
+        Record a successful call, closing the breaker
+        :param name:
+        '''
+        with self._lock:
+            breaker = self._get(name)
+            if breaker['state'] != CLOSED:
+                logging.info("Circuit breaker %s closed", name)
+            breaker['state'] = CLOSED
+            breaker['failures'] = 0
+            breaker['successes_total'] += 1
+
+    def failed(self, name):
+        '''
+        Record a failed call, opening the breaker if it failed too many
+        times in a row, or if it was half-open
+        :param name:
+        '''
+        with self._lock:
+            breaker = self._get(name)
+            breaker['failures'] += 1
+            breaker['failures_total'] += 1
+            if breaker['state'] == HALF_OPEN or \
+               breaker['failures'] >= self._settings['breaker_threshold']:
+                if breaker['state'] != OPEN:
+                    breaker['trips'] += 1
+                    logging.warning("Circuit breaker %s open for %d seconds "
+                                    "after %d failures", name,
+                                    self._settings['breaker_cooldown'],
+                                    breaker['failures'])
+                breaker['state'] = OPEN
+                breaker['opened_until'] = self._clock() + \
+                    self._settings['breaker_cooldown']
@@ -1,8 +1,128 @@
 """
 CommonConfig: Common configuration functions applying to both
-GenericClient and GenericFeed.
+GenericClient and GenericFeed, and to the runner settings.
 """
 
+import collections
+import logging
+
+# Flags of the tag_filter_opts option
+TAG_FILTER_FLAGS = ('ignore_title', 'ignore_content', 'ignore_category',
+                    'case-sensitive')
+
+
+def option_key(value):
+    '''
+    Return a hashable equivalent of an option value
+    :param value:
+    '''
+    if isinstance(value, (list, tuple)):
+        return tuple(option_key(item) for item in value)
+    if isinstance(value, dict):
+        return tuple(sorted((key, option_key(item))
+                            for key, item in value.items()))
+
+    return value
+
+
+def runner_settings(settings, defaults):
+    '''
+    Return the runner settings (settings section of the configuration file)
+    named in defaults, the defaults being used for those not specified
+    :param settings: runner settings, or None
+    :param defaults: dict of the default values, by setting name
+    '''
+    settings = settings or dict()
+
+    return {name: default if settings.get(name) is None else settings[name]
+            for name, default in defaults.items()}
+
+
+class PostOptions(collections.namedtuple('PostOptions', (
+        'tags', 'ignore_title', 'ignore_content', 'ignore_category',
+        'case_sensitive', 'max_tags', 'post_prefix', 'post_suffix',
+        'post_include_content', 'post_include_media', 'url_shortener',
+        'url_shortener_opts'))):
+    '''
+    The options a client posts the entries of a feed with: feed options
+    override client options. They are resolved and validated once, and
+    can't be modified. Tag filter options are parsed into flags, and the
+    URL shortener options are a tuple of (name, value) items.
+    '''
+    __slots__ = ()
+
+    @classmethod
+    def compile(cls, client_config, feed_config=None):
+        '''
+        Resolve and validate the options of a client for a feed.
+        Raise ValueError for invalid options.
+        :param client_config:
+        :param feed_config:
+        '''
+
+        def resolve(option, default=None):
+            if feed_config and option in feed_config:
+                return feed_config[option]
+            return client_config.get(option, default)
+
+        def invalid(option, value):
+            return ValueError("Invalid %s %r for client %s and feed %s" %
+                              (option, value, client_config.get('name'),
+                               (feed_config or dict()).get('path')))
+
+        tags = resolve('tags') or []
+        if isinstance(tags, str):
+            tags = [word.strip() for word in tags.split(',') if word]
+        if not all(isinstance(tag, str) for tag in tags):
+            raise invalid('tags', tags)
+
+        tag_filter_opts = resolve('tag_filter_opts') or dict()
+        if isinstance(tag_filter_opts, str):
+            tag_filter_opts = {key.strip(): True
+                               for key in tag_filter_opts.split(',') if key}
+        for flag in tag_filter_opts:
+            if flag not in TAG_FILTER_FLAGS:
+                logging.warning("Ignoring unknown tag_filter_opts flag '%s' "
+                                "for client %s", flag,
+                                client_config.get('name'))
+
+        max_tags = resolve('max_tags', 100)
+        if not isinstance(max_tags, int) or isinstance(max_tags, bool) or \
+           max_tags < 0:
+            raise invalid('max_tags', max_tags)
+
+        for option in ('post_prefix', 'post_suffix'):
+            if not isinstance(resolve(option, ''), str):
+                raise invalid(option, resolve(option))
+        for option in ('post_include_content', 'post_include_media'):
+            if not isinstance(resolve(option, False), bool):
+                raise invalid(option, resolve(option))
+
+        url_shortener = resolve('url_shortener')
+        if url_shortener is not None and not isinstance(url_shortener, str):
+            raise invalid('url_shortener', url_shortener)
+        if url_shortener is not None and \
+           url_shortener.lower() in ('', 'none'):
+            url_shortener = None
+        url_shortener_opts = resolve('url_shortener_opts') or dict()
+        if not isinstance(url_shortener_opts, dict):
+            raise invalid('url_shortener_opts', url_shortener_opts)
+
+        return cls(tags=tuple(tags),
+                   ignore_title='ignore_title' in tag_filter_opts,
+                   ignore_content='ignore_content' in tag_filter_opts,
+                   ignore_category='ignore_category' in tag_filter_opts,
+                   case_sensitive='case-sensitive' in tag_filter_opts,
+                   max_tags=max_tags,
+                   post_prefix=resolve('post_prefix', ''),
+                   post_suffix=resolve('post_suffix', ''),
+                   post_include_content=resolve('post_include_content',
+                                                False),
+                   post_include_media=resolve('post_include_media', False),
+                   url_shortener=url_shortener and url_shortener.lower(),
+                   url_shortener_opts=option_key(url_shortener_opts))
+
+
 class CommonConfig:
     """
     Configuration aspects that are common to both clients and feeds.
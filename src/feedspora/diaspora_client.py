@@ -55,21 +55,21 @@ class DiaspyClient(GenericClient):
         :param feed:
         :param entry:
         '''
+        options = self.get_options(feed)
 
-        text = self.resolve_option(feed, 'post_prefix') + \
-               '['+entry.title +']('+self.shorten_url(feed, entry.link)+')'
-        stripped_html = self.strip_html(feed, entry.content) \
-                        if entry.content else None
-        if self.resolve_option(feed, 'post_include_content') and stripped_html:
+        text = options.post_prefix + \
+               '['+entry.title +']('+self.shorten_link(feed, entry)+')'
+        stripped_html = self.strip_entry_html(feed, entry)
+        if options.post_include_content and stripped_html:
             text += ": " + stripped_html
-        text += self.resolve_option(feed, 'post_suffix')
+        text += options.post_suffix
         post_tags = ''.join([" #{}".format(k)
                              for k in self.filter_tags(feed, entry)])
         if post_tags:
             text += ' |'+post_tags
 
         media_path = None
-        if self.resolve_option(feed, 'post_include_media') and entry.media_url:
+        if options.post_include_media and entry.media_url:
             # Need to download image from that URL in order to post it!
             media_path = self.download_media(entry.media_url)
 
@@ -5,6 +5,10 @@ import facebook
 
 from feedspora.generic_client import GenericClient
 
+# Graph API error codes of rate limits (application, user, page, and
+# specific API calls)
+RATE_LIMIT_CODES = (4, 17, 32, 613)
+
 
 class FacebookClient(GenericClient):
     ''' The FacebookClient handles the connection to Facebook. '''
@@ -46,41 +50,38 @@ class FacebookClient(GenericClient):
         :param feed:
         :param entry:
         '''
+        options = self.get_options(feed)
         # "Only owners of the URL have the ability to specify the picture,
         #  name, thumbnail or description params." -- Facebook Law
         # This greatly limits what we can reliably do/provide, obviously
-        stripped_html = self.strip_html(feed, entry.content) \
-                        if entry.content else None
+        stripped_html = self.strip_entry_html(feed, entry)
         text = ''
-        if self.resolve_option(feed, 'post_include_content') and \
-           stripped_html or \
-           not self.resolve_option(feed, 'post_include_media'):
-            text = self.resolve_option(feed, 'post_prefix')
-            if not self.resolve_option(feed, 'post_include_media'):
+        if options.post_include_content and stripped_html or \
+           not options.post_include_media:
+            text = options.post_prefix
+            if not options.post_include_media:
                 # Not including media (which pulls in the title as the link
                 # name), so we need to insert the title here
                 text += entry.title
-                if self.resolve_option(feed, 'post_include_content') and \
-                   stripped_html:
+                if options.post_include_content and stripped_html:
                     # More to come, so add a delimiter
                     text += ': '
-            if self.resolve_option(feed, 'post_include_content') and \
-               stripped_html:
+            if options.post_include_content and stripped_html:
                 text += stripped_html
-            text += self.resolve_option(feed, 'post_suffix')
+            text += options.post_suffix
         text += ''.join([' #{}'.format(k)
                          for k in self.filter_tags(feed, entry)])
-        if not self.resolve_option(feed, 'post_include_media'):
-            text += ' '+self.shorten_url(feed, entry.link)
+        if not options.post_include_media:
+            text += ' '+self.shorten_link(feed, entry)
         # Just in case...
         text = text.strip()
 
         # 'message' and 'link' are the only two components of a post
         attachment = {'message': text}
-        if self.resolve_option(feed, 'post_include_media'):
+        if options.post_include_media:
             # In this case, specify the link, which will include its media
             # (and the title as the link text, as previously mentioned)
-            attachment['link'] = self.shorten_url(feed, entry.link)
+            attachment['link'] = self.shorten_link(feed, entry)
         else:
             attachment['link'] = None
 
@@ -89,8 +90,13 @@ class FacebookClient(GenericClient):
             self.accumulate_testing_output(
                 self.get_dict_output(text=text, attachment=attachment))
         else:
-            to_return = self._graph.put_object(self._config['post_to_id'],
-                                               'feed', **attachment)
+            try:
+                to_return = self._graph.put_object(
+                    self._config['post_to_id'], 'feed', **attachment)
+            except facebook.GraphAPIError as error:
+                if error.code in RATE_LIMIT_CODES:
+                    raise self.rate_limited(error) from error
+                raise
             if 'id' not in to_return or to_return['id'] == 0:
                 to_return = ()
 
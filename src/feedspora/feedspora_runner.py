@@ -14,10 +14,25 @@ It currently supports Facebook, Twitter, Diaspora, Wordpress and Mastodon.
 @contact:    aurelien.grosdidier@gmail.com
 '''
 
+import collections
+import functools
+import itertools
 import json
 import logging
 import os
-import sqlite3
+import threading
+import time
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+
+from feedspora import http_session, media_cache, url_shortener
+from feedspora.circuit_breaker import CircuitBreakers, CircuitOpen
+from feedspora.generic_feed import FeedSporaEntry, parse_date
+from feedspora.outbox import Outbox, key_item, post_key
+from feedspora.rate_limiter import RateLimited
+from feedspora.send_scheduler import SendScheduler
+from feedspora.state_store import DAY, STATE_STORES, copy_store, \
+    entry_digest
 
 class FeedSpora:
     ''' FeedSpora itself. '''
@@ -25,8 +40,12 @@ class FeedSpora:
     _client = None
     _feed = None
     _db_file = "feedspora.db"
-    _conn = None
-    _cur = None
+    _store = None
+    _published = None
+    _post_executor = None
+    _schedulers = None
+    _outbox = None
+    _breakers = None
 
     def __init__(self):
         '''
@@ -35,6 +54,58 @@ class FeedSpora:
         logging.basicConfig(level=logging.INFO)
         self._testing = False
         self._testing_accumulator = None
+        self._settings = None
+        self._pending_entries = []
+        # Posts left to the send schedulers, not recorded yet
+        self._scheduled_posts = []
+        # Identifiers of the entries currently in each feed, and feeds
+        # which couldn't be read, by feed identifier
+        self._feed_windows = dict()
+        self._unread_feeds = set()
+        # Last state of the rate limiters written to the store, by client
+        self._rate_limits = dict()
+        self.set_settings(None)
+
+    def set_settings(self, settings):
+        '''
+        Set the runner settings (optional 'settings' section of the
+        configuration file), using defaults for anything not specified
+        :param settings:
+        '''
+        setting_defaults = {'commit_interval': 50,
+                            'state_store': 'sqlite',
+                            'retention_days': 0,
+                            'fetch_workers': 4,
+                            'fetch_per_host': 2,
+                            'post_workers': 1,
+                            'outbox_max_attempts': 5,
+                            'outbox_backoff': 60,
+                            'outbox_batch': 10,
+                           }
+        self._settings = dict(setting_defaults)
+        if settings:
+            self._settings.update(settings)
+        http_session.configure(self._settings)
+        media_cache.configure(self._settings)
+        url_shortener.configure(self._settings)
+        if self._settings['state_store'] not in STATE_STORES:
+            raise ValueError("Unknown state_store '%s', should be one of %s" %
+                             (self._settings['state_store'],
+                              ', '.join(sorted(STATE_STORES))))
+        for name in ('commit_interval', 'fetch_workers', 'fetch_per_host',
+                     'post_workers'):
+            value = self._settings[name]
+            if not isinstance(value, int) or isinstance(value, bool) or \
+               value < 1:
+                raise ValueError("Invalid %s '%s', should be a positive "
+                                 "integer" % (name, value))
+        # Feeds of the same host retrieved at once each need a connection
+        pool_size = http_session.get_settings()['http_pool_size']
+        if not isinstance(pool_size, int) or \
+           pool_size < self._settings['fetch_per_host']:
+            raise ValueError("Invalid http_pool_size '%s', should be at least "
+                             "fetch_per_host (%d)" %
+                             (pool_size, self._settings['fetch_per_host']))
 
     def set_db_file(self, db_file):
         '''
@@ -65,20 +136,28 @@ class FeedSpora:
 
     def _init_db(self):
         '''
-        Initialize the connection to the database.
-        It also creates the table if the file does not exist yet.
+        Initialize the state store tracking published entries, with the
+        configured backend. A new store starts from the state of the other
+        backend, if there is one (the state_store setting changed).
         '''
-        should_init = not os.path.exists(self._db_file)
-        self._conn = sqlite3.connect(self._db_file)
-        self._cur = self._conn.cursor()
+        backend = self._settings['state_store']
+        self._store = STATE_STORES[backend](self._db_file)
+        is_new = not os.path.exists(self._store.get_path())
+        self._store.open()
+        if not is_new:
+            return
 
-        if should_init:
-            logging.info("Creating new database file %s", self._db_file)
-            sql = "CREATE table posts (id INTEGER PRIMARY KEY, " \
-                  "feedspora_id, client_id TEXT)"
-            self._cur.execute(sql)
-        else:
-            logging.info("Found database file %s", self._db_file)
+        for name, store_class in sorted(STATE_STORES.items()):
+            previous = store_class(self._db_file)
+            if name != backend and os.path.exists(previous.get_path()):
+                logging.info("Copying the state of %s to %s",
+                             previous.get_path(), self._store.get_path())
+                previous.open()
+                try:
+                    copy_store(previous, self._store)
+                finally:
+                    previous.close()
+                return
 
     def set_testing(self, testing):
         '''
@@ -90,57 +169,216 @@ class FeedSpora:
             self._testing_accumulator = dict()
 
     # pylint: disable=no-self-use
-    def entry_identifier(self, entry):
+    def entry_identifier(self, entry, feed=None):
         '''
-        Defines the identifier associated with the specified entry
+        Defines the identifier associated with the specified entry: a digest
+        of its identity, as defined by the entry_identity option of the feed
         :param entry:
+        :param feed:
         '''
-        # Unique item formed of link data, perhaps with published date
-        to_return = entry.link
+        strategy = feed.get_config()['entry_identity'] if feed \
+                   else 'link_date'
+
+        if strategy == 'guid' and entry.guid:
+            identity = entry.guid
+        elif strategy == 'link':
+            identity = entry.link
+        else:
+            # Unique item formed of link data, perhaps with published date
+            identity = entry.link
 
-        if entry.published_date:
-            to_return += ' ' + entry.published_date
+            if entry.published_date:
+                identity += ' ' + entry.published_date
 
-        return to_return
+        return entry_digest(identity)
+    # pylint: enable=no-self-use
+
+    def _client_ids(self):
+        '''
+        Return the names of the connected clients
+        '''
+        return [client.get_config()['name'] for client in self._client]
+
+    # pylint: disable=no-self-use
+    def feed_identifier(self, feed):
+        '''
+        Defines the identifier associated with the specified feed
+        :param feed:
+        '''
+        return entry_digest(feed.get_path()) if feed else None
     # pylint: enable=no-self-use
 
-    def is_already_published(self, entry, client):
+    def load_published_entries(self, entries, feed=None):
+        '''
+        Load, for every connected client, which of the specified entries
+        have already been published, with a single bulk lookup. Subsequent
+        calls to is_already_published are answered from memory.
+        :param entries:
+        :param feed:
+        '''
+        self.commit_published_entries()
+        client_ids = self._client_ids()
+        self._published = {client_id: set() for client_id in client_ids}
+        pub_items = {self.entry_identifier(entry, feed) for entry in entries}
+        found = self._store.contains_many(
+            (client_id, pub_item)
+            for client_id in client_ids for pub_item in pub_items)
+
+        for client_id, pub_item in found:
+            self._published[client_id].add(pub_item)
+
+    def is_already_published(self, entry, client, feed=None):
         '''
         Checks if a FeedSporaEntry has already been published.
-        It checks if it's already in the database of published items.
+        It checks if it's already in the state store of published items, or
+        in the identifiers loaded by load_published_entries.
         :param entry:
         :param client:
+        :param feed:
         '''
-        pub_item = self.entry_identifier(entry)
-        sql = "SELECT id from posts WHERE feedspora_id=:feedspora_id AND "\
-              "client_id=:client_id"
-        self._cur.execute(sql, {
-            "feedspora_id": pub_item,
-            "client_id": client.get_config()['name']
-        })
-        already_published = self._cur.fetchone() is not None
+        pub_item = self.entry_identifier(entry, feed)
+        client_id = client.get_config()['name']
+        if self._published is not None and client_id in self._published:
+            already_published = pub_item in self._published[client_id]
+        else:
+            self.commit_published_entries()
+            already_published = bool(
+                self._store.contains_many([(client_id, pub_item)]))
 
         if already_published:
             logging.info('Skipping already published entry in %s: %s',
-                         client.get_config()['name'], entry.title)
+                         client_id, entry.title)
         else:
             logging.info('Found entry to publish in %s: %s',
-                         client.get_config()['name'], entry.title)
+                         client_id, entry.title)
 
         return already_published
 
-    def add_to_published_entries(self, entry, client):
+    def _is_left_to_outbox(self, client_id, pub_item):
+        '''
+        Is the post of an entry to a client waiting in the outbox, or
+        dead-lettered? It is then taken care of, as if it was published.
+        :param client_id:
+        :param pub_item:
         '''
-        Add a FeedSporaEntries to the database of published items.
+        if self._outbox is None:
+            return False
+        key = post_key(client_id, pub_item)
+
+        return key in self._outbox or self._outbox.is_dead(key)
+
+    def is_published_everywhere(self, entry, feed=None):
+        '''
+        Checks if a FeedSporaEntry has already been published to every
+        connected client (or left to the outbox), straight from the state
+        store.
+        :param entry:
+        :param feed:
+        '''
+        self.commit_published_entries()
+        pub_item = self.entry_identifier(entry, feed)
+        client_ids = self._client_ids()
+        found = {client_id for client_id, _ in self._store.contains_many(
+            (client_id, pub_item) for client_id in client_ids)}
+
+        return all(client_id in found or
+                   self._is_left_to_outbox(client_id, pub_item)
+                   for client_id in client_ids)
+
+    def add_to_published_entries(self, entry, client, feed=None):
+        '''
+        Add a FeedSporaEntries to the state store of published items.
+        Entries are written in batches: they are committed once
+        commit_interval of them are pending, and at the end of each feed.
         :param entry:
         :param client:
+        :param feed:
+        '''
+        pub_item = self.entry_identifier(entry, feed)
+        client_id = client.get_config()['name']
+        logging.info('Storing in database of published items: %s',
+                     entry.link)
+        self._pending_entries.append(
+            (client_id, pub_item, self.feed_identifier(feed)))
+
+        if self._published is not None and client_id in self._published:
+            self._published[client_id].add(pub_item)
+
+        if len(self._pending_entries) >= self._settings['commit_interval']:
+            self.commit_published_entries()
+
+    def commit_published_entries(self):
+        '''
+        Write the pending published items to the state store, in a single
+        batch.
+        '''
+        if not self._pending_entries:
+            return
+        logging.info('Committing %d published items to the database',
+                     len(self._pending_entries))
+        self._store.add_many(self._pending_entries)
+        self._pending_entries = []
+
+    def _load_short_urls(self):
+        '''
+        Load the short URLs cached in the state store
+        '''
+        url_shortener.load_cache(self._store.get_all_states('short_urls'))
+
+    def _save_short_urls(self):
+        '''
+        Write the short URLs obtained since the last call to the state store
         '''
-        pub_item = self.entry_identifier(entry)
-        logging.info('Storing in database of published items: %s', pub_item)
-        self._cur.execute(
-            "INSERT INTO posts (feedspora_id, client_id) "
-            "values (?,?)", (pub_item, client.get_config()['name']))
-        self._conn.commit()
+        self._store.set_states('short_urls', url_shortener.pop_changes())
+
+    def _load_breakers(self):
+        '''
+        Load the circuit breakers kept in the state store, and share them
+        with the clients and feeds
+        '''
+        self._breakers = CircuitBreakers(self._settings)
+        self._breakers.load_states(
+            self._store.get_all_states('circuit_breakers'))
+        for client in self._client:
+            client.set_circuit_breakers(self._breakers)
+        for feed in self._feed:
+            feed.set_circuit_breakers(self._breakers)
+
+    def _save_breakers(self):
+        '''
+        Write the circuit breakers which changed since the last call to the
+        state store
+        '''
+        if self._breakers is None:
+            return
+        self._store.set_states('circuit_breakers',
+                               self._breakers.pop_changes())
+
+    def _load_rate_limits(self):
+        '''
+        Restore the state of the rate limiters of the clients
+        '''
+        states = self._store.get_all_states('rate_limits')
+        self._rate_limits = dict()
+        for client in self._client:
+            name = client.get_config()['name']
+            if states.get(name):
+                client.get_rate_limiter().set_state(states[name])
+            self._rate_limits[name] = client.get_rate_limiter().get_state()
+
+    def _save_rate_limits(self):
+        '''
+        Write the state of the rate limiters of the clients which changed to
+        the state store
+        '''
+        changes = {}
+        for client in self._client:
+            name = client.get_config()['name']
+            state = client.get_rate_limiter().get_state()
+            if state != self._rate_limits.get(name):
+                changes[name] = state
+        self._store.set_states('rate_limits', changes)
+        self._rate_limits.update(changes)
 
     def _publish_entry(self, entry, entry_count, feed, feed_count):
         '''
@@ -158,43 +396,306 @@ class FeedSpora:
             return
         logging.info('Publishing: %s', entry.title)
 
+        clients = [client for client in self._client
+                   if not self.is_already_published(entry, client, feed)]
+        if self._outbox is not None:
+            # Attempted again from the outbox only, or not at all once
+            # dead-lettered
+            pub_item = self.entry_identifier(entry, feed)
+            keys = {client: post_key(client.get_config()['name'], pub_item)
+                    for client in clients}
+            clients = [client for client in clients
+                       if keys[client] not in self._outbox and
+                       not self._outbox.is_dead(keys[client])]
+        # Clients with a delay between posts are left to their scheduler:
+        # the results are recorded later, unless the feed is limited (the
+        # posts of the entry must then be counted right away)
+        posts = dict()
+        deferred = []
+        for client in clients:
+            if self._schedulers and client in self._schedulers:
+                future = self._schedulers[client].schedule(
+                    client.post_within_limits, entry, feed)
+                if feed.is_post_limited():
+                    posts[client] = future.result
+                else:
+                    self._scheduled_posts.append(
+                        (future, entry, client, feed, entry_count,
+                         feed_count, None))
+                    deferred.append(client)
+        clients = [client for client in clients if client not in deferred]
+
+        direct = [client for client in clients if client not in posts]
+        for client in direct:
+            if self._post_executor and len(direct) > 1:
+                posts[client] = self._post_executor.submit(
+                    client.post_within_limits, entry, feed).result
+            else:
+                posts[client] = functools.partial(client.post_within_limits,
+                                                  entry, feed)
+
+        # Results are handled in order, in this thread
         entry_published = False
-        for client in self._client:
-            if not self.is_already_published(entry, client):
-                # pylint: disable=broad-except
-                try:
-                    posted_to_client = client.post_within_limits(entry, feed)
-                except Exception as error:
-                    logging.error(
-                        "Error while publishing '%s' to client"
-                        " '%s' : %s",
-                        entry.title,
-                        client.__class__.__name__,
-                        format(error),
-                        exc_info=True)
-
-                    continue
-
-                if posted_to_client:
-                    entry_published = True
-
-                if posted_to_client or \
-                   client.seeding_published_db(entry_count, feed, feed_count):
-                    try:
-                        self.add_to_published_entries(entry, client)
-                    except Exception as error:
-                        logging.error(
-                            "Error while storing '%s' to client"
-                            "'%s' : %s",
-                            entry.title,
-                            client.__class__.__name__,
-                            format(error),
-                            exc_info=True)
-                # pylint: enable=broad-except
+        for client in clients:
+            if self._handle_post(posts[client], entry, client, feed,
+                                 entry_count, feed_count):
+                entry_published = True
 
         if entry_published:
             feed.increment_posts_done()
 
+    # pylint: disable=too-many-arguments
+    def _handle_post(self, post, entry, client, feed, entry_count,
+                     feed_count, outbox_post=None):
+        '''
+        Post an entry to a client, and record it as published if it was (or
+        if the client is seeding). If it fails, it is left to the outbox.
+        Return whether it was posted.
+        :param post: function posting, or returning the result of the post
+        :param entry:
+        :param client:
+        :param feed:
+        :param entry_count:
+        :param feed_count:
+        :param outbox_post: post from the outbox, if delivered from it
+        '''
+        key = post_key(client.get_config()['name'],
+                       self.entry_identifier(entry, feed))
+        if outbox_post is None:
+            outbox_post = {'client': client.get_config()['name'],
+                           'feed': feed.get_path(),
+                           'entry_count': entry_count,
+                           'feed_count': feed_count}
+        # pylint: disable=broad-except
+        try:
+            posted_to_client = post()
+        except (RateLimited, CircuitOpen) as error:
+            logging.info("Postponing '%s' to client '%s' for %d seconds: %s",
+                         entry.title, client.__class__.__name__,
+                         error.retry_after, format(error))
+            if self._outbox is not None:
+                self._outbox.postpone(
+                    key, dict(outbox_post, entry=entry.to_dict()),
+                    error.retry_after)
+
+            return False
+        except Exception as error:
+            logging.error(
+                "Error while publishing '%s' to client"
+                " '%s' : %s",
+                entry.title,
+                client.__class__.__name__,
+                format(error),
+                exc_info=True)
+
+            if self._outbox is not None:
+                self._outbox.failed(
+                    key, dict(outbox_post, entry=entry.to_dict()), error)
+
+            return False
+
+        if self._outbox is not None:
+            self._outbox.remove(key)
+
+        if posted_to_client or \
+           client.seeding_published_db(entry_count, feed, feed_count):
+            try:
+                self.add_to_published_entries(entry, client, feed)
+            except Exception as error:
+                logging.error(
+                    "Error while storing '%s' to client"
+                    "'%s' : %s",
+                    entry.title,
+                    client.__class__.__name__,
+                    format(error),
+                    exc_info=True)
+        # pylint: enable=broad-except
+
+        return bool(posted_to_client)
+    # pylint: enable=too-many-arguments
+
+    def _deliver_outbox(self):
+        '''
+        Attempt again the posts of the outbox which are due, at most
+        outbox_batch of them. There is no separate worker: this runs in the
+        main thread, before the first feed and after each feed, and posts
+        to clients with a send_delay are left to their scheduler.
+        '''
+        feeds = {feed.get_path(): feed for feed in self._feed}
+        clients = {client.get_config()['name']: client
+                   for client in self._client}
+        # Posts left to a scheduler already
+        in_flight = {post_key(client.get_config()['name'],
+                              self.entry_identifier(entry, feed))
+                     for _, entry, client, feed, *_ in self._scheduled_posts}
+
+        for key, post in self._outbox.due(self._settings['outbox_batch']):
+            if key in in_flight:
+                continue
+            client = clients.get(post['client'])
+            feed = feeds.get(post['feed'])
+            if client is None or feed is None:
+                logging.warning("Removing %s from the outbox: its client or "
+                                "feed is no longer configured", key)
+                self._outbox.remove(key)
+                continue
+            entry = FeedSporaEntry.from_dict(post['entry'])
+            self.load_published_entries([entry], feed)
+            if self.is_already_published(entry, client, feed):
+                self._outbox.remove(key)
+                continue
+
+            logging.info("Delivering %s from the outbox (attempt %d)", key,
+                         post['attempts'] + 1)
+            if self._schedulers and client in self._schedulers:
+                future = self._schedulers[client].schedule(
+                    client.post_within_limits, entry, feed)
+                self._scheduled_posts.append(
+                    (future, entry, client, feed, post['entry_count'],
+                     post['feed_count'], post))
+            else:
+                self._handle_post(
+                    functools.partial(client.post_within_limits, entry,
+                                      feed),
+                    entry, client, feed, post['entry_count'],
+                    post['feed_count'], post)
+
+    def _collect_scheduled_posts(self, wait=False):
+        '''
+        Record the results of the posts sent by the schedulers so far, or
+        of all of them if wait is set
+        :param wait:
+        '''
+        pending = []
+        for future, *post_args in self._scheduled_posts:
+            if future.cancelled():
+                continue
+            if wait or future.done():
+                # Feeds with deferred posts aren't limited: their number of
+                # posts done doesn't matter
+                self._handle_post(future.result, *post_args)
+            else:
+                pending.append((future, *post_args))
+        self._scheduled_posts = pending
+
+    def _start_schedulers(self):
+        '''
+        Start a send scheduler for each client with a delay between posts
+        '''
+        self._schedulers = {
+            client: SendScheduler(client.get_config()['name'],
+                                  client.get_send_delay())
+            for client in self._client if client.get_send_delay()}
+
+    def _close_schedulers(self, cancel=False):
+        '''
+        Wait for the schedulers to send their posts (only those being sent
+        if cancel is set), and record the results
+        :param cancel:
+        '''
+        for scheduler in (self._schedulers or dict()).values():
+            scheduler.close(cancel)
+        self._schedulers = None
+        self._collect_scheduled_posts(wait=True)
+
+    def _load_feed_validators(self, feed):
+        '''
+        Set the validators of the previous retrieval of the feed. They are
+        only relevant if the feed was entirely published to the same clients.
+        :param feed:
+        '''
+        validators = self._store.get_state('feed_validators',
+                                           feed.get_path())
+        if validators and validators.get('clients') == self._client_ids():
+            feed.set_validators(validators)
+
+    def _load_feed_cursor(self, feed):
+        '''
+        Set the cursor of the feed, if enabled. It is only relevant if the
+        feed was published to the same clients.
+        :param feed:
+        '''
+        if not feed.get_config()['cursor']:
+            return
+        cursor = self._store.get_state('feed_cursor', feed.get_path())
+        if cursor and cursor.get('clients') == self._client_ids():
+            feed.set_cursor(cursor['date'])
+
+    def _save_feed_cursor(self, feed, entries):
+        '''
+        Advance the cursor of the feed, if enabled, to the newest date at or
+        before which every entry has been published to every client. Entries
+        with broken or missing dates are left to the published entries
+        lookup.
+        :param feed:
+        :param entries:
+        '''
+        if not feed.get_config()['cursor']:
+            return
+        client_ids = self._client_ids()
+
+        # Whether every entry of each date is published everywhere (or left
+        # to the outbox)
+        dates = dict()
+        for entry in entries:
+            published = parse_date(entry.published_date)
+            if published is not None:
+                pub_item = self.entry_identifier(entry, feed)
+                dates[published] = dates.get(published, True) and \
+                    all(pub_item in self._published[client_id] or
+                        self._is_left_to_outbox(client_id, pub_item)
+                        for client_id in client_ids)
+
+        cursor = feed.get_cursor()
+        for published in sorted(dates):
+            if not dates[published]:
+                break
+            if cursor is None or published > cursor:
+                cursor = published
+
+        if cursor is not None:
+            self._store.set_state('feed_cursor', feed.get_path(),
+                                  {'date': cursor, 'clients': client_ids})
+
+    # pylint: disable=no-self-use
+    def _prefetch_feed(self, feed, host_slots):
+        '''
+        Retrieve a feed, once a slot is available for its host
+        :param feed:
+        :param host_slots:
+        '''
+        with host_slots:
+            feed.prefetch()
+    # pylint: enable=no-self-use
+
+    def _prefetch_feeds(self, executor):
+        '''
+        Retrieve the feeds concurrently, with at most fetch_per_host
+        retrievals at a time from the same host, and yield them in order
+        once retrieved. At most fetch_workers feeds are retrieved ahead of
+        the one being processed, so that only their content is held in
+        memory (each feed drops it once processed).
+        :param executor:
+        '''
+        host_slots = dict()
+        pending = collections.deque()
+        feeds = iter(self._feed)
+
+        while True:
+            for feed in itertools.islice(
+                    feeds, self._settings['fetch_workers'] - len(pending)):
+                host = urllib.parse.urlparse(feed.get_path()).netloc
+                if host not in host_slots:
+                    host_slots[host] = threading.BoundedSemaphore(
+                        self._settings['fetch_per_host'])
+                pending.append((feed, executor.submit(
+                    self._prefetch_feed, feed, host_slots[host])))
+            if not pending:
+                return
+            feed, future = pending.popleft()
+            future.result()
+            yield feed
+
     def _process_feed(self, entry_count, feed):
         '''
         Handle the feed content and publish entries that haven't been
@@ -203,10 +704,20 @@ class FeedSpora:
         :param feed:
         '''
 
-        entry_generator = feed.feed_generator()
+        entry_generator = feed.feed_generator(
+            lambda entry: self.is_published_everywhere(entry, feed))
         if entry_generator:
+            entries = list(entry_generator)
+            pub_items = {self.entry_identifier(entry, feed)
+                         for entry in entries}
+            if feed.is_partially_read():
+                # The entries not read must not be forgotten either
+                self._unread_feeds.add(self.feed_identifier(feed))
+            else:
+                self._feed_windows[self.feed_identifier(feed)] = pub_items
+            self.load_published_entries(entries, feed)
             feed_count = 0
-            for entry in entry_generator:
+            for entry in entries:
                 entry_count += 1
                 feed_count += 1
                 self._publish_entry(entry, entry_count, feed, feed_count)
@@ -223,8 +734,84 @@ class FeedSpora:
                     for client in self._client
                 }
                 self._testing_accumulator[feed.get_path()] = output
+
+            # Only skip this content next time if nothing is left to publish
+            # (posts left to the outbox are delivered without the feed)
+            if all(pub_item in self._published[client_id] or
+                   self._is_left_to_outbox(client_id, pub_item)
+                   for client_id in self._client_ids()
+                   for pub_item in pub_items):
+                validators = dict(feed.get_fetched_validators(),
+                                  clients=self._client_ids())
+            else:
+                validators = None
+            self._store.set_state('feed_validators', feed.get_path(),
+                                  validators)
+            self._save_feed_cursor(feed, entries)
+        else:
+            self._unread_feeds.add(self.feed_identifier(feed))
         return entry_count
 
+    def _prune_store(self, retention_days, window=False):
+        '''
+        Forget published entries older than retention_days (if set) or, if
+        window is set, no longer in their feed. Entries still in a feed are
+        never forgotten, nor entries of feeds which couldn't be read.
+        :param retention_days:
+        :param window:
+        '''
+        pruned = 0
+        if window:
+            for feed_key, pub_items in self._feed_windows.items():
+                pruned += self._store.prune_feed_window(feed_key, pub_items)
+
+        if retention_days:
+            keep_feeds = set(self._unread_feeds)
+            if keep_feeds:
+                # Unread feeds may hold entries stored without their feed
+                keep_feeds.add(None)
+            keep_keys = set().union(*self._feed_windows.values())
+            pruned += self._store.prune_older_than(
+                time.time() - retention_days * DAY,
+                keep_keys=keep_keys, keep_feeds=keep_feeds)
+            # Dead letters expire the same way
+            outbox = self._outbox
+            if outbox is None:
+                outbox = Outbox(self._store, self._settings)
+            dead = outbox.prune_dead(
+                time.time() - retention_days * DAY,
+                lambda key, post: key_item(key) in keep_keys or
+                entry_digest(post['feed']) in keep_feeds)
+            logging.info("Forgot %d dead-lettered posts", dead)
+        logging.info("Forgot %d published entries", pruned)
+
+    def prune(self, retention_days=None, window=False):
+        '''
+        Prune FeedSpora: read the feeds to find out which entries they
+        currently hold, forget the published entries which are no longer
+        needed, then compact the state store. This is safe to run between
+        two runs.
+        :param retention_days: defaults to the retention_days setting
+        :param window:
+        '''
+        if retention_days is None:
+            retention_days = self._settings['retention_days']
+
+        self._init_db()
+        try:
+            for feed in self._feed or []:
+                entry_generator = feed.feed_generator()
+                if entry_generator:
+                    self._feed_windows[self.feed_identifier(feed)] = {
+                        self.entry_identifier(entry, feed)
+                        for entry in entry_generator}
+                else:
+                    self._unread_feeds.add(self.feed_identifier(feed))
+            self._prune_store(retention_days, window)
+            self._store.compact()
+        finally:
+            self._store.close()
+
     def run(self):
         '''
         Run FeedSpora: initialize the database and process the list of
@@ -236,11 +823,64 @@ class FeedSpora:
                 "No client found, aborting publication", exc_info=True)
             return
 
+        # Options are resolved and validated before anything is done
+        for client in self._client:
+            client.get_send_delay()
+            client.get_rate_limiter()
+            for feed in self._feed:
+                client.compile_options(feed)
+
         self._init_db()
 
         entry_count = 0
-        for feed in self._feed:
-            entry_count = self._process_feed(entry_count, feed)
+        if self._settings['post_workers'] > 1:
+            self._post_executor = ThreadPoolExecutor(
+                max_workers=self._settings['post_workers'])
+        try:
+            self._start_schedulers()
+            self._load_short_urls()
+            self._load_rate_limits()
+            self._load_breakers()
+            self._outbox = Outbox(self._store, self._settings)
+            self._deliver_outbox()
+            for feed in self._feed:
+                self._load_feed_validators(feed)
+                self._load_feed_cursor(feed)
+
+            # Feeds are retrieved concurrently, but processed one after
+            # the other, in order
+            with ThreadPoolExecutor(
+                    max_workers=self._settings['fetch_workers']) as executor:
+                if self._settings['fetch_workers'] > 1:
+                    feeds = self._prefetch_feeds(executor)
+                else:
+                    feeds = self._feed
+
+                for feed in feeds:
+                    entry_count = self._process_feed(entry_count, feed)
+                    self._collect_scheduled_posts()
+                    self._deliver_outbox()
+                    self.commit_published_entries()
+                    self._save_short_urls()
+            # Wait for the posts still held by the schedulers
+            self._close_schedulers()
+            if self._settings['retention_days']:
+                self._prune_store(self._settings['retention_days'])
+        finally:
+            # Whatever happens, don't lose what has been posted
+            self._close_schedulers(cancel=True)
+            self.commit_published_entries()
+            self._save_short_urls()
+            self._save_rate_limits()
+            self._save_breakers()
+            self._store.close()
+            self._outbox = None
+            self._breakers = None
+            if self._post_executor:
+                self._post_executor.shutdown()
+                self._post_executor = None
+            http_session.close()
+            media_cache.close()
 
         if self._testing:
             print(json.dumps(self._testing_accumulator, indent=4))
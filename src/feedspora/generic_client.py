@@ -2,23 +2,26 @@
 GenericClient: baseclass providing features to specific clients.
 """
 
-import logging
-import os
-import posixpath
-import re
 import mimetypes
-import urllib.parse
-import urllib.request
-import lxml.html
-import pyshorteners
+import os
+import time
 
-from feedspora.common_config import CommonConfig
+from feedspora import media_cache, url_shortener
+from feedspora.circuit_breaker import CircuitBreakers
+from feedspora.common_config import CommonConfig, PostOptions
+from feedspora.hashtags import add_hashtags, split_ending_tags
+from feedspora.html_text import strip_markup
+from feedspora.rate_limiter import RateLimited, RateLimiter
 
 class GenericClient(CommonConfig):
     ''' Implements the base functionalities expected from clients '''
 
     _testing_root = None
     _testing_output = None
+    # Compiled options, by feed
+    _feed_options = None
+    _rate_limiter = None
+    _circuit_breakers = None
 
     def set_testing_root(self, testing_root):
         '''
@@ -68,17 +71,92 @@ class GenericClient(CommonConfig):
 
         return {"client": self._config['name'], "content": kwargs['text']}
 
-    def resolve_option(self, feed, option):
+    def compile_options(self, feed):
+        '''
+        Resolve and validate the options of the client for a feed once and
+        for all, raising ValueError for invalid options
+        :param feed:
+        '''
+        if self._feed_options is None:
+            self._feed_options = dict()
+        self._feed_options[feed] = PostOptions.compile(
+            self._config, feed.get_config() if feed else None)
+
+        return self._feed_options[feed]
+
+    def get_options(self, feed):
+        '''
+        Return the options (PostOptions) of the client for a feed
+        :param feed:
+        '''
+        if self._feed_options is None or feed not in self._feed_options:
+            return self.compile_options(feed)
+
+        return self._feed_options[feed]
+
+    def get_send_delay(self):
+        '''
+        Return the minimal number of seconds between two posts of the
+        client ('delay' option, 0 when testing), raising ValueError if
+        invalid
+        '''
+        delay = self._config.get('delay') or 0
+        if not isinstance(delay, (int, float)) or isinstance(delay, bool) or \
+           delay < 0:
+            raise ValueError("Invalid delay %r for client %s" %
+                             (delay, self._config.get('name')))
+
+        return 0 if self.is_testing() else delay
+
+    def get_rate_limiter(self):
+        '''
+        Return the rate limiter of the client ('rate_limit' posts per hour,
+        0 for no limit, at most 'rate_limit_burst' at once), raising
+        ValueError if invalid
+        '''
+        if self._rate_limiter is None:
+            rate = self._config.get('rate_limit') or 0
+            burst = self._config.get('rate_limit_burst') or max(int(rate), 1)
+            for option, value in (('rate_limit', rate),
+                                  ('rate_limit_burst', burst)):
+                if not isinstance(value, (int, float)) or \
+                   isinstance(value, bool) or value < 0:
+                    raise ValueError("Invalid %s %r for client %s" %
+                                     (option, value, self._config.get('name')))
+            self._rate_limiter = RateLimiter(rate, burst)
+
+        return self._rate_limiter
+
+    def set_circuit_breakers(self, circuit_breakers):
         '''
-        Resolve a named option between a client and a feed and return the
-        value of that resolved option.
+        Set the circuit breakers shared with the runner
+        :param circuit_breakers:
         '''
+        self._circuit_breakers = circuit_breakers
+
+    def get_circuit_breakers(self):
+        '''
+        Return the circuit breakers of the client, its own if the runner
+        didn't share any
+        '''
+        if self._circuit_breakers is None:
+            self._circuit_breakers = CircuitBreakers()
+
+        return self._circuit_breakers
+
+    def rate_limited(self, error, retry_after=None, reset=None):
+        '''
+        Record that the remote API rejected a call because of its rate limit,
+        and return the RateLimited exception to raise
+        :param error: error raised by the API
+        :param retry_after: number of seconds to wait, if known
+        :param reset: time (epoch) the remote limit resets at, if known
+        '''
+        if retry_after is None and reset:
+            retry_after = max(reset - time.time(), 0)
+        to_return = RateLimited(str(error), retry_after)
+        self.get_rate_limiter().update(retry_after=to_return.retry_after)
 
-        to_return = None
-        if feed and feed.get_config() and option in feed.get_config():
-            to_return = feed.get_config()[option]
-        elif option in self._config:
-            to_return = self._config[option]
         return to_return
 
     def post(self, feed, entry):
@@ -137,60 +215,9 @@ class GenericClient(CommonConfig):
         :param separator:
         '''
 
-        def repl(match):
-            return '%s#%s%s' % (match.group(1), match.group(2), match.group(3))
-
-        # Constants used in regex pattern generation
-        # pylint: disable=anomalous-backslash-in-string
-        before_tag = r'(\A|[\'"/([{\s])'
-        after_tag = r'(\Z|[\'"/\s)\]},.!?:])'
-        # pylint: enable=anomalous-backslash-in-string
-
-        to_return = text
-
-        # Tag order needs to be observed
-        # Set manipulations ignore that, so use lists instead!
-
-        # Find inline and extra tags
-        inline_kw = []
-        extra_kw = []
-
-        for word in tags:
-            # remove any illegal characters
-            word = re.sub(r'[\-\.]', '', word)
-
-            if re.search(
-                    r'%s#?(%s)%s' % (before_tag, re.escape('%s' % word),
-                                     after_tag), to_return, re.IGNORECASE):
-                inline_kw.append(word)
-            else:
-                extra_kw.append(word)
-
-        # Process inline tags
-        for word in inline_kw:
-            pattern = (
-                r'%s(%s)%s' % (before_tag, re.escape('%s' % word), after_tag))
-
-            if re.search(pattern, to_return, re.IGNORECASE):
-                to_return = re.sub(
-                    pattern, repl, to_return, flags=re.IGNORECASE)
-
-        # Add separator and tags, if needed
-        minlen_wo_xtra_kw = len(to_return)
-
-        if extra_kw:
-            fake_separator = separator.replace(' ', '_')
-            to_return += fake_separator
-            minlen_wo_xtra_kw = len(to_return)
-
-            # Add extra (ordered) tags
-            for word in extra_kw:
-                # prevent duplication
-                pattern = (r'%s#(%s)%s' % (before_tag, re.escape('%s' % word),
-                                           after_tag))
-
-                if re.search(pattern, to_return, re.IGNORECASE) is None:
-                    to_return += " #" + word
+        fake_separator = separator.replace(' ', '_')
+        to_return, minlen_wo_xtra_kw, extra_kw = add_hashtags(
+            text, tags, fake_separator)
 
         # If the text is too long, cut it and, if needed, add suffix
         if maxlen is not None:
@@ -237,83 +264,65 @@ class GenericClient(CommonConfig):
     # pylint: enable=no-self-use
 
 
-    # pylint: disable=no-self-use
     def download_media(self, the_url):
         '''
-        Download the media file referenced by the_url
-        Returns the path to the downloaded file
+        Download the media file referenced by the_url, through the media
+        cache shared by all clients
+        Returns the path to the downloaded file (None if it is too large),
+        or raises media_cache.MediaError.
+        When testing, it is reported as $MEDIA_DIR/<name of the file>, so
+        that it doesn't depend on the content of the file.
         :param the_url:
         '''
 
-        def get_filename_from_cd(content_disp):
-            '''
-            Get filename from Content-Disposition
-            :param content_disp:
-            '''
-
-            to_return = None
-
-            if content_disp:
-                fname = re.findall('filename=(.+)', content_disp)
-
-                if fname:
-                    to_return = fname[0]
-
-            return to_return
-
-
-        def get_filename_from_response(the_response):
-            '''
-            Attempt to get the filename from the response
-            :param the_response:
-            '''
-
-            url_parts = urllib.parse.urlparse(the_response.geturl())
-            to_return = posixpath.basename(url_parts.path)
-            # Sanity check
-            if not re.match(r'^[\w-]+\.(jpg|jpeg|gif|png)$',
-                            to_return, re.IGNORECASE):
-                # Nope, "bad" filename
-                logging.error("Invalid media filename '%s' - ignoring",
-                              to_return)
-                to_return = ''
-
-            return to_return
+        to_return = media_cache.fetch(the_url)
+        if to_return and self.is_testing():
+            to_return = os.path.join(os.getenv('MEDIA_DIR', '/tmp'),
+                                     os.path.basename(to_return))
 
-        request = urllib.request.Request(the_url)
-        request.add_header('User-Agent', 'Mozilla/5.0')
-        response = urllib.request.urlopen(request)
-        filename = get_filename_from_cd(
-            request.get_header('Content-Disposition')) or \
-            get_filename_from_response(response) or \
-            'random.jpg'
-
-        media_dir = os.getenv('MEDIA_DIR', '/tmp')
-        full_path = media_dir + '/' + filename
-        logging.info("Downloading %s as %s...", the_url, full_path)
-        with open(full_path, 'wb') as file_chunk:
-            file_chunk.write(response.read())
-
-        return full_path
-    # pylint: enable=no-self-use
+        return to_return
 
     def post_within_limits(self, entry_to_post, feed):
         '''
         Client post entry, as long as within specified limits of both client
-        and feed
+        and feed. Raise CircuitOpen if the circuit breaker of the client is
+        open, or RateLimited if its rate limit doesn't allow it yet. Only
+        the errors of the client API count as failures of the breaker (not
+        those downloading media, for instance).
         :param entry_to_post:
         :param feed:
         '''
         to_return = False
 
         # The client config and feed config need to be taken into
-        # consideration independently; don't use resolve_option
+        # consideration independently, unlike the post options
         post_from_feed = not feed.is_post_limited() or \
                          feed.get_posts_done() < feed.get_config()['max_posts']
         post_to_client = not self.is_post_limited() or \
                          self.get_posts_done() < self.get_config()['max_posts']
         if post_from_feed and post_to_client:
-            to_return = self.post(feed, entry_to_post)
+            breakers = self.get_circuit_breakers()
+            breaker = 'client %s' % self._config.get('name')
+            breakers.check(breaker)
+            wait = self.get_rate_limiter().acquire()
+            if wait:
+                breakers.release(breaker)
+                raise RateLimited("Rate limit of %s reached" %
+                                  self._config['name'], wait)
+            try:
+                to_return = self.post(feed, entry_to_post)
+            except RateLimited:
+                # The remote API is up
+                breakers.succeeded(breaker)
+                raise
+            except media_cache.MediaError:
+                # The remote API wasn't called: says nothing about it
+                breakers.release(breaker)
+                raise
+            except Exception:
+                breakers.failed(breaker)
+                raise
+            breakers.succeeded(breaker)
 
             if to_return:
                 self.increment_posts_done()
@@ -329,7 +338,7 @@ class GenericClient(CommonConfig):
         :param feed_count:
         '''
         # The client config and feed config need to be taken into
-        # consideration independently; don't use resolve_option
+        # consideration independently, unlike the post options
         seed_client = self.get_config()['max_posts'] < 0 and \
                       entry_count + self.get_config()['max_posts'] <= 0
         seed_feed = feed.get_config()['max_posts'] < 0 and \
@@ -344,76 +353,63 @@ class GenericClient(CommonConfig):
         :param feed:
         :param the_url:
         '''
-        to_return = the_url
-        # Default
-        short_options = {'timeout': 3}
-        add_options = self.resolve_option(feed, 'url_shortener_opts')
-        if add_options:
-            short_options.update(add_options)
+        options = self.get_options(feed)
+        if the_url and options.url_shortener:
+            return url_shortener.shorten(options.url_shortener,
+                                         options.url_shortener_opts, the_url)
 
-        url_shortener = self.resolve_option(feed, 'url_shortener')
-        if the_url and url_shortener and url_shortener != 'none':
-            try:
-                shortener = pyshorteners.Shortener(**short_options)
-                # Verify a legal choice
-                # pylint: disable=no-member
-                assert url_shortener in shortener.available_shorteners
-                # pylint: enable=no-member
-                to_return = getattr(shortener, url_shortener).short(the_url)
-                # Sanity check!
-
-                if len(to_return) > len(the_url):
-                    # Not shorter?  You're fired!
-                    raise RuntimeError(
-                        'Shortener %s produced a longer URL ' +
-                        'than the original!', url_shortener)
-            # pylint: disable=broad-except
-            except Exception as exception:
-                # Shortening attempt failed somehow (we don't care how, except
-                # for messaging purposes) - revert to non-shortened link
-
-                if isinstance(exception, AssertionError):
-                    all_shorteners = ' '.join(shortener.available_shorteners)
-                    logging.error('URL shortener %s is unimplemented!',
-                                  url_shortener)
-                    logging.info('Available URL shorteners: %s',
-                                 all_shorteners)
-                else:
-                    logging.error('Cannot shorten URL %s with %s: %s',
-                                  the_url, url_shortener, str(exception))
-                to_return = the_url
-            # pylint: enable=broad-except
+        return the_url
 
-        return to_return
+    def shorten_link(self, feed, entry):
+        '''
+        Return the link of the entry, shortened with shorten_url. The result
+        is shared by the clients with the same shortener options.
+        :param feed:
+        :param entry:
+        '''
+        options = self.get_options(feed)
+        key = ('shorten_url', options.url_shortener,
+               options.url_shortener_opts)
+
+        return entry.get_render(key,
+                                lambda: self.shorten_url(feed, entry.link))
 
     def filter_tags(self, feed, entry):
         '''
         Filter the client/feed-specific tag list and entry tag lists
         (title, content, category) according to the client/feed-specific tag
         filtering options, producing an ordered and size-limited tag list
-        to be used during posting
+        to be used during posting. The result is shared by the clients with
+        the same tag options.
         :param feed:
         :param entry:
         '''
+        options = self.get_options(feed)
+        key = ('filter_tags', options.tags, options.ignore_title,
+               options.ignore_content, options.ignore_category,
+               options.case_sensitive, options.max_tags)
+
+        return list(entry.get_render(
+            key, lambda: self._filter_tags(entry, options)))
+
+    # pylint: disable=no-self-use
+    def _filter_tags(self, entry, options):
+        '''
+        Filter the tags, see filter_tags
+        :param entry:
+        :param options:
+        '''
 
         # First priority: user-defined tags
-        tags_opts = self.resolve_option(feed, 'tags')
-        to_filter = tags_opts[:] if tags_opts else []
+        to_filter = list(options.tags)
         # Next, title tags, if appropriate
-        tag_filter_opts = self.resolve_option(feed, 'tag_filter_opts')
-        if (not (tag_filter_opts and
-                 'ignore_title' in tag_filter_opts)) and \
-           entry.tags['title']:
+        if not options.ignore_title and entry.tags['title']:
             to_filter.extend(entry.tags['title'])
         # Then, content tags, if appropriate
-        if (not (tag_filter_opts and
-                 'ignore_content' in tag_filter_opts)) and \
-           entry.tags['content']:
+        if not options.ignore_content and entry.tags['content']:
             to_filter.extend(entry.tags['content'])
         # Finally, category tags, again if appropriate
-        if (not (tag_filter_opts and
-                 'ignore_category' in tag_filter_opts)) and \
-           entry.tags['category']:
+        if not options.ignore_category and entry.tags['category']:
             to_filter.extend(entry.tags['category'])
 
         # And now we filter.  We NEVER want any duplicates, and that might
@@ -421,19 +417,18 @@ class GenericClient(CommonConfig):
         to_return = []
         non_case_sensitive = []
         for tag in to_filter:
-            if tag_filter_opts and 'case-sensitive' in tag_filter_opts and \
-               tag not in to_return:
+            if options.case_sensitive and tag not in to_return:
                 to_return.append(tag)
-            elif (not (tag_filter_opts and \
-                       'case-sensitive' in  tag_filter_opts)) and \
+            elif not options.case_sensitive and \
                  tag.lower() not in non_case_sensitive:
                 to_return.append(tag)
                 non_case_sensitive.append(tag.lower())
             # We may have all that were specified
-            if len(to_return) >= self.resolve_option(feed, 'max_tags'):
+            if len(to_return) >= options.max_tags:
                 break
 
         return to_return
+    # pylint: enable=no-self-use
 
     def remove_ending_tags(self, feed, content):
         '''
@@ -443,39 +438,50 @@ class GenericClient(CommonConfig):
         :param content:
         '''
 
-        tag_filter_opts = self.resolve_option(feed, 'tag_filter_opts')
-        if content and \
-           (not (tag_filter_opts and 'ignore_content' in tag_filter_opts)):
-            tag_pattern = r'\s+#([\w]+)$'
-            match_result = re.search(tag_pattern, content)
+        if content and not self.get_options(feed).ignore_content:
+            content = split_ending_tags(content)[0]
 
-            while match_result:
-                content = re.sub(tag_pattern, '', content)
-                match_result = re.search(tag_pattern, content)
+        return content
 
-            if re.match(r'^\s*#[\w]+$', content):
-                # Left with a single tag!
-                content = ''
+    def strip_entry_html(self, feed, entry, maxlen=None):
+        '''
+        Strip HTML from the content of the entry with strip_html (None if it
+        has no content). The result is shared by the clients with the same
+        tag filtering options and maxlen.
+        :param feed:
+        :param entry:
+        :param maxlen:
+        '''
+        if not entry.content:
+            return None
+        key = ('strip_html', self.get_options(feed).ignore_content, maxlen)
 
-        return content
+        # The text of the entry is the first stripping step
+        return entry.get_render(
+            key, lambda: self.strip_html(feed, entry.text, maxlen))
 
-    def strip_html(self, feed, before_strip):
+    def strip_html(self, feed, before_strip, maxlen=None):
         '''
-        Strip HTML from the content
+        Strip HTML from the content, and the tags ending it.
+        With maxlen, only the beginning of the content, still longer than
+        maxlen, may be returned: escaped HTML then doesn't need to be parsed
+        as a whole.
         :param feed:
         :param before_strip:
+        :param maxlen:
         '''
 
-        to_return = None
-        # Getting the stripped HTML might take multiple attempts
-        done = False
-        while not done:
-            to_return = lxml.html.fromstring(
-                before_strip).text_content().strip()
-            done = to_return == before_strip
-            if not done:
-                before_strip = to_return
-        # Remove all tags from end of content!
-        to_return = self.remove_ending_tags(feed, to_return)
+        to_return, complete = strip_markup(before_strip, maxlen)
+        if complete:
+            # Remove all tags from end of content!
+            return self.remove_ending_tags(feed, to_return)
+        if self.get_options(feed).ignore_content:
+            return to_return
+
+        # Keep what tags ending the whole content can't take away, knowing
+        # the last tag of the beginning may be cut
+        kept = len(split_ending_tags(to_return.rstrip('#').rstrip())[0])
+        if kept <= maxlen:
+            return self.strip_html(feed, before_strip)
 
-        return to_return
+        return to_return[:kept]
@@ -2,28 +2,351 @@
 GenericFeed: base class providing features to specific feeds.
 """
 
+import datetime
+import email.utils
+import functools
+import hashlib
+import html
+import io
 import logging
 import re
+import threading
+import urllib.parse
 import requests
 import lxml.html
-from bs4 import BeautifulSoup
+from lxml import etree
 
+from feedspora import http_session
+from feedspora.circuit_breaker import CircuitBreakers, CircuitOpen
 from feedspora.common_config import CommonConfig
+from feedspora.hashtags import split_ending_tags
+from feedspora.html_text import html_to_text
 
-# pylint: disable=too-few-public-methods
 class FeedSporaEntry:
     '''
     A FeedSpora entry.
     This class is generated from each entry/item in an Atom/RSS feed,
-    then posted to your client accounts
+    then posted to your client accounts.
+    Derived fields (tags, media_url and text) are computed by the feed the
+    entry comes from on first access, so that entries which are never
+    published cost next to nothing.
     '''
-    title = ''
-    link = ''
-    published_date = None
-    content = ''
-    tags = None
-    media_url = None
-# pylint: enable=too-few-public-methods
+    __slots__ = ('title', 'link', 'guid', 'published_date', 'content',
+                 'categories', '_feed', '_media_sources', '_tags',
+                 '_media_url', '_media_lock', '_text', '_renders')
+
+    def __init__(self, feed=None, media_sources=None):
+        '''
+        Initialize
+        :param feed: feed deriving the fields, None if they are set
+        :param media_sources: see GenericFeed.find_rss_image_url
+        '''
+        self.title = ''
+        self.link = ''
+        # Atom <id> or RSS <guid>
+        self.guid = None
+        self.published_date = None
+        self.content = ''
+        # Tags from the categories of the entry
+        self.categories = []
+        self._feed = feed
+        self._media_sources = media_sources
+        self._tags = None
+        self._media_url = None
+        # Clients posting the entry concurrently find its image only once
+        self._media_lock = None if media_sources is None \
+            else threading.Lock()
+        self._text = None
+        # What clients rendered out of the entry, by rendering options
+        self._renders = None
+
+    @property
+    def tags(self):
+        '''
+        Tags from title, content and categories, each in their own list
+        '''
+        if self._tags is None and self._feed is not None:
+            title_tags, content_tags = self._feed.get_tag_lists(
+                self.title, self.content, self.text)
+            self._tags = {'title': title_tags,
+                          'content': content_tags,
+                          'category': self.categories}
+
+        return self._tags
+
+    @tags.setter
+    def tags(self, tags):
+        self._tags = tags
+
+    @property
+    def media_url(self):
+        '''
+        URL of the image of the entry
+        '''
+        if self._media_sources is not None:
+            with self._media_lock:
+                if self._media_sources is not None:
+                    self._media_url = self._feed.find_rss_image_url(
+                        self._media_sources, self.content, self.link)
+                    self._media_sources = None
+
+        return self._media_url
+
+    @media_url.setter
+    def media_url(self, media_url):
+        self._media_sources = None
+        self._media_url = media_url
+
+    @property
+    def text(self):
+        '''
+        Content stripped of its HTML
+        '''
+        if self._text is None:
+            self._text = html_to_text(self.content)
+
+        return self._text
+
+    def to_dict(self):
+        '''
+        Return the fields of the entry, derived ones included, as a dict
+        JSON can encode
+        '''
+        return {'title': self.title,
+                'link': self.link,
+                'guid': self.guid,
+                'published_date': self.published_date,
+                'content': self.content,
+                'categories': list(self.categories),
+                'tags': self.tags,
+                'media_url': self.media_url,
+               }
+
+    @classmethod
+    def from_dict(cls, fields):
+        '''
+        Return the entry with the specified fields (see to_dict)
+        :param fields:
+        '''
+        entry = cls()
+        for name, value in fields.items():
+            setattr(entry, name, value)
+
+        return entry
+
+    def get_render(self, key, render):
+        '''
+        Return what was rendered out of the entry for key (which includes the
+        options the rendering depends on), calling render() the first time
+        only, so that clients with the same options share the work
+        :param key:
+        :param render:
+        '''
+        if self._renders is None:
+            self._renders = dict()
+        if key not in self._renders:
+            self._renders[key] = render()
+
+        return self._renders[key]
+
+
+# Namespaces of the elements of each kind of feed (or none at all)
+ATOM_NAMESPACES = (None, 'http://www.w3.org/2005/Atom',
+                   'http://purl.org/atom/ns#')
+RSS_NAMESPACES = (None, 'http://purl.org/rss/1.0/',
+                  'http://my.netscape.com/rdf/simple/0.9/')
+# Prefixes of the extension namespaces elements are looked up with
+NAMESPACE_PREFIXES = {'http://search.yahoo.com/mrss/': 'media'}
+# Kind of feed of each entry element
+ENTRY_TAGS = dict(
+    [(etree.QName(namespace, 'entry').text, 'atom')
+     for namespace in ATOM_NAMESPACES] +
+    [(etree.QName(namespace, 'item').text, 'rss')
+     for namespace in RSS_NAMESPACES])
+_element_names = dict()
+# RFC 3339 dates, and the ISO 8601 variants found in the wild
+ISO_DATE_PATTERN = re.compile(
+    r'^(\d{4})-(\d{2})-(\d{2})'
+    r'(?:[Tt ](\d{2}):(\d{2})(?::(\d{2})(?:[.,](\d+))?)?)?'
+    r'\s*(Z|z|[+-]\d{2}:?\d{2})?$')
+
+
+def iter_feed_elements(feed_content):
+    '''
+    Parse the feed incrementally, generating ('atom', entry) or ('rss', item)
+    for each entry element found. Elements are freed once processed, so that
+    large feeds are never held in memory as a whole.
+    :param feed_content:
+    '''
+    encoding = None
+    if isinstance(feed_content, str):
+        # Already decoded, whatever the XML declaration says
+        feed_content = feed_content.strip().encode('utf-8')
+        encoding = 'utf-8'
+
+    elements = etree.iterparse(io.BytesIO(feed_content), events=('end',),
+                               tag=list(ENTRY_TAGS), encoding=encoding,
+                               recover=True, resolve_entities=False,
+                               no_network=True, huge_tree=True)
+    for _, element in elements:
+        yield ENTRY_TAGS[element.tag], element
+
+        # Free the entry, and the elements preceding it
+        element.clear()
+        parent = element.getparent()
+        if parent is not None:
+            while element.getprevious() is not None:
+                del parent[0]
+
+
+def element_name(tag, namespaces):
+    '''
+    Return the name elements with the specified tag are looked up with:
+    lowercased local name for the feed namespaces, prefixed for the known
+    extension namespaces (e.g. 'media:content'), full tag otherwise
+    :param tag:
+    :param namespaces: namespaces of the feed elements
+    '''
+    key = (tag, namespaces)
+    name = _element_names.get(key)
+
+    if name is None:
+        qname = etree.QName(tag)
+        if qname.namespace in namespaces:
+            name = qname.localname.lower()
+        elif qname.namespace in NAMESPACE_PREFIXES:
+            name = NAMESPACE_PREFIXES[qname.namespace] + ':' + \
+                qname.localname.lower()
+        else:
+            name = tag
+        _element_names[key] = name
+
+    return name
+
+
+def scan_entry(entry, namespaces):
+    '''
+    Return the first element of each name (see element_name) found in the
+    entry, and the list of its category elements
+    :param entry:
+    :param namespaces: namespaces of the feed elements
+    '''
+    fields = dict()
+    categories = []
+
+    for element in entry.iterdescendants(tag=etree.Element):
+        name = element_name(element.tag, namespaces)
+        if name == 'category':
+            categories.append(element)
+        if name not in fields:
+            fields[name] = element
+
+    return fields, categories
+
+
+def element_date(kind, element):
+    '''
+    Return the text of the date of an entry element, as read by parse_atom
+    or parse_rss (None if there is none)
+    :param kind: 'atom' or 'rss'
+    :param element:
+    '''
+    if kind == 'atom':
+        names, namespaces = ('updated', 'published'), ATOM_NAMESPACES
+    else:
+        names, namespaces = ('pubdate',), RSS_NAMESPACES
+    found = dict()
+
+    for child in element.iterdescendants(tag=etree.Element):
+        name = element_name(child.tag, namespaces)
+        if name in names and name not in found:
+            found[name] = child
+
+    for name in names:
+        if name in found:
+            return element_text(found[name])
+
+    return None
+
+
+@functools.lru_cache(maxsize=4096)
+def parse_date(text):
+    '''
+    Return the timestamp of an RSS (RFC 822) or Atom (RFC 3339) date, or
+    None if it can't be parsed. Dates without a timezone are taken as UTC.
+    :param text:
+    '''
+    if not text:
+        return None
+    text = text.strip()
+
+    try:
+        date = email.utils.parsedate_to_datetime(text)
+    except (TypeError, ValueError, IndexError):
+        date = None
+
+    if date is None:
+        match_result = ISO_DATE_PATTERN.match(text)
+        if not match_result:
+            return None
+        (year, month, day, hour, minute, second, fraction,
+         offset) = match_result.groups()
+        try:
+            date = datetime.datetime(
+                int(year), int(month), int(day), int(hour or 0),
+                int(minute or 0), int(second or 0),
+                int((fraction or '0')[:6].ljust(6, '0')))
+        except ValueError:
+            return None
+        if offset and offset.upper() != 'Z':
+            delta = datetime.timedelta(hours=int(offset[1:3]),
+                                       minutes=int(offset[-2:]))
+            date = date.replace(tzinfo=datetime.timezone(
+                delta if offset[0] == '+' else -delta))
+
+    if date.tzinfo is None:
+        date = date.replace(tzinfo=datetime.timezone.utc)
+
+    return date.timestamp()
+
+
+def element_text(element):
+    '''
+    Return the text of an element and its descendants ('' for None)
+    :param element:
+    '''
+    if element is None:
+        return ''
+
+    parts = [element.text or '']
+    for child in element:
+        if child.tag is etree.Entity:
+            # Not an XML entity, but possibly an HTML one
+            parts.append(html.unescape(child.text))
+        elif isinstance(child.tag, str):
+            parts.append(element_text(child))
+        parts.append(child.tail or '')
+
+    return ''.join(parts)
+
+
+def anchor_text(text):
+    '''
+    Return the text of the first link found in an HTML text, None if there
+    is none
+    :param text:
+    '''
+    if '<' not in text:
+        return None
+
+    try:
+        fragment = lxml.html.fragment_fromstring(text, create_parent='div')
+    except etree.LxmlError:
+        return None
+    for anchor in fragment.iter('a'):
+        return anchor.text_content()
+
+    return None
 
 
 class GenericFeed(CommonConfig):
@@ -31,8 +354,21 @@ class GenericFeed(CommonConfig):
     Implements the base functionalities expected from feeds.
     '''
     _path = None
-    _ua = "Mozilla/5.0 (X11; Linux x86_64; rv:42.0) Gecko/20100101 " \
-          "Firefox/42.0"
+    # HTTP validators (ETag, Last-Modified and digest of the content) known
+    # from a previous run, and the ones of the last retrieval
+    _validators = None
+    _fetched_validators = None
+    _unchanged = False
+    # Whether the last parsing skipped entries of the feed
+    _partially_read = False
+    # Timestamp at or before which every entry has already been handled
+    _cursor = None
+    # Outcome (content, error) of a retrieval done ahead of feed_generator
+    _prefetched = None
+    # Circuit breakers of the feed hosts, shared with the runner
+    _circuit_breakers = None
+    # Ways of identifying entries in the database of published items
+    entry_identities = ('guid', 'link', 'link_date')
 
     def __init__(self, config):
         '''
@@ -52,6 +388,17 @@ class GenericFeed(CommonConfig):
         # Feed options are an override to client options
         self.set_common_opts(config, is_override=True)
 
+        # Feed-only options
+        if 'entry_identity' not in self._config:
+            self._config['entry_identity'] = 'link_date'
+        elif self._config['entry_identity'] not in self.entry_identities:
+            raise ValueError("Invalid entry_identity '%s' for feed %s" %
+                             (self._config['entry_identity'], self._path))
+        if 'stop_after_published' not in self._config:
+            self._config['stop_after_published'] = 0
+        if 'cursor' not in self._config:
+            self._config['cursor'] = False
+
     def get_path(self):
         '''
         Get the defined path (URL)
@@ -66,11 +413,148 @@ class GenericFeed(CommonConfig):
         return self._config['max_posts'] > 0 and \
                self._posts_done >= self._config['max_posts']
 
-    def retrieve_feed_soup(self, feed_url):
+    def set_validators(self, validators):
+        '''
+        Set the validators of a previous retrieval, so that the feed is only
+        parsed if it changed since then
+        :param validators:
+        '''
+        self._validators = validators
+
+    def get_fetched_validators(self):
+        '''
+        Get the validators of the last retrieval
+        '''
+        return self._fetched_validators
+
+    def is_unchanged(self):
+        '''
+        Return whether the last retrieval found the feed unchanged
+        '''
+        return self._unchanged
+
+    def retrieve_feed_entries(self, feed_url):
         '''
         Retrieve and parse the specified feed.
+        Return None if it didn't change since the retrieval the validators
+        (if set) come from.
+        :param feed_url: can either be a URL or a path to a local file
+        '''
+        feed_content = self.retrieve_feed_content(feed_url)
+
+        return self.parse_feed_content(feed_content)
+
+    def set_cursor(self, cursor):
+        '''
+        Set the cursor: the timestamp at or before which every entry has
+        already been handled (None to read every entry)
+        :param cursor:
+        '''
+        self._cursor = cursor
+
+    def get_cursor(self):
+        '''
+        Get the cursor
+        '''
+        return self._cursor
+
+    def set_circuit_breakers(self, circuit_breakers):
+        '''
+        Set the circuit breakers of the feed hosts, shared with the runner
+        :param circuit_breakers:
+        '''
+        self._circuit_breakers = circuit_breakers
+
+    def get_circuit_breakers(self):
+        '''
+        Return the circuit breakers of the feed hosts, the feed's own if the
+        runner didn't share any
+        '''
+        if self._circuit_breakers is None:
+            self._circuit_breakers = CircuitBreakers()
+
+        return self._circuit_breakers
+
+    def iter_feed_entries(self, feed_content):
+        '''
+        Generate the entries of the retrieved content, in document order
+        (usually newest first). Entries dated at or before the cursor (if
+        set) are skipped before being parsed any further.
+        :param feed_content:
+        '''
+        for kind, element in iter_feed_elements(feed_content):
+            if self._cursor is not None:
+                published = parse_date(element_date(kind, element))
+                if published is not None and published <= self._cursor:
+                    self._partially_read = True
+                    continue
+            if kind == 'atom':
+                yield self.parse_atom(element)
+            else:
+                yield self.parse_rss(element)
+
+    def parse_feed_content(self, feed_content, is_published=None):
+        '''
+        Parse the retrieved content (None if unchanged).
+        Return the list of entries, oldest first.
+        If the stop_after_published option is set, the feed is scanned from
+        its newest entry, and the scan stops after that many consecutive
+        entries is_published() says were already published.
+        :param feed_content:
+        :param is_published:
+        '''
+        self._partially_read = False
+        if feed_content is None:
+            return None
+
+        stop_after = self._config['stop_after_published'] \
+            if is_published else 0
+        entries = []
+        published_run = 0
+        for entry in self.iter_feed_entries(feed_content):
+            entries.append(entry)
+            if stop_after:
+                published_run = published_run + 1 \
+                    if is_published(entry) else 0
+                if published_run >= stop_after:
+                    logging.info("Found %d published entries in a row, "
+                                 "ignoring older entries", published_run)
+                    self._partially_read = True
+                    break
+        entries.reverse()
+
+        return entries
+
+    def is_partially_read(self):
+        '''
+        Return whether the last parsing skipped entries of the feed, either
+        stopping before its end or skipping entries older than the cursor
+        '''
+        return self._partially_read
+
+    def prefetch(self):
+        '''
+        Retrieve the feed content ahead of feed_generator, which can be done
+        from another thread. Errors are raised by feed_generator.
+        '''
+        # pylint: disable=broad-except
+        try:
+            self._prefetched = (self.retrieve_feed_content(self.get_path()),
+                                None)
+        except Exception as error:
+            self._prefetched = (None, error)
+        # pylint: enable=broad-except
+
+    def retrieve_feed_content(self, feed_url):
+        '''
+        Retrieve the content of the specified feed.
+        Return None if it didn't change since the retrieval the validators
+        (if set) come from.
         :param feed_url: can either be a URL or a path to a local file
         '''
+        validators = self._validators or dict()
+        self._fetched_validators = dict()
+        self._unchanged = False
         feed_content = None
         try:
             logging.info("Trying to read %s as a file.", feed_url)
@@ -79,21 +563,55 @@ class GenericFeed(CommonConfig):
         except FileNotFoundError:
             logging.info("File not found.")
             logging.info("Trying to read %s as a URL.", feed_url)
-            response = requests.get(feed_url, headers={'User-Agent': self._ua})
-
-            if not response.ok:
-                raise Exception(feed_content)
+            headers = dict()
+            if validators.get('etag'):
+                headers['If-None-Match'] = validators['etag']
+            if validators.get('last_modified'):
+                headers['If-Modified-Since'] = validators['last_modified']
+            breakers = self.get_circuit_breakers()
+            breaker = 'host %s' % urllib.parse.urlparse(feed_url).netloc
+            breakers.check(breaker)
+            try:
+                response = http_session.get(feed_url, headers=headers)
+            except OSError:
+                breakers.failed(breaker)
+                raise
+            if response.status_code >= 500:
+                breakers.failed(breaker)
+            else:
+                breakers.succeeded(breaker)
+
+            if response.status_code == 304:
+                logging.info("Feed not modified.")
+                self._fetched_validators = validators
+                self._unchanged = True
+                return None
+            response.raise_for_status()
             feed_content = response.text
+            for header, validator in (('ETag', 'etag'),
+                                      ('Last-Modified', 'last_modified')):
+                if response.headers.get(header):
+                    self._fetched_validators[validator] = \
+                        response.headers[header]
         logging.info("Feed read.")
 
-        return BeautifulSoup(feed_content, 'html.parser')
+        # Servers not supporting conditional requests: compare the content
+        self._fetched_validators['digest'] = hashlib.blake2b(
+            feed_content.encode('utf-8'), digest_size=16).hexdigest()
+        if self._fetched_validators['digest'] == validators.get('digest'):
+            logging.info("Feed content unchanged.")
+            self._unchanged = True
+            return None
+
+        return feed_content
 
     # pylint: disable=no-self-use
-    def get_tag_lists(self, title, content):
+    def get_tag_lists(self, title, content, text=None):
         '''
         Determine the list of tags, both from title and content
         :param title:
         :param content:
+        :param text: content stripped of its HTML, if already known
         '''
         title_tags = []
         # Add tags from title
@@ -106,114 +624,115 @@ class GenericFeed(CommonConfig):
         content_tags = []
         if content:
             # Remove tags to improve processing
-            content = lxml.html.fromstring(content).text_content().strip()
-            tag_pattern = r'\s+#([\w]+)$'
-            match_result = re.search(tag_pattern, content)
-
-            while match_result:
-                tag = match_result.group(1)
-
-                if tag not in content_tags:
-                    content_tags.insert(0, tag)
-                content = re.sub(tag_pattern, '', content)
-                match_result = re.search(tag_pattern, content)
-
-            tag_pattern = r'^\s*#([\w]+)$'
-            match_result = re.search(tag_pattern, content)
-            if match_result:
-                # Left with a single tag!
-                tag = match_result.group(1)
-                if tag not in content_tags:
-                    content_tags.insert(0, tag)
-                content = ''
+            content = html_to_text(content) if text is None else text
+            content_tags = split_ending_tags(content)[1]
 
         return title_tags, content_tags
     # pylint: enable=no-self-use
 
-    # Define generator for Atom
-    def parse_atom(self, soup):
+    def parse_atom(self, entry):
         '''
-        Generate FeedSpora entries out of an Atom feed.
-        :param soup:
+        Build a FeedSpora entry out of an Atom entry element.
+        :param entry:
         '''
-
-        for entry in soup.find_all('entry')[::-1]:
-            fse = FeedSporaEntry()
-
-            # Title
-            try:
-                fse.title = BeautifulSoup(
-                    entry.find('title').text, 'html.parser').find('a').text
-            except AttributeError:
-                fse.title = entry.find('title').text
-
-            # Link
-            fse.link = entry.find('link')['href']
-
-            # Content
-            if entry.find('content'):
-                fse.content = entry.find('content').text.strip()
-            # If no content, attempt to use summary
-
-            if not fse.content and entry.find('summary'):
-                fse.content = entry.find('summary').text.strip()
-
-            if fse.content is None:
-                fse.content = ''
-
-            # Tags
-            fse.tags = dict()
-            # Tags from title and content, each in their own list
-            fse.tags['title'], fse.tags['content'] = self.get_tag_lists(
-                fse.title, fse.content)
-
-            # Add tags from category
-            fse.tags['category'] = []
-            for tag in entry.find_all('category'):
-                new_tag = tag['term'].replace(' ', '_').strip()
-                if new_tag not in fse.tags['category']:
-                    fse.tags['category'].append(new_tag)
-
-            # Published_date implementation for Atom
-            if entry.find('updated'):
-                fse.published_date = entry.find('updated').text
-            elif entry.find('published'):
-                fse.published_date = entry.find('published').text
-            yield fse
+        fields, categories = scan_entry(entry, ATOM_NAMESPACES)
+        fse = FeedSporaEntry(self)
+
+        # Title
+        fse.title = element_text(fields.get('title'))
+        title_anchor = anchor_text(fse.title)
+        if title_anchor is not None:
+            fse.title = title_anchor
+
+        # Link
+        if fields.get('link') is not None:
+            fse.link = fields['link'].get('href', '')
+
+        # ID
+        if fields.get('id') is not None:
+            fse.guid = element_text(fields['id']).strip()
+
+        # Content
+        if fields.get('content') is not None:
+            fse.content = element_text(fields['content']).strip()
+        # If no content, attempt to use summary
+
+        if not fse.content and fields.get('summary') is not None:
+            fse.content = element_text(fields['summary']).strip()
+
+        if fse.content is None:
+            fse.content = ''
+
+        # Tags from category (the ones from title and content are derived
+        # from them when needed)
+        for tag in categories:
+            if tag.get('term') is None:
+                continue
+            new_tag = tag.get('term').replace(' ', '_').strip()
+            if new_tag not in fse.categories:
+                fse.categories.append(new_tag)
+
+        # Published_date implementation for Atom
+        if fields.get('updated') is not None:
+            fse.published_date = element_text(fields['updated'])
+        elif fields.get('published') is not None:
+            fse.published_date = element_text(fields['published'])
+
+        return fse
 
     # pylint: disable=no-self-use
-    def find_rss_image_url(self, entry, link):
+    def rss_media_sources(self, fields):
         '''
-        Extract specified image URL, if it exists in the item (entry)
-        :param entry:
+        Return what the image of an item is looked for in, without keeping
+        its elements: (medium, url) of its media:content element, and the
+        texts of its content (or description) element, None for all of its
+        text (then equal to the content of the entry)
+        :param fields: first element of each name found in the item
+        '''
+        media_content = None
+        if fields.get('media:content') is not None:
+            media_content = (fields['media:content'].get('medium'),
+                             fields['media:content'].get('url'))
+
+        texts = ()
+        for name in ('content', 'description'):
+            entity = fields.get(name)
+            if entity is not None:
+                if len(entity):
+                    texts = tuple([entity.text] +
+                                  [child.tail for child in entity])
+                else:
+                    texts = None
+                break
+
+        return media_content, texts
+
+    def find_rss_image_url(self, media_sources, content, link):
+        '''
+        Extract specified image URL, if it exists in the item
+        :param media_sources: see rss_media_sources
+        :param content: content of the entry
         :param link:
         '''
+        media_content, texts = media_sources
+        if texts is None:
+            texts = (content,)
 
-        def content_img_src(entity):
-            result = None
+        to_return = None
 
+        if media_content and media_content[0] == 'image':
+            to_return = media_content[1]
+        else:
             compiled_pattern = re.compile(r'<img [^>]*src=["\']([^"\']+)["\']')
 
-            for content in entity.contents:
-                img_tag = compiled_pattern.search(content)
+            for text in texts:
+                img_tag = compiled_pattern.search(text or '')
 
                 if img_tag:
-                    result = img_tag.group(1)
+                    to_return = img_tag.group(1)
 
                     break
 
-            return result
-
-        to_return = None
-
-        if entry.find('media:content') and \
-           entry.find('media:content')['medium'] == 'image':
-            to_return = entry.find('media:content')['url']
-        elif entry.find('content'):
-            to_return = content_img_src(entry.find('content'))
-        elif entry.find('description'):
-            to_return = content_img_src(entry.find('description'))
-
         if to_return and link:
             tag_pattern = r'^(https?://[^/]+)/'
             match_result = re.search(tag_pattern, to_return)
@@ -233,62 +752,69 @@ class GenericFeed(CommonConfig):
         return to_return
     # pylint: enable=no-self-use
 
-    # Define generator for RSS
-    def parse_rss(self, soup):
+    def parse_rss(self, item):
         '''
-        Generate FeedSpora entries out of an RSS feed.
-        :param soup:
+        Build a FeedSpora entry out of an RSS item element.
+        :param item:
         '''
+        fields, categories = scan_entry(item, RSS_NAMESPACES)
+        fse = FeedSporaEntry(self, self.rss_media_sources(fields))
 
-        for entry in soup.find_all('item')[::-1]:
-            fse = FeedSporaEntry()
-
-            # Title
-            fse.title = entry.find('title').text
+        # Title
+        fse.title = element_text(fields.get('title'))
 
-            # Link
-            fse.link = entry.find('link').text
+        # Link
+        fse.link = element_text(fields.get('link'))
 
-            # Content takes priority over Description
+        # GUID
+        if fields.get('guid') is not None:
+            fse.guid = element_text(fields['guid']).strip()
 
-            if entry.find('content'):
-                fse.content = entry.find('content')[0].text.strip()
-            else:
-                fse.content = entry.find('description').text.strip()
+        # Content takes priority over Description
 
-            # PubDate
-            fse.published_date = entry.find('pubdate').text
+        if fields.get('content') is not None:
+            fse.content = element_text(fields['content']).strip()
+        else:
+            fse.content = element_text(fields.get('description')).strip()
 
-            fse.tags = dict()
-            # Tags from title and content, each in their own list
-            fse.tags['title'], fse.tags['content'] = self.get_tag_lists(
-                fse.title, fse.content)
+        # PubDate
+        if fields.get('pubdate') is not None:
+            fse.published_date = element_text(fields['pubdate'])
 
-            # Add tags from category
-            fse.tags['category'] = []
-            for tag in entry.find_all('category'):
-                new_tag = tag.text.replace(' ', '_').strip()
+        # Tags from category (the ones from title and content are derived
+        # from them when needed)
+        for tag in categories:
+            new_tag = element_text(tag).replace(' ', '_').strip()
 
-                if new_tag not in fse.tags['category']:
-                    fse.tags['category'].append(new_tag)
+            if new_tag not in fse.categories:
+                fse.categories.append(new_tag)
 
-            # And for our final act, media
-            fse.media_url = self.find_rss_image_url(entry, fse.link)
-            yield fse
+        return fse
 
-    def feed_generator(self):
+    def feed_generator(self, is_published=None):
         '''
         Handle RSS/Atom feed
         Sets up a generator for the feed content
-        :param feed:
+        :param is_published: see parse_feed_content
         '''
         to_return = None
         # get feed content
         feed_url = self.get_path()
         try:
-            soup = self.retrieve_feed_soup(feed_url)
-        except (requests.exceptions.ConnectionError, ValueError,
-                OSError) as error:
+            if self._prefetched:
+                feed_content, error = self._prefetched
+                self._prefetched = None
+                if error:
+                    raise error
+            else:
+                feed_content = self.retrieve_feed_content(feed_url)
+            entries = self.parse_feed_content(feed_content, is_published)
+        except CircuitOpen as error:
+            logging.warning("Skipping feed %s: %s", feed_url, format(error))
+            return to_return
+        except (requests.exceptions.ConnectionError,
+                requests.exceptions.HTTPError, ValueError, OSError,
+                etree.LxmlError) as error:
             logging.error(
                 "Error while reading feed at %s: %s",
                 feed_url,
@@ -296,11 +822,12 @@ class GenericFeed(CommonConfig):
                 exc_info=True)
             return to_return
 
-        # Choose which generator to use, or abort.
-        if soup.find('entry'):
-            to_return = self.parse_atom(soup)
-        elif soup.find('item'):
-            to_return = self.parse_rss(soup)
+        if entries is None:
+            logging.info("Skipping unchanged feed %s", feed_url)
+            return to_return
+
+        if entries:
+            to_return = iter(entries)
         else:
             print("No entry/item found in %s" % feed_url)
         return to_return
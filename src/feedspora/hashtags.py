@@ -0,0 +1,287 @@
+"""
+Hashtags: turn the words of a text matching tags into hashtags, and append
+the remaining tags after it, or split the hashtags ending a text off it.
+
+Tags are looked up in a single pass over the words of the text, whatever
+the number of tags. Texts and tags this can't handle exactly like the
+original regular expressions (tags made of delimiters, characters whose
+case folding differs between str.lower() and re.IGNORECASE) go through the
+regular expressions instead, so that the result is the same either way.
+"""
+
+import re
+
+# Constants used in regex pattern generation
+# pylint: disable=anomalous-backslash-in-string
+BEFORE_TAG = r'(\A|[\'"/([{\s])'
+AFTER_TAG = r'(\Z|[\'"/\s)\]},.!?:])'
+# pylint: enable=anomalous-backslash-in-string
+
+_ILLEGAL_CHARS = re.compile(r'[\-\.]')
+_BEFORE_CHAR = re.compile(r'[\'"/([{\s]')
+_AFTER_CHAR = re.compile(r'[\'"/\s)\]},.!?:]')
+# Characters delimiting the words of a text
+_DELIMITERS = re.compile(r'[\'"/([{\s)\]},.!?:#]')
+# Strings whose characters compare the same case-insensitively with
+# str.lower() and with re.IGNORECASE (checked for every pair of them): all
+# but the characters lowercased to several characters (U+0130), or matching
+# other lowercase characters with re.IGNORECASE (micro sign, dotless i,
+# long s, Greek symbol variants, old Cyrillic variants, ligatures...)
+_FOLD_SAFE = re.compile('[^\u00b5\u0130\u0131\u017f\u0345\u0390\u03b0'
+                        '\u03c2\u03d0\u03d1\u03d5\u03d6\u03f0\u03f1\u03f5'
+                        '\u1c80-\u1c88\u1e9b\u1fbe\u1fd3\u1fe3\ufb05\ufb06]*')
+
+
+def add_hashtags(text, tags, separator):
+    '''
+    Prefix the words of text matching a tag (case-insensitively) with '#',
+    then append the other tags, not already there as hashtags, after the
+    separator.
+    Return the new text, its length up to the separator, and whether tags
+    were appended.
+    :param text:
+    :param tags:
+    :param separator:
+    '''
+
+    # remove any illegal characters
+    words = [_ILLEGAL_CHARS.sub('', word) for word in tags]
+
+    if _FOLD_SAFE.fullmatch(text) and _FOLD_SAFE.fullmatch(separator) and \
+            all(word and _FOLD_SAFE.fullmatch(word) and
+                not _DELIMITERS.search(word) for word in words):
+        return _add_hashtags_single_pass(text, words, separator)
+
+    return _add_hashtags_regex(text, words, separator)
+
+
+def _add_hashtags_regex(text, words, separator):
+    '''
+    add_hashtags() with one regular expression per tag
+    :param text:
+    :param words:
+    :param separator:
+    '''
+
+    def repl(match):
+        return '%s#%s%s' % (match.group(1), match.group(2), match.group(3))
+
+    to_return = text
+
+    # Tag order needs to be observed
+    # Set manipulations ignore that, so use lists instead!
+
+    # Find inline and extra tags
+    inline_kw = []
+    extra_kw = []
+
+    for word in words:
+        if re.search(
+                r'%s#?(%s)%s' % (BEFORE_TAG, re.escape('%s' % word),
+                                 AFTER_TAG), to_return, re.IGNORECASE):
+            inline_kw.append(word)
+        else:
+            extra_kw.append(word)
+
+    # Process inline tags
+    for word in inline_kw:
+        pattern = (
+            r'%s(%s)%s' % (BEFORE_TAG, re.escape('%s' % word), AFTER_TAG))
+
+        if re.search(pattern, to_return, re.IGNORECASE):
+            to_return = re.sub(
+                pattern, repl, to_return, flags=re.IGNORECASE)
+
+    # Add separator and tags, if needed
+    minlen_wo_xtra_kw = len(to_return)
+
+    if extra_kw:
+        to_return += separator
+        minlen_wo_xtra_kw = len(to_return)
+
+        # Add extra (ordered) tags
+        for word in extra_kw:
+            # prevent duplication
+            pattern = (r'%s#(%s)%s' % (BEFORE_TAG, re.escape('%s' % word),
+                                       AFTER_TAG))
+
+            if re.search(pattern, to_return, re.IGNORECASE) is None:
+                to_return += " #" + word
+
+    return to_return, minlen_wo_xtra_kw, bool(extra_kw)
+
+
+def _words(text):
+    '''
+    Return the (start, end) positions of the words of text, i.e. of the runs
+    of characters between delimiters
+    :param text:
+    '''
+
+    to_return = []
+    start = 0
+    for match in _DELIMITERS.finditer(text):
+        if match.start() > start:
+            to_return.append((start, match.start()))
+        start = match.end()
+    if start < len(text):
+        to_return.append((start, len(text)))
+
+    return to_return
+
+
+def _hashtags(text):
+    '''
+    Return the set of the (lowercase) hashtags of text, as matched by
+    BEFORE_TAG + '#' + tag + AFTER_TAG
+    :param text:
+    '''
+
+    folded = text.lower()
+    to_return = set()
+    for start, end in _words(text):
+        if start and text[start - 1] == '#' and \
+                (start == 1 or _BEFORE_CHAR.match(text, start - 2)) and \
+                (end == len(text) or _AFTER_CHAR.match(text, end)):
+            to_return.add(folded[start:end])
+
+    return to_return
+
+
+def _add_hashtags_single_pass(text, words, separator):
+    '''
+    add_hashtags() with a dictionary lookup of the words of the text, for
+    tags made of characters other than delimiters.
+    Such tags always match whole words. Like re.sub(), each tag only
+    matches words whose preceding delimiter wasn't the delimiter following
+    its previous match.
+    :param text:
+    :param words:
+    :param separator:
+    '''
+
+    folded = text.lower()
+    positions = _words(text)
+
+    # Words followed by a delimiter allowed after a tag, by lowercase text,
+    # and those also preceded by a delimiter allowed before a tag
+    candidates = {}
+    taggable = set()
+    hashtags = set()
+    for index, (start, end) in enumerate(positions):
+        if end < len(text) and not _AFTER_CHAR.match(text, end):
+            continue
+        key = folded[start:end]
+        candidates.setdefault(key, []).append(index)
+        if start == 0 or _BEFORE_CHAR.match(text, start - 1):
+            taggable.add(index)
+        elif text[start - 1] == '#' and \
+                (start == 1 or _BEFORE_CHAR.match(text, start - 2)):
+            hashtags.add(key)
+
+    # Find inline and extra tags
+    inline_kw = []
+    extra_kw = []
+    for word in words:
+        key = word.lower()
+        if key in hashtags or \
+                any(index in taggable for index in candidates.get(key, ())):
+            inline_kw.append(key)
+        else:
+            extra_kw.append(word)
+
+    # Process inline tags
+    tagged = []
+    for key in inline_kw:
+        # Position of the delimiter consumed by the previous match
+        consumed = -1
+        for index in candidates.get(key, ()):
+            start, end = positions[index]
+            if index in taggable and (start == 0 or start - 1 > consumed):
+                taggable.discard(index)
+                tagged.append(start)
+                consumed = end
+
+    to_return = text
+    if tagged:
+        tagged.sort()
+        chunks = []
+        previous = 0
+        for start in tagged:
+            chunks.append(text[previous:start])
+            chunks.append('#')
+            previous = start
+        chunks.append(text[previous:])
+        to_return = ''.join(chunks)
+
+    # Add separator and tags, if needed
+    minlen_wo_xtra_kw = len(to_return)
+
+    if extra_kw:
+        to_return += separator
+        minlen_wo_xtra_kw = len(to_return)
+
+        # Add extra (ordered) tags, unless already there as hashtags
+        hashtags = _hashtags(to_return)
+        extra = []
+        for word in extra_kw:
+            key = word.lower()
+            if key not in hashtags:
+                hashtags.add(key)
+                extra.append(" #" + word)
+        to_return += ''.join(extra)
+
+    return to_return, minlen_wo_xtra_kw, bool(extra_kw)
+
+
+def _is_word_char(char):
+    '''
+    Whether char is a word character, as matched by \\w
+    :param char:
+    '''
+    return char.isalnum() or char == '_'
+
+
+def split_ending_tags(content):
+    r'''
+    Split the hashtags ending content ("... #tag1 #tag2") off it, scanning
+    it backward once. This gives the same result as removing
+    r'\s+#(\w+)$' from content until it no longer matches, then emptying
+    it if it matches r'^\s*#(\w+)$' (a single tag).
+    Return the content without its ending tags, and these tags, in order
+    and without duplicates (the last occurrence of a tag is kept).
+    :param content:
+    '''
+
+    found = []
+    # '$' also matches before a newline ending the content, which is kept
+    newline = content.endswith('\n')
+    end = len(content) - 1 if newline else len(content)
+
+    while True:
+        start = end
+        while start and _is_word_char(content[start - 1]):
+            start -= 1
+        if start == end or not start or content[start - 1] != '#':
+            break
+        before = start - 1
+        while before and content[before - 1].isspace():
+            before -= 1
+        if before == start - 1:
+            if before == 0:
+                # Left with a single tag!
+                found.append(content[start:end])
+                content, end, newline = '', 0, False
+            break
+        found.append(content[start:end])
+        end = before
+
+    tags = []
+    seen = set()
+    for tag in found:
+        if tag not in seen:
+            seen.add(tag)
+            tags.append(tag)
+    tags.reverse()
+
+    return content[:end] + ('\n' if newline else ''), tags
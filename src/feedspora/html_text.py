@@ -0,0 +1,168 @@
+"""
+HTML to text: the text of HTML contents, collected while parsing them (no
+document tree is built). It is the text lxml's text_content() gives, except
+that line breaks (<br>) and block elements (paragraphs, list items...) are
+turned into newlines, instead of gluing the text around them together.
+"""
+
+import re
+
+from lxml import etree
+
+# Characters text can't contain to be its own text when parsed as HTML
+MARKUP_CHARS = re.compile('[<&\r\x00\ud800-\udfff]')
+# Number of characters fed to the parser at once
+CHUNK_SIZE = 16384
+# Number of newlines separating the text of block elements from the text
+# around them
+BLOCK_BREAKS = {
+    'address': 2, 'article': 2, 'aside': 2, 'blockquote': 2, 'dd': 1,
+    'div': 1, 'dl': 2, 'dt': 1, 'figcaption': 1, 'figure': 2, 'footer': 2,
+    'h1': 2, 'h2': 2, 'h3': 2, 'h4': 2, 'h5': 2, 'h6': 2, 'header': 2,
+    'hr': 2, 'li': 1, 'main': 2, 'nav': 2, 'ol': 2, 'p': 2, 'pre': 2,
+    'section': 2, 'table': 2, 'tr': 1, 'ul': 2,
+}
+
+
+class _TextTarget:
+    '''
+    Parser target collecting the text of a document
+    '''
+
+    def __init__(self):
+        '''
+        Initialize
+        '''
+        self.parts = []
+        self.size = 0
+        # Newlines to add before the next text, if any
+        self.breaks = 0
+
+    def _add_breaks(self, number, line_break=False):
+        '''
+        Separate the text collected so far from the next one by number
+        newlines, or by one more newline for a line break. The whitespace
+        around them is dropped.
+        :param number:
+        :param line_break:
+        '''
+        if not self.parts:
+            return
+        if not self.breaks:
+            while self.parts and not self.parts[-1].strip():
+                self.size -= len(self.parts.pop())
+            if self.parts:
+                stripped = self.parts[-1].rstrip()
+                self.size -= len(self.parts[-1]) - len(stripped)
+                self.parts[-1] = stripped
+        self.breaks = self.breaks + 1 if line_break else \
+            max(self.breaks, number)
+
+    def start(self, tag, attrib):
+        '''
+        Turn a line break or the start of a block element into newlines
+        :param tag:
+        :param attrib:
+        '''
+        # pylint: disable=unused-argument
+        if tag == 'br':
+            self._add_breaks(1, True)
+        elif tag in BLOCK_BREAKS:
+            self._add_breaks(BLOCK_BREAKS[tag])
+        # pylint: enable=unused-argument
+
+    def end(self, tag):
+        '''
+        Turn the end of a block element into newlines
+        :param tag:
+        '''
+        if tag in BLOCK_BREAKS:
+            self._add_breaks(BLOCK_BREAKS[tag])
+
+    def data(self, data):
+        '''
+        Collect text
+        :param data:
+        '''
+        if self.breaks:
+            data = data.lstrip()
+            if not data:
+                return
+            data = '\n' * self.breaks + data
+            self.breaks = 0
+        self.parts.append(data)
+        self.size += len(data)
+
+    def close(self):
+        '''
+        Return the text collected
+        '''
+        return ''.join(self.parts)
+
+
+def parse_html_text(content, maxlen=None, complete=True):
+    '''
+    Return the text of an HTML content, and whether it is the whole text.
+    With maxlen, parsing stops once more than maxlen characters of text were
+    collected, and only the beginning of the text is returned.
+    If content is only the beginning of a document (complete is False), so
+    is the text: only the text the parser is sure of is returned.
+    :param content:
+    :param maxlen:
+    :param complete:
+    '''
+    target = _TextTarget()
+    if not content:
+        return '', complete
+
+    parser = etree.HTMLParser(target=target)
+    for start in range(0, len(content), CHUNK_SIZE):
+        parser.feed(content[start:start + CHUNK_SIZE])
+        if maxlen is not None and target.size > maxlen:
+            return target.close(), False
+    if not complete:
+        return target.close(), False
+
+    return parser.close(), True
+
+
+def html_to_text(content):
+    '''
+    Return the text of an HTML content, stripped
+    :param content:
+    '''
+    return parse_html_text(content)[0].strip()
+
+
+def strip_markup(text, maxlen=None):
+    '''
+    Parse text as HTML again as long as it looks like markup (escaped HTML),
+    and return it stripped, along with whether this is all of it.
+    With maxlen, parsing may stop early: only the beginning of the text,
+    more than maxlen characters long, is then returned, unless there isn't
+    enough text known for sure (then the whole text is returned).
+    :param text:
+    :param maxlen:
+    '''
+    complete = True
+    to_return = text
+    while MARKUP_CHARS.search(to_return):
+        stripped, complete = parse_html_text(to_return, maxlen, complete)
+        stripped = stripped.strip() if complete else stripped.lstrip()
+        if not complete and len(stripped) <= maxlen:
+            # Start over, parsing everything
+            return strip_markup(text)
+        if stripped == to_return:
+            break
+        to_return = stripped
+
+    if complete:
+        # Text without markup is its own text
+        return to_return.strip(), True
+
+    # The whole text may end with whitespace only
+    to_return = to_return.rstrip()
+    if len(to_return) <= maxlen:
+        return strip_markup(text)
+
+    return to_return, False
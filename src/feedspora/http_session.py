@@ -0,0 +1,88 @@
+"""
+HTTP session shared by everything FeedSpora retrieves itself (feeds, media
+and article contents), so that connections to the same hosts are kept alive
+and reused.
+"""
+
+import logging
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from feedspora.common_config import runner_settings
+
+USER_AGENT = "Mozilla/5.0 (X11; Linux x86_64; rv:42.0) Gecko/20100101 " \
+             "Firefox/42.0"
+
+_DEFAULTS = {'http_timeout': 30,
+             'http_pool_hosts': 10,
+             'http_pool_size': 4,
+             'user_agent': USER_AGENT,
+            }
+_settings = dict(_DEFAULTS)
+_session = None
+_lock = threading.Lock()
+
+
+def configure(settings):
+    '''
+    Set the HTTP settings (timeout in seconds, number of hosts and of
+    connections per host kept in the pool, User-Agent), and start over with
+    a new session
+    :param settings:
+    '''
+    _settings.update(runner_settings(settings, _DEFAULTS))
+    close()
+
+
+def get_settings():
+    '''
+    Return the HTTP settings in use (see configure)
+    '''
+    return dict(_settings)
+
+
+def get_session():
+    '''
+    Return the shared session, creating it if needed
+    '''
+    global _session  # pylint: disable=global-statement
+
+    with _lock:
+        if _session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=_settings['http_pool_hosts'],
+                                  pool_maxsize=_settings['http_pool_size'])
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            # Accept-Encoding is left to requests: gzip and deflate, and br
+            # since brotli is in the requirements
+            session.headers['User-Agent'] = _settings['user_agent']
+            _session = session
+            logging.debug("HTTP session created.")
+
+        return _session
+
+
+def get(url, **kwargs):
+    '''
+    GET url with the shared session and the default timeout
+    :param url:
+    :param kwargs: passed on to requests
+    '''
+    kwargs.setdefault('timeout', _settings['http_timeout'])
+
+    return get_session().get(url, **kwargs)
+
+
+def close():
+    '''
+    Close the shared session and its pooled connections
+    '''
+    global _session  # pylint: disable=global-statement
+
+    with _lock:
+        if _session is not None:
+            _session.close()
+            _session = None
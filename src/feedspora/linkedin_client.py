@@ -48,26 +48,26 @@ class LinkedInClient(GenericClient):
         :param feed:
         :param entry:
         '''
-        stripped_html = self.strip_html(feed, entry.content) \
-                        if entry.content else None
+        options = self.get_options(feed)
+        stripped_html = self.strip_entry_html(feed, entry, 700)
         raw_contents = entry.title
-        if self.resolve_option(feed, 'post_include_content') and stripped_html:
+        if options.post_include_content and stripped_html:
             raw_contents += ': '+stripped_html
-        comment = self.resolve_option(feed, 'post_prefix') + \
+        comment = options.post_prefix + \
                   self._mkrichtext(raw_contents, self.filter_tags(feed, entry),
                                    maxlen=700) + \
-                  self.resolve_option(feed, 'post_suffix')
+                  options.post_suffix
         # Just in case...
         comment = comment.strip()
 
         post_args = {'comment': comment,
                      'title': self._trim_string(entry.title, 200),
                      'description': self._trim_string(entry.title, 256),
-                     'submitted_url': self.shorten_url(feed, entry.link),
+                     'submitted_url': self.shorten_link(feed, entry),
                      'submitted_image_url': None,
                      'visibility_code': self._visibility
                      }
-        if self.resolve_option(feed, 'post_include_media') and entry.media_url:
+        if options.post_include_media and entry.media_url:
             post_args['submitted_image_url'] = entry.media_url
 
         to_return = False
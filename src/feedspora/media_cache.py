@@ -0,0 +1,272 @@
+"""
+Media cache: media files downloaded to be posted, shared by all clients and
+kept from one run to the next.
+
+Files are stored under $MEDIA_DIR/feedspora-media, in a directory named
+after the hash of their content (keeping their own name), and indexed by
+URL. A media downloaded during a run isn't downloaded again during that
+run, and is only downloaded again during later runs if it was modified
+(conditional requests). The least recently used files are evicted at the
+end of each run, once too old or beyond the size of the cache.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import posixpath
+import re
+import shutil
+import tempfile
+import threading
+import time
+import urllib.parse
+
+from feedspora import http_session
+from feedspora.common_config import runner_settings
+
+CACHE_DIRNAME = 'feedspora-media'
+INDEX_FILENAME = 'index.json'
+DEFAULT_FILENAME = 'random.jpg'
+MEGABYTE = 1024 * 1024
+DAY = 86400
+
+_DEFAULTS = {'media_cache_size': 100,
+             'media_max_size': 10,
+             'media_max_age': 30,
+            }
+_settings = dict(_DEFAULTS)
+# Index of the cache, media downloaded during this run (by URL) and locks
+# preventing several clients from downloading the same media at once
+_index = None
+_fetched = {}
+_url_locks = {}
+_lock = threading.Lock()
+
+
+class MediaError(Exception):
+    '''
+    A media file couldn't be downloaded
+    '''
+
+
+def configure(settings):
+    '''
+    Set the cache settings (size of the cache and largest media in MB,
+    number of days unused media are kept), and start over with a new run
+    :param settings:
+    '''
+    _settings.update(runner_settings(settings, _DEFAULTS))
+    close()
+
+
+def get_cache_dir():
+    '''
+    Return the directory of the cache
+    '''
+    return os.path.join(os.getenv('MEDIA_DIR', '/tmp'), CACHE_DIRNAME)
+
+
+def _get_index():
+    '''
+    Return the index of the cache, loading it if needed (with _lock held)
+    '''
+    global _index  # pylint: disable=global-statement
+
+    if _index is None:
+        _index = {'urls': {}, 'files': {}}
+        try:
+            with open(os.path.join(get_cache_dir(), INDEX_FILENAME)) as fp:
+                _index = json.load(fp)
+        except FileNotFoundError:
+            pass
+        except ValueError:
+            logging.warning("Invalid media cache index, starting over")
+        # Forget the files removed behind our back
+        _index['files'] = {
+            digest: info for digest, info in _index['files'].items()
+            if os.path.exists(os.path.join(get_cache_dir(), info['path']))}
+
+    return _index
+
+
+def media_filename(response):
+    '''
+    Return a safe name for the media file retrieved with response
+    :param response:
+    '''
+    names = []
+    content_disp = response.headers.get('Content-Disposition')
+    if content_disp:
+        names += [posixpath.basename(name.strip('"\' '))
+                  for name in re.findall('filename=(.+)', content_disp)]
+    names.append(posixpath.basename(
+        urllib.parse.urlparse(response.url).path))
+
+    for name in names:
+        # Sanity check
+        if re.match(r'^[\w-]+\.(jpg|jpeg|gif|png)$', name, re.IGNORECASE):
+            return name
+    logging.error("Invalid media filename '%s' - ignoring", names[-1])
+
+    return DEFAULT_FILENAME
+
+
+def fetch(url):
+    '''
+    Return the path to the media file referenced by url, downloading it if
+    needed, or None if it is too large. Raise MediaError if it can't be
+    downloaded.
+    :param url:
+    '''
+    with _lock:
+        url_lock = _url_locks.setdefault(url, threading.Lock())
+
+    with url_lock:
+        with _lock:
+            if url in _fetched:
+                return _fetched[url]
+        try:
+            path = _download(url)
+        except OSError as error:
+            raise MediaError("Cannot download %s: %s" % (url, error)) \
+                from error
+        with _lock:
+            _fetched[url] = path
+
+    return path
+
+
+def _download(url):
+    '''
+    Download the media file referenced by url, unless the cached one is
+    still valid, and return its path (None if it is too large)
+    :param url:
+    '''
+    with _lock:
+        index = _get_index()
+        cached = index['urls'].get(url)
+        if cached and cached['hash'] not in index['files']:
+            cached = None
+
+    headers = {}
+    if cached and cached.get('etag'):
+        headers['If-None-Match'] = cached['etag']
+    if cached and cached.get('last_modified'):
+        headers['If-Modified-Since'] = cached['last_modified']
+
+    max_size = _settings['media_max_size'] * MEGABYTE
+    with http_session.get(url, stream=True, headers=headers) as response:
+        if cached and response.status_code == 304:
+            logging.info("Media %s not modified", url)
+            return _use(cached['hash'])
+        response.raise_for_status()
+        if int(response.headers.get('Content-Length') or 0) > max_size:
+            logging.error("Media %s larger than %d MB - ignoring", url,
+                          _settings['media_max_size'])
+            return None
+        filename = media_filename(response)
+
+        os.makedirs(get_cache_dir(), exist_ok=True)
+        digest = hashlib.sha256()
+        size = 0
+        with tempfile.NamedTemporaryFile(dir=get_cache_dir(),
+                                         prefix='.download-',
+                                         delete=False) as tmp_file:
+            logging.info("Downloading %s...", url)
+            for chunk in response.iter_content(chunk_size=65536):
+                size += len(chunk)
+                if size > max_size:
+                    break
+                digest.update(chunk)
+                tmp_file.write(chunk)
+        if size > max_size:
+            os.remove(tmp_file.name)
+            logging.error("Media %s larger than %d MB - ignoring", url,
+                          _settings['media_max_size'])
+            return None
+
+        with _lock:
+            index['urls'][url] = {
+                'hash': digest.hexdigest(),
+                'etag': response.headers.get('ETag'),
+                'last_modified': response.headers.get('Last-Modified')}
+
+    return _store(tmp_file.name, digest.hexdigest(), filename, size)
+
+
+def _store(tmp_path, digest, filename, size):
+    '''
+    Store the downloaded file in the cache, unless it already holds the
+    same content, and return its path
+    :param tmp_path:
+    :param digest:
+    :param filename:
+    :param size:
+    '''
+    with _lock:
+        index = _get_index()
+        if digest in index['files']:
+            os.remove(tmp_path)
+        else:
+            path = os.path.join(digest[:16], filename)
+            os.makedirs(os.path.join(get_cache_dir(), digest[:16]),
+                        exist_ok=True)
+            os.replace(tmp_path, os.path.join(get_cache_dir(), path))
+            index['files'][digest] = {'path': path, 'size': size}
+
+    return _use(digest)
+
+
+def _use(digest):
+    '''
+    Mark the cached file as used, and return its path
+    :param digest:
+    '''
+    with _lock:
+        info = _get_index()['files'][digest]
+        info['used'] = time.time()
+
+        return os.path.join(get_cache_dir(), info['path'])
+
+
+def _evict(index):
+    '''
+    Remove the least recently used files, as long as they are too old or
+    the cache is too large
+    :param index:
+    '''
+    max_size = _settings['media_cache_size'] * MEGABYTE
+    oldest = time.time() - _settings['media_max_age'] * DAY
+    total = sum(info['size'] for info in index['files'].values())
+
+    for digest, info in sorted(index['files'].items(),
+                               key=lambda item: item[1].get('used', 0)):
+        if total <= max_size and info.get('used', 0) >= oldest:
+            break
+        shutil.rmtree(os.path.join(get_cache_dir(), digest[:16]),
+                      ignore_errors=True)
+        del index['files'][digest]
+        total -= info['size']
+
+    index['urls'] = {url: cached for url, cached in index['urls'].items()
+                     if cached['hash'] in index['files']}
+
+
+def close():
+    '''
+    Evict what needs to be from the cache and save its index, if anything
+    was done with it during this run
+    '''
+    global _index  # pylint: disable=global-statement
+
+    with _lock:
+        if _index is not None and os.path.isdir(get_cache_dir()):
+            _evict(_index)
+            index_path = os.path.join(get_cache_dir(), INDEX_FILENAME)
+            with open(index_path + '.tmp', 'w') as fp:
+                json.dump(_index, fp)
+            os.replace(index_path + '.tmp', index_path)
+        _index = None
+        _fetched.clear()
+        _url_locks.clear()
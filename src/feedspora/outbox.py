@@ -0,0 +1,151 @@
+"""
+Outbox: posts which failed, kept in the state store to be delivered again
+later, without waiting for their feed to be read again. Posts postponed
+because of a rate limit wait there too.
+
+A post is attempted again after outbox_backoff seconds, doubled after each
+failed attempt. After outbox_max_attempts attempts, it is dead-lettered:
+removed from the outbox, and kept aside in the state store for inspection.
+Dead-lettered posts aren't attempted again, even when their feed is read
+again, until they are removed from the state store, or forgotten along with
+the published entries (see retention_days).
+"""
+
+import logging
+import time
+
+# State store namespaces of the posts to deliver and of the dead letters
+OUTBOX = 'outbox'
+DEAD_LETTERS = 'outbox_dead'
+
+
+def post_key(client_id, pub_item):
+    '''
+    Return the key of the post of an entry to a client
+    :param client_id:
+    :param pub_item: entry digest
+    '''
+    return '%s %s' % (client_id, pub_item.hex())
+
+
+def key_item(key):
+    '''
+    Return the entry digest of a post key (see post_key)
+    :param key:
+    '''
+    return bytes.fromhex(key.rsplit(' ', 1)[1])
+
+
+class Outbox:
+    ''' The posts to deliver again, backed by a state store '''
+
+    def __init__(self, store, settings):
+        '''
+        Load the posts to deliver from the state store
+        :param store:
+        :param settings: runner settings (outbox_backoff and
+                         outbox_max_attempts)
+        '''
+        self._store = store
+        self._backoff = settings['outbox_backoff']
+        self._max_attempts = settings['outbox_max_attempts']
+        self._posts = store.get_all_states(OUTBOX)
+        self._dead = set(store.get_all_states(DEAD_LETTERS))
+        if self._posts:
+            logging.info("%d posts waiting in the outbox", len(self._posts))
+
+    def __contains__(self, key):
+        '''
+        Is the post waiting in the outbox?
+        :param key:
+        '''
+        return key in self._posts
+
+    def is_dead(self, key):
+        '''
+        Was the post dead-lettered?
+        :param key:
+        '''
+        return key in self._dead
+
+    def __len__(self):
+        '''
+        Return the number of posts waiting in the outbox
+        '''
+        return len(self._posts)
+
+    def failed(self, key, post, error):
+        '''
+        Record a failed attempt of a post, and schedule the next one, or
+        dead-letter the post after the last one
+        :param key:
+        :param post: dict JSON can encode: client name, feed path, entry
+                     fields, and attempts so far (if any)
+        :param error:
+        '''
+        post = dict(post, attempts=post.get('attempts', 0) + 1,
+                    error=str(error))
+
+        if post['attempts'] >= self._max_attempts:
+            logging.error("Giving up on %s after %d attempts", key,
+                          post['attempts'])
+            self.remove(key)
+            self._dead.add(key)
+            self._store.set_state(DEAD_LETTERS, key,
+                                  dict(post, dead_since=time.time()))
+            return
+
+        retry_in = self._backoff * 2 ** (post['attempts'] - 1)
+        logging.info("Trying %s again in %d seconds", key, retry_in)
+        post['next_attempt'] = time.time() + retry_in
+        self._posts[key] = post
+        self._store.set_state(OUTBOX, key, post)
+
+    def postpone(self, key, post, delay):
+        '''
+        Postpone a post for delay seconds, without counting an attempt
+        :param key:
+        :param post: see failed
+        :param delay:
+        '''
+        post = dict(post, attempts=post.get('attempts', 0),
+                    next_attempt=time.time() + delay)
+        self._posts[key] = post
+        self._store.set_state(OUTBOX, key, post)
+
+    def remove(self, key):
+        '''
+        Remove a post from the outbox (delivered, or no longer deliverable)
+        :param key:
+        '''
+        if self._posts.pop(key, None) is not None:
+            self._store.set_state(OUTBOX, key, None)
+
+    def due(self, limit):
+        '''
+        Return at most limit (key, post) items due for another attempt,
+        the ones due for the longest time first
+        :param limit:
+        '''
+        now = time.time()
+
+        return sorted(((key, post) for key, post in self._posts.items()
+                       if post['next_attempt'] <= now),
+                      key=lambda item: item[1]['next_attempt'])[:limit]
+
+    def prune_dead(self, oldest, keep=None):
+        '''
+        Forget the posts dead-lettered before oldest (epoch), so that they
+        can be attempted again, and return how many were forgotten
+        :param oldest:
+        :param keep: function telling, from the key and post, whether a dead
+                     letter must be kept anyway
+        '''
+        expired = {key: None for key, post in
+                   self._store.get_all_states(DEAD_LETTERS).items()
+                   if post.get('dead_since', 0) < oldest and
+                   not (keep and keep(key, post))}
+        self._store.set_states(DEAD_LETTERS, expired)
+        self._dead.difference_update(expired)
+
+        return len(expired)
@@ -0,0 +1,123 @@
+"""
+Rate limiters: how fast each client may post, so that a burst of posts
+(e.g. after an outage) is spread out instead of hitting the rate limits of
+the remote API.
+
+Each client has a token bucket: rate_limit posts per hour (0 for no limit),
+at most rate_limit_burst of them at once. It adapts to what the remote API
+reports (calls remaining until its limit resets, or how long to wait after
+it rejected a call): nothing is posted until the remote limit resets. The
+state of the buckets is kept in the state store from one run to the next.
+"""
+
+import threading
+import time
+
+HOUR = 3600
+# Seconds to wait when the remote API rejected a call without saying how
+# long to wait
+DEFAULT_RETRY_AFTER = 900
+
+
+class RateLimited(Exception):
+    '''
+    A post couldn't be sent because of a rate limit: it should be attempted
+    again after retry_after seconds
+    '''
+
+    def __init__(self, message, retry_after=None):
+        '''
+        Initialize
+        :param message:
+        :param retry_after: seconds to wait (DEFAULT_RETRY_AFTER if unknown)
+        '''
+        super().__init__(message)
+        self.retry_after = DEFAULT_RETRY_AFTER if retry_after is None \
+            else retry_after
+
+
+class RateLimiter:
+    ''' Token bucket of a client, adapting to the remote rate limit '''
+
+    def __init__(self, rate, burst, clock=time.time):
+        '''
+        Initialize, with a full bucket
+        :param rate: number of posts per hour, 0 for no limit
+        :param burst: largest number of posts sent at once
+        :param clock: function returning the current time (epoch)
+        '''
+        self._rate = rate / HOUR
+        self._burst = burst
+        self._clock = clock
+        self._tokens = burst
+        self._updated = clock()
+        self._blocked_until = 0
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        '''
+        Add the tokens earned since the last update (with _lock held)
+        :param now:
+        '''
+        if self._rate:
+            self._tokens = min(self._burst, self._tokens +
+                               (now - self._updated) * self._rate)
+        self._updated = now
+
+    def acquire(self):
+        '''
+        Take a token to post and return 0, or return the number of seconds
+        until a post is allowed (no token is taken then)
+        '''
+        with self._lock:
+            now = self._clock()
+            if self._blocked_until > now:
+                return self._blocked_until - now
+            if not self._rate:
+                return 0
+            self._refill(now)
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return 0
+
+            return (1 - self._tokens) / self._rate
+
+    def update(self, remaining=None, reset=None, retry_after=None):
+        '''
+        Adapt to the rate limit information of the remote API
+        :param remaining: number of calls left until the remote limit resets
+        :param reset: time (epoch) the remote limit resets at
+        :param retry_after: number of seconds to wait before the next call
+        '''
+        with self._lock:
+            now = self._clock()
+            if retry_after is not None:
+                self._blocked_until = max(self._blocked_until,
+                                          now + retry_after)
+            if remaining is None:
+                return
+            if remaining <= 0 and reset:
+                self._blocked_until = max(self._blocked_until, reset)
+            elif self._rate:
+                self._refill(now)
+                self._tokens = min(self._tokens, remaining)
+
+    def get_state(self):
+        '''
+        Return the state of the bucket, as a dict JSON can encode (it only
+        changes when the bucket is used, the tokens earned since are added
+        back when it is restored)
+        '''
+        with self._lock:
+            return {'tokens': self._tokens, 'time': self._updated,
+                    'blocked_until': self._blocked_until}
+
+    def set_state(self, state):
+        '''
+        Restore the state of the bucket (see get_state)
+        :param state:
+        '''
+        with self._lock:
+            self._tokens = min(self._burst, state['tokens'])
+            self._updated = min(state['time'], self._clock())
+            self._blocked_until = state['blocked_until']
@@ -0,0 +1,93 @@
+"""
+Send scheduler: posts of a client waiting for each other, without holding
+up other clients and feeds.
+
+Each scheduler sends the posts of its client one after the other, in order,
+in a thread of its own, at least delay seconds after the previous
+successful one.
+"""
+
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+
+class SendScheduler:
+    ''' Sends the posts of a client when they are due '''
+
+    def __init__(self, name, delay, clock=time.monotonic, wait=None):
+        '''
+        Initialize, and start sending
+        :param name: name of the client
+        :param delay: minimal number of seconds between two posts
+        :param clock: function returning the current time, in seconds
+        :param wait: function waiting for a number of seconds, or until the
+                     scheduler is closed with cancel (the default)
+        '''
+        self._name = name
+        self._delay = delay
+        self._clock = clock
+        self._next_due = 0
+        self._jobs = queue.Queue()
+        self._stop = threading.Event()
+        self._wait = wait or self._stop.wait
+        self._thread = threading.Thread(target=self._send,
+                                        name='send-%s' % name, daemon=True)
+        self._thread.start()
+
+    def schedule(self, function, *args):
+        '''
+        Call function(*args) to post once the previous posts are sent and
+        the delay is over, and return a Future of its result
+        :param function: function posting, and returning a true value if
+                         successful
+        :param args:
+        '''
+        future = Future()
+        self._jobs.put((future, function, args))
+
+        return future
+
+    def _send(self):
+        '''
+        Send the posts, in order, until closed
+        '''
+        while True:
+            job = self._jobs.get()
+            if job is None:
+                return
+            future, function, args = job
+
+            wait = self._next_due - self._clock()
+            if wait > 0 and not self._stop.is_set():
+                logging.info("Delaying post to %s for %d seconds...",
+                             self._name, wait)
+                self._wait(wait)
+            if self._stop.is_set():
+                future.cancel()
+            if not future.set_running_or_notify_cancel():
+                continue
+
+            # pylint: disable=broad-except
+            try:
+                result = function(*args)
+            except Exception as error:
+                future.set_exception(error)
+                continue
+            # pylint: enable=broad-except
+            if result:
+                self._next_due = self._clock() + self._delay
+            future.set_result(result)
+
+    def close(self, cancel=False):
+        '''
+        Wait until the posts are sent, or only the one being sent if cancel
+        is set (the others are cancelled)
+        :param cancel:
+        '''
+        if cancel:
+            self._stop.set()
+        self._jobs.put(None)
+        self._thread.join()
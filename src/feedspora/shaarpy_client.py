@@ -4,7 +4,6 @@ Shaarpy client
 
 import logging
 
-from bs4 import BeautifulSoup
 from shaarpy.shaarpy import Shaarpy
 from feedspora.generic_client import GenericClient
 
@@ -52,23 +51,13 @@ class ShaarpyClient(GenericClient):
         :param feed:
         :param entry:
         '''
-        title = self.resolve_option(feed, 'post_prefix') + \
-                entry.title+self.resolve_option(feed, 'post_suffix')
-        link = self.shorten_url(feed, entry.link)
+        options = self.get_options(feed)
+        title = options.post_prefix + entry.title + options.post_suffix
+        link = self.shorten_link(feed, entry)
         tags = self.filter_tags(feed, entry)
         content = ''
-        if self.resolve_option(feed, 'post_include_content') and entry.content:
-            content = entry.content
-
-            # pylint: disable=broad-except
-            try:
-                soup = BeautifulSoup(entry.content, 'html.parser')
-                content = soup.text
-            except Exception:
-                pass
-            # pylint: enable=broad-except
-
-            content = self.remove_ending_tags(feed, content)
+        if options.post_include_content and entry.content:
+            content = self.strip_entry_html(feed, entry)
 
         to_return = False
         if self.is_testing():
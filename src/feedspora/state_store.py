@@ -0,0 +1,892 @@
+"""
+State stores: where FeedSpora keeps track of published entries.
+"""
+
+import contextlib
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import struct
+import time
+
+# Seconds in a day, for retention periods
+DAY = 86400
+
+
+def entry_digest(identity):
+    '''
+    Return the fixed width (16 bytes) digest stored for the specified entry
+    identity
+    :param identity:
+    '''
+    return hashlib.blake2b(identity.encode('utf-8'), digest_size=16).digest()
+
+
+def _replaced(opened_file, path):
+    '''
+    Was the file at path replaced since opened_file was opened?
+    :param opened_file:
+    :param path:
+    '''
+    return os.fstat(opened_file.fileno()).st_ino != os.stat(path).st_ino
+
+
+class GenericStateStore:
+    '''
+    Implements the base functionalities expected from state stores.
+    Published entries are (client_id, key) pairs, key being an entry digest.
+    They are recorded along with the time they were added, and the digest of
+    the feed they come from (feed_key, None if unknown).
+    '''
+
+    def __init__(self, path):
+        '''
+        Initialize
+        :param path:
+        '''
+        self._path = path
+
+    def get_path(self):
+        '''
+        Get the path of the underlying file
+        '''
+        return self._path
+
+    def open(self):
+        '''
+        Placeholder for open, override it in subclasses
+        '''
+        raise NotImplementedError("Please implement!")
+
+    def close(self):
+        '''
+        Placeholder for close, override it in subclasses
+        '''
+        raise NotImplementedError("Please implement!")
+
+    def contains_many(self, items):
+        '''
+        Placeholder for contains_many, override it in subclasses.
+        Return the set of the (client_id, key) items that have been published.
+        :param items:
+        '''
+        raise NotImplementedError("Please implement!")
+
+    def add_many(self, items):
+        '''
+        Placeholder for add_many, override it in subclasses.
+        Durably record the (client_id, key, feed_key) items as published.
+        :param items:
+        '''
+        raise NotImplementedError("Please implement!")
+
+    def export_items(self):
+        '''
+        Placeholder for export_items, override it in subclasses.
+        Return the list of the published (client_id, key, feed_key,
+        timestamp) items.
+        '''
+        raise NotImplementedError("Please implement!")
+
+    def import_items(self, items):
+        '''
+        Placeholder for import_items, override it in subclasses.
+        Durably record the (client_id, key, feed_key, timestamp) items as
+        published, keeping their timestamps.
+        :param items:
+        '''
+        raise NotImplementedError("Please implement!")
+
+    def prune_older_than(self, timestamp, keep_keys=(), keep_feeds=()):
+        '''
+        Placeholder for prune_older_than, override it in subclasses.
+        Forget the items added before timestamp, except those whose key is
+        in keep_keys or whose feed_key is in keep_feeds. Return the number
+        of forgotten items.
+        :param timestamp:
+        :param keep_keys:
+        :param keep_feeds:
+        '''
+        raise NotImplementedError("Please implement!")
+
+    def prune_feed_window(self, feed_key, keep_keys):
+        '''
+        Placeholder for prune_feed_window, override it in subclasses.
+        Forget the items of the specified feed whose key is not in keep_keys
+        (the entries currently in the feed). Return the number of forgotten
+        items.
+        :param feed_key:
+        :param keep_keys:
+        '''
+        raise NotImplementedError("Please implement!")
+
+    def compact(self):
+        '''
+        Placeholder for compact, override it in subclasses.
+        Reclaim the space used by forgotten items.
+        '''
+        raise NotImplementedError("Please implement!")
+
+    def get_state(self, namespace, key, default=None):
+        '''
+        Placeholder for get_state, override it in subclasses.
+        Return the value stored for key in namespace, or default.
+        :param namespace:
+        :param key:
+        :param default:
+        '''
+        raise NotImplementedError("Please implement!")
+
+    def get_all_states(self, namespace):
+        '''
+        Placeholder for get_all_states, override it in subclasses.
+        Return a dict of all the values stored in namespace.
+        :param namespace:
+        '''
+        raise NotImplementedError("Please implement!")
+
+    def get_namespaces(self):
+        '''
+        Placeholder for get_namespaces, override it in subclasses.
+        Return the list of the namespaces holding values.
+        '''
+        raise NotImplementedError("Please implement!")
+
+    def set_state(self, namespace, key, value):
+        '''
+        Placeholder for set_state, override it in subclasses.
+        Durably store the value (anything JSON can encode) for key in
+        namespace, or remove it if value is None.
+        :param namespace:
+        :param key:
+        :param value:
+        '''
+        raise NotImplementedError("Please implement!")
+
+    def set_states(self, namespace, values):
+        '''
+        Durably store several values in namespace at once (see set_state).
+        :param namespace:
+        :param values: dict of the values, by key (None to remove a key)
+        '''
+        for key, value in values.items():
+            self.set_state(namespace, key, value)
+
+
+class SQLiteStateStore(GenericStateStore):
+    ''' State store backed by an SQLite database. '''
+    _conn = None
+    _cur = None
+    # Maximum number of host parameters used by a single query
+    _lookup_batch_size = 500
+
+    def open(self):
+        '''
+        Initialize the connection to the database.
+        It also creates the tables if the file does not exist yet, and
+        migrates existing files to the current schema version.
+        '''
+        should_init = not os.path.exists(self._path)
+        # Wait for other processes (e.g. a concurrent prune) rather than
+        # failing right away
+        self._conn = sqlite3.connect(self._path, timeout=60)
+        self._cur = self._conn.cursor()
+        # Readers don't block the writer, and a commit only appends to the
+        # log instead of rewriting pages in place
+        self._cur.execute("PRAGMA journal_mode=WAL")
+
+        if should_init:
+            logging.info("Creating new database file %s", self._path)
+        else:
+            logging.info("Found database file %s", self._path)
+        self._migrate()
+
+    def close(self):
+        '''
+        Close the connection to the database
+        '''
+        if self._conn:
+            self._conn.close()
+            self._conn = None
+            self._cur = None
+
+    def get_schema_version(self):
+        '''
+        Return the schema version of the database (0 for files created
+        before the schema was versioned)
+        '''
+        self._cur.execute("SELECT name FROM sqlite_master WHERE "
+                          "type='table' AND name='schema_version'")
+        if self._cur.fetchone() is None:
+            return 0
+        self._cur.execute("SELECT MAX(version) FROM schema_version")
+        version = self._cur.fetchone()[0]
+
+        return version if version else 0
+
+    def _migrate_to_v1(self):
+        '''
+        Schema version 1: version table, and unique index on
+        (client_id, feedspora_id) so that lookups don't scan the whole table
+        '''
+        self._cur.execute("CREATE TABLE IF NOT EXISTS posts "
+                          "(id INTEGER PRIMARY KEY, feedspora_id, "
+                          "client_id TEXT)")
+        self._cur.execute("CREATE TABLE IF NOT EXISTS schema_version "
+                          "(version INTEGER NOT NULL)")
+        # Older files may contain duplicates, which would prevent the
+        # creation of the unique index: only keep the first of them
+        self._cur.execute("DELETE FROM posts WHERE id NOT IN "
+                          "(SELECT MIN(id) FROM posts "
+                          "GROUP BY client_id, feedspora_id)")
+        self._cur.execute("CREATE UNIQUE INDEX IF NOT EXISTS "
+                          "posts_client_entry ON posts "
+                          "(client_id, feedspora_id)")
+
+    def _migrate_to_v2(self):
+        '''
+        Schema version 2: entries are identified by a 16 bytes digest
+        instead of their full identity string
+        '''
+        self._conn.create_function('entry_digest', 1, entry_digest)
+        self._cur.execute("UPDATE posts SET "
+                          "feedspora_id = entry_digest(feedspora_id) "
+                          "WHERE typeof(feedspora_id) = 'text'")
+
+    def _migrate_to_v3(self):
+        '''
+        Schema version 3: time each entry was added at (rows added before
+        are considered added by the migration), and digest of its feed
+        '''
+        self._cur.execute("ALTER TABLE posts ADD COLUMN published_at INTEGER")
+        self._cur.execute("ALTER TABLE posts ADD COLUMN feed_id")
+        self._cur.execute("UPDATE posts SET published_at = ?",
+                          (int(time.time()), ))
+
+    def _migrate_to_v4(self):
+        '''
+        Schema version 4: key/value state (HTTP validators, caches...)
+        '''
+        self._cur.execute("CREATE TABLE IF NOT EXISTS state "
+                          "(namespace TEXT NOT NULL, key TEXT NOT NULL, "
+                          "value TEXT NOT NULL, PRIMARY KEY (namespace, key))")
+
+    def _migrate(self):
+        '''
+        Bring the database up to the current schema version, one migration
+        at a time, each of them in its own transaction.
+        '''
+        migrations = [self._migrate_to_v1, self._migrate_to_v2,
+                      self._migrate_to_v3, self._migrate_to_v4]
+        version = self.get_schema_version()
+
+        if version > len(migrations):
+            raise Exception("Database file %s has schema version %d, which "
+                            "is newer than the supported one (%d)" %
+                            (self._path, version, len(migrations)))
+
+        for migration in migrations[version:]:
+            version += 1
+            logging.info("Migrating database file %s to schema version %d",
+                         self._path, version)
+            self._cur.execute("BEGIN")
+            try:
+                migration()
+                self._cur.execute("DELETE FROM schema_version")
+                self._cur.execute("INSERT INTO schema_version (version) "
+                                  "values (?)", (version, ))
+            except sqlite3.Error:
+                self._conn.rollback()
+                raise
+            self._conn.commit()
+
+    def contains_many(self, items):
+        '''
+        Return the set of the (client_id, key) items that have been published,
+        using batched queries on the (client_id, feedspora_id) index.
+        :param items:
+        '''
+        items = set(items)
+        client_ids = list({client_id for client_id, _ in items})
+        keys = list({key for _, key in items})
+        batch_size = max(self._lookup_batch_size - len(client_ids), 1)
+        to_return = set()
+
+        for start in range(0, len(keys), batch_size):
+            batch = keys[start:start + batch_size]
+            sql = "SELECT client_id, feedspora_id FROM posts " \
+                  "WHERE client_id IN ({}) AND feedspora_id IN ({})".format(
+                      ','.join('?' * len(client_ids)),
+                      ','.join('?' * len(batch)))
+            self._cur.execute(sql, client_ids + batch)
+            to_return.update(item for item in self._cur.fetchall()
+                             if item in items)
+
+        return to_return
+
+    def add_many(self, items):
+        '''
+        Record the (client_id, key, feed_key) items as published, in a single
+        transaction.
+        :param items:
+        '''
+        now = int(time.time())
+        try:
+            self._cur.executemany(
+                "INSERT OR IGNORE INTO posts "
+                "(client_id, feedspora_id, feed_id, published_at) "
+                "values (?,?,?,?)",
+                [(client_id, key, feed_key, now)
+                 for client_id, key, feed_key in items])
+        except sqlite3.Error:
+            self._conn.rollback()
+            raise
+        self._conn.commit()
+
+    def export_items(self):
+        '''
+        Return the list of the published (client_id, key, feed_key,
+        timestamp) items
+        '''
+        self._cur.execute("SELECT client_id, feedspora_id, feed_id, "
+                          "published_at FROM posts")
+
+        return self._cur.fetchall()
+
+    def import_items(self, items):
+        '''
+        Record the (client_id, key, feed_key, timestamp) items as published,
+        in a single transaction
+        :param items:
+        '''
+        try:
+            self._cur.executemany(
+                "INSERT OR IGNORE INTO posts "
+                "(client_id, feedspora_id, feed_id, published_at) "
+                "values (?,?,?,?)", items)
+        except sqlite3.Error:
+            self._conn.rollback()
+            raise
+        self._conn.commit()
+
+    def _delete(self, where, params, keep_keys):
+        '''
+        Delete the rows matching the where clause, except those whose key
+        is in keep_keys, and return their number
+        :param where:
+        :param params:
+        :param keep_keys:
+        '''
+        try:
+            self._cur.execute("CREATE TEMP TABLE IF NOT EXISTS keep_keys "
+                              "(key PRIMARY KEY)")
+            self._cur.execute("DELETE FROM keep_keys")
+            self._cur.executemany("INSERT OR IGNORE INTO keep_keys (key) "
+                                  "values (?)", [(key, ) for key in keep_keys])
+            self._cur.execute("DELETE FROM posts WHERE " + where +
+                              " AND feedspora_id NOT IN "
+                              "(SELECT key FROM keep_keys)", params)
+            to_return = self._cur.rowcount
+        except sqlite3.Error:
+            self._conn.rollback()
+            raise
+        self._conn.commit()
+
+        return to_return
+
+    def prune_older_than(self, timestamp, keep_keys=(), keep_feeds=()):
+        '''
+        Delete the rows added before timestamp, except those whose key is in
+        keep_keys or whose feed is in keep_feeds. Return their number.
+        :param timestamp:
+        :param keep_keys:
+        :param keep_feeds:
+        '''
+        where = "published_at < ?"
+        params = [timestamp]
+        feed_keys = [feed_key for feed_key in keep_feeds if feed_key]
+        if feed_keys:
+            where += " AND (feed_id IS NULL OR feed_id NOT IN ({}))".format(
+                ','.join('?' * len(feed_keys)))
+            params.extend(feed_keys)
+        if None in keep_feeds:
+            where += " AND feed_id IS NOT NULL"
+
+        return self._delete(where, params, keep_keys)
+
+    def prune_feed_window(self, feed_key, keep_keys):
+        '''
+        Delete the rows of the specified feed whose key is not in keep_keys.
+        Return their number.
+        :param feed_key:
+        :param keep_keys:
+        '''
+        return self._delete("feed_id = ?", [feed_key], keep_keys)
+
+    def compact(self):
+        '''
+        Refresh the query planner statistics, rebuild the database file and
+        truncate the write-ahead log
+        '''
+        self._conn.commit()
+        self._cur.execute("ANALYZE")
+        self._cur.execute("VACUUM")
+        self._cur.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+    def get_state(self, namespace, key, default=None):
+        '''
+        Return the value stored for key in namespace, or default
+        :param namespace:
+        :param key:
+        :param default:
+        '''
+        self._cur.execute("SELECT value FROM state "
+                          "WHERE namespace = ? AND key = ?", (namespace, key))
+        row = self._cur.fetchone()
+
+        return json.loads(row[0]) if row else default
+
+    def get_all_states(self, namespace):
+        '''
+        Return a dict of all the values stored in namespace
+        :param namespace:
+        '''
+        self._cur.execute("SELECT key, value FROM state WHERE namespace = ?",
+                          (namespace, ))
+
+        return {key: json.loads(value) for key, value in self._cur.fetchall()}
+
+    def get_namespaces(self):
+        '''
+        Return the list of the namespaces holding values
+        '''
+        self._cur.execute("SELECT DISTINCT namespace FROM state")
+
+        return [row[0] for row in self._cur.fetchall()]
+
+    def set_state(self, namespace, key, value):
+        '''
+        Store the value for key in namespace, or remove it if value is None
+        :param namespace:
+        :param key:
+        :param value:
+        '''
+        self.set_states(namespace, {key: value})
+
+    def set_states(self, namespace, values):
+        '''
+        Store several values in namespace (None to remove a key), in a
+        single transaction
+        :param namespace:
+        :param values: dict of the values, by key
+        '''
+        if not values:
+            return
+        try:
+            self._cur.executemany(
+                "DELETE FROM state WHERE namespace = ? AND key = ?",
+                [(namespace, key) for key, value in values.items()
+                 if value is None])
+            self._cur.executemany(
+                "INSERT OR REPLACE INTO state (namespace, key, value) "
+                "values (?,?,?)",
+                [(namespace, key, json.dumps(value))
+                 for key, value in values.items() if value is not None])
+        except sqlite3.Error:
+            self._conn.rollback()
+            raise
+        self._conn.commit()
+
+
+class LogStateStore(GenericStateStore):
+    '''
+    State store backed by an append-only log file, indexed in memory.
+    Each record holds the time it was written, the client ID, the key, and
+    the feed key. Forgotten items are only removed from the file when it is
+    rewritten.
+    Key/value state goes to a second log (<path>.state), made of JSON lines.
+    The log is named after the database file with a .log extension, so that
+    both backends can be switched between without mixing up files.
+    Writes to both logs hold an exclusive lock on a third file
+    (<path>.lock), the logs themselves being replaced when rewritten, so
+    that several processes can share them.
+    '''
+    _magic = b'FSLOG1\n'
+    _header = struct.Struct('>dHHH')
+    _file = None
+    _index = None
+    _state_file = None
+    _states = None
+
+    def __init__(self, path):
+        '''
+        Initialize
+        :param path: path of the database file (<name>.db), or of the log
+        '''
+        root, extension = os.path.splitext(path)
+        super().__init__(root + '.log' if extension == '.db' else path)
+
+    def open(self):
+        '''
+        Load the log file into the in-memory index, creating it if it does
+        not exist yet. A record truncated by a crash is discarded.
+        '''
+        self._index = dict()
+
+        with self._locked():
+            if not os.path.exists(self._path):
+                logging.info("Creating new log file %s", self._path)
+                self._rewrite()
+            else:
+                logging.info("Found log file %s", self._path)
+                self._load()
+            self._open_for_append()
+            self._load_states()
+
+    @contextlib.contextmanager
+    def _locked(self):
+        '''
+        Hold the lock of the log files while writing to them, reopening
+        those another process replaced meanwhile
+        '''
+        with open(self._path + '.lock', 'ab') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                if self._file and _replaced(self._file, self._path):
+                    self._file.close()
+                    self._open_for_append()
+                if self._state_file and \
+                   _replaced(self._state_file, self._path + '.state'):
+                    self._state_file.close()
+                    # pylint: disable=consider-using-with
+                    self._state_file = open(self._path + '.state', 'a',
+                                            encoding='utf-8')
+                    # pylint: enable=consider-using-with
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _open_for_append(self):
+        '''
+        Open the log file for appending records
+        '''
+        # pylint: disable=consider-using-with
+        self._file = open(self._path, 'ab')
+        # pylint: enable=consider-using-with
+
+    def _load(self):
+        '''
+        Read all records of the log file into the index (with the lock held)
+        '''
+        with open(self._path, 'rb') as log_file:
+            content = log_file.read()
+
+        if not content.startswith(self._magic):
+            raise Exception("%s is not a FeedSpora log file" % self._path)
+        header = self._header
+
+        offset = len(self._magic)
+        while offset + header.size <= len(content):
+            fields = header.unpack_from(content, offset)
+            start = offset + header.size
+            end = start + sum(fields[1:])
+            if end > len(content):
+                break
+            client_end = start + fields[1]
+            key_end = client_end + fields[2]
+            self._index.setdefault(
+                content[start:client_end].decode('utf-8'), dict())[
+                    content[client_end:key_end]] = (
+                        fields[0], content[key_end:end] or None)
+            offset = end
+
+        if offset < len(content):
+            logging.warning("Discarding truncated record at the end of %s",
+                            self._path)
+            with open(self._path, 'r+b') as log_file:
+                log_file.truncate(offset)
+
+    def _records(self, items):
+        '''
+        Return the binary records for the (timestamp, client_id, key,
+        feed_key) items
+        :param items:
+        '''
+        records = []
+
+        for timestamp, client_id, key, feed_key in items:
+            encoded_id = client_id.encode('utf-8')
+            feed_key = feed_key or b''
+            records.append(self._header.pack(timestamp, len(encoded_id),
+                                             len(key), len(feed_key)))
+            records.extend((encoded_id, key, feed_key))
+
+        return b''.join(records)
+
+    def _rewrite(self):
+        '''
+        Atomically replace the log file with the content of the index (with
+        the lock held)
+        '''
+        if self._file:
+            self._file.close()
+            self._file = None
+        tmp_path = self._path + '.tmp'
+        with open(tmp_path, 'wb') as log_file:
+            log_file.write(self._magic)
+            log_file.write(self._records(
+                (timestamp, client_id, key, feed_key)
+                for client_id, keys in self._index.items()
+                for key, (timestamp, feed_key) in keys.items()))
+            log_file.flush()
+            os.fsync(log_file.fileno())
+        os.replace(tmp_path, self._path)
+
+    def close(self):
+        '''
+        Close the log files
+        '''
+        if self._file:
+            self._file.close()
+            self._file = None
+        if self._state_file:
+            self._state_file.close()
+            self._state_file = None
+
+    def contains_many(self, items):
+        '''
+        Return the set of the (client_id, key) items that have been published
+        :param items:
+        '''
+        return {(client_id, key) for client_id, key in items
+                if key in self._index.get(client_id, ())}
+
+    def add_many(self, items):
+        '''
+        Append the (client_id, key, feed_key) items to the log, and sync it
+        to disk
+        :param items:
+        '''
+        now = time.time()
+        with self._locked():
+            self._file.write(self._records(
+                (now, client_id, key, feed_key)
+                for client_id, key, feed_key in items))
+            self._file.flush()
+            os.fsync(self._file.fileno())
+
+        for client_id, key, feed_key in items:
+            self._index.setdefault(client_id, dict())[key] = (now, feed_key)
+
+    def export_items(self):
+        '''
+        Return the list of the published (client_id, key, feed_key,
+        timestamp) items
+        '''
+        return [(client_id, key, feed_key, timestamp)
+                for client_id, keys in self._index.items()
+                for key, (timestamp, feed_key) in keys.items()]
+
+    def import_items(self, items):
+        '''
+        Append the (client_id, key, feed_key, timestamp) items to the log,
+        and sync it to disk
+        :param items:
+        '''
+        items = list(items)
+        with self._locked():
+            self._file.write(self._records(
+                (timestamp, client_id, key, feed_key)
+                for client_id, key, feed_key, timestamp in items))
+            self._file.flush()
+            os.fsync(self._file.fileno())
+
+        for client_id, key, feed_key, timestamp in items:
+            self._index.setdefault(client_id, dict())[key] = (timestamp,
+                                                              feed_key)
+
+    def _forget(self, predicate):
+        '''
+        Remove the items matching predicate(key, timestamp, feed_key) from
+        the index, rewrite the log file if needed, and return their number.
+        The items other processes added meanwhile are read first, so that
+        they are kept.
+        :param predicate:
+        '''
+        to_return = 0
+
+        with self._locked():
+            self._load()
+            for keys in self._index.values():
+                forgotten = [key for key, (timestamp, feed_key)
+                             in keys.items()
+                             if predicate(key, timestamp, feed_key)]
+                for key in forgotten:
+                    del keys[key]
+                to_return += len(forgotten)
+
+            if to_return:
+                self._rewrite()
+                self._open_for_append()
+
+        return to_return
+
+    def prune_older_than(self, timestamp, keep_keys=(), keep_feeds=()):
+        '''
+        Forget the items added before timestamp, except those whose key is
+        in keep_keys or whose feed_key is in keep_feeds. Return their number.
+        :param timestamp:
+        :param keep_keys:
+        :param keep_feeds:
+        '''
+        keep_keys = set(keep_keys)
+        keep_feeds = set(keep_feeds)
+
+        return self._forget(
+            lambda key, added, feed_key: added < timestamp and
+            key not in keep_keys and feed_key not in keep_feeds)
+
+    def prune_feed_window(self, feed_key, keep_keys):
+        '''
+        Forget the items of the specified feed whose key is not in keep_keys.
+        Return their number.
+        :param feed_key:
+        :param keep_keys:
+        '''
+        keep_keys = set(keep_keys)
+
+        return self._forget(
+            lambda key, added, item_feed_key: item_feed_key == feed_key and
+            key not in keep_keys)
+
+    def compact(self):
+        '''
+        Rewrite the log files, dropping superseded records (along with
+        those of other processes)
+        '''
+        with self._locked():
+            self._load()
+            self._rewrite()
+            self._open_for_append()
+            self._load_states()
+
+    def _load_states(self):
+        '''
+        Read the key/value state log, then rewrite it and open it for
+        appending (with the lock held). A line truncated by a crash is
+        ignored.
+        '''
+        self._states = dict()
+        state_path = self._path + '.state'
+
+        if os.path.exists(state_path):
+            with open(state_path, encoding='utf-8') as state_file:
+                for line in state_file:
+                    try:
+                        namespace, key, value = json.loads(line)
+                    except ValueError:
+                        logging.warning("Ignoring invalid record in %s",
+                                        state_path)
+                        continue
+                    if value is None:
+                        self._states.get(namespace, {}).pop(key, None)
+                    else:
+                        self._states.setdefault(namespace, {})[key] = value
+        self._rewrite_states()
+
+    def _rewrite_states(self):
+        '''
+        Atomically replace the key/value state log with the current state,
+        and reopen it for appending (with the lock held)
+        '''
+        if self._state_file:
+            self._state_file.close()
+        state_path = self._path + '.state'
+        with open(state_path + '.tmp', 'w', encoding='utf-8') as state_file:
+            for namespace, values in self._states.items():
+                for key, value in values.items():
+                    state_file.write(json.dumps([namespace, key, value]) +
+                                     '\n')
+            state_file.flush()
+            os.fsync(state_file.fileno())
+        os.replace(state_path + '.tmp', state_path)
+        # pylint: disable=consider-using-with
+        self._state_file = open(state_path, 'a', encoding='utf-8')
+        # pylint: enable=consider-using-with
+
+    def get_state(self, namespace, key, default=None):
+        '''
+        Return the value stored for key in namespace, or default
+        :param namespace:
+        :param key:
+        :param default:
+        '''
+        return self._states.get(namespace, {}).get(key, default)
+
+    def get_all_states(self, namespace):
+        '''
+        Return a dict of all the values stored in namespace
+        :param namespace:
+        '''
+        return dict(self._states.get(namespace, {}))
+
+    def get_namespaces(self):
+        '''
+        Return the list of the namespaces holding values
+        '''
+        return [namespace for namespace, values in self._states.items()
+                if values]
+
+    def set_state(self, namespace, key, value):
+        '''
+        Append the value for key in namespace to the state log, and sync it
+        to disk. A None value removes the key.
+        :param namespace:
+        :param key:
+        :param value:
+        '''
+        self.set_states(namespace, {key: value})
+
+    def set_states(self, namespace, values):
+        '''
+        Append several values in namespace to the state log (None to remove
+        a key), and sync it to disk once
+        :param namespace:
+        :param values: dict of the values, by key
+        '''
+        if not values:
+            return
+        with self._locked():
+            self._state_file.write(''.join(
+                json.dumps([namespace, key, value]) + '\n'
+                for key, value in values.items()))
+            self._state_file.flush()
+            os.fsync(self._state_file.fileno())
+
+        for key, value in values.items():
+            if value is None:
+                self._states.get(namespace, {}).pop(key, None)
+            else:
+                self._states.setdefault(namespace, {})[key] = value
+
+
+# State store backends, as selected by the state_store setting
+STATE_STORES = {'sqlite': SQLiteStateStore,
+                'log': LogStateStore,
+               }
+
+
+def copy_store(source, target):
+    '''
+    Copy the published items and the key/value state of an open state store
+    to another one, e.g. when switching backends
+    :param source:
+    :param target:
+    '''
+    target.import_items(source.export_items())
+    for namespace in source.get_namespaces():
+        for key, value in source.get_all_states(namespace).items():
+            target.set_state(namespace, key, value)
@@ -8,6 +8,18 @@ import tweepy
 from feedspora.generic_client import GenericClient
 
 
+def _header_int(headers, name):
+    '''
+    Return the value of a numeric rate limit header, or None
+    :param headers:
+    :param name:
+    '''
+    try:
+        return int(headers[name])
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
 class TweepyClient(GenericClient):
     ''' The TweepyClient handles the connection to Twitter. '''
     _api = None
@@ -53,6 +65,7 @@ class TweepyClient(GenericClient):
         Post entry to Twitter.
         :param entry:
         '''
+        options = self.get_options(feed)
 
         putative_urls = re.findall(r'[a-zA-Z0-9]+\.[a-zA-Z]{2,3}', entry.title)
         # Infer the 'inner links' Twitter may charge length for
@@ -61,27 +74,26 @@ class TweepyClient(GenericClient):
         maxlen = self._max_len - adjust_with_inner_links - 1  # for last ' '
 
         # Let's build our tweet!  Apply optional prefix
-        text = self.resolve_option(feed, 'post_prefix')
+        text = options.post_prefix
 
         # Process contents
         raw_contents = entry.title
 
-        stripped_html = self.strip_html(feed, entry.content) \
-                        if entry.content else None
-        if self.resolve_option(feed, 'post_include_content') and stripped_html:
+        stripped_html = self.strip_entry_html(feed, entry, maxlen)
+        if options.post_include_content and stripped_html:
             raw_contents += ": " + stripped_html
         text += self._mkrichtext(raw_contents, self.filter_tags(feed, entry),
                                  maxlen=maxlen)
 
         # Apply optional suffix
-        text += self.resolve_option(feed, 'post_suffix')
+        text += options.post_suffix
 
         # Shorten the link URL if configured/possible
-        text += " " + self.shorten_url(feed, entry.link)
+        text += " " + self.shorten_link(feed, entry)
 
         # Finally ready to post.  Let's find out how (media/text)
         media_path = None
-        if self.resolve_option(feed, 'post_include_media') and entry.media_url:
+        if options.post_include_media and entry.media_url:
             # Need to download image from that URL in order to post it!
             media_path = self.download_media(entry.media_url)
 
@@ -89,9 +101,22 @@ class TweepyClient(GenericClient):
         if self.is_testing():
             self.accumulate_testing_output(
                 self.get_dict_output(text=text, media_path=media_path))
-        elif media_path:
-            to_return = self._api.update_with_media(media_path, text)
         else:
-            to_return = self._api.update_status(text)
+            try:
+                if media_path:
+                    to_return = self._api.update_with_media(media_path, text)
+                else:
+                    to_return = self._api.update_status(text)
+            except tweepy.RateLimitError as error:
+                headers = error.response.headers \
+                    if error.response is not None else {}
+                raise self.rate_limited(
+                    error, retry_after=_header_int(headers, 'retry-after'),
+                    reset=_header_int(headers, 'x-rate-limit-reset')) \
+                    from error
+            headers = self._api.last_response.headers
+            self.get_rate_limiter().update(
+                remaining=_header_int(headers, 'x-rate-limit-remaining'),
+                reset=_header_int(headers, 'x-rate-limit-reset'))
 
         return to_return
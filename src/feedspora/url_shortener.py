@@ -0,0 +1,156 @@
+"""
+URL shortener: short URLs shared by all clients, and cached in the state
+store from one run to the next.
+
+Shortener instances are reused, and a service failing to shorten a URL
+isn't used again for a while: links are then left as they are.
+"""
+
+import hashlib
+import logging
+import threading
+import time
+
+import pyshorteners
+
+from feedspora.common_config import runner_settings
+
+DAY = 86400
+
+_DEFAULTS = {'shortener_ttl': 30,
+             'shortener_retry': 300,
+            }
+_settings = dict(_DEFAULTS)
+# Short URLs by service and long URL, changes not stored yet, shortener
+# instances by options, and services failing until some time
+_short_urls = {}
+_changes = {}
+_shorteners = {}
+_failures = {}
+_lock = threading.Lock()
+
+
+def configure(settings):
+    '''
+    Set the shortener settings (number of days short URLs are cached, number
+    of seconds a failing service is left alone), and start over
+    :param settings:
+    '''
+    _settings.update(runner_settings(settings, _DEFAULTS))
+    with _lock:
+        _short_urls.clear()
+        _changes.clear()
+        _shorteners.clear()
+        _failures.clear()
+
+
+def cache_key(service, options, url):
+    '''
+    Return the key of a short URL in the cache. Short URLs obtained with
+    other options (another account, for instance) have other keys, the
+    options being hashed so that no token is stored.
+    :param service:
+    :param options: tuple of (name, value) items
+    :param url:
+    '''
+    if not options:
+        return '%s %s' % (service, url)
+
+    return '%s %s %s' % (service, hashlib.blake2b(
+        repr(options).encode('utf-8'), digest_size=8).hexdigest(), url)
+
+
+def load_cache(states):
+    '''
+    Load the short URLs cached in the state store (see pop_changes), those
+    older than shortener_ttl days being removed
+    :param states: dict of the cached short URLs, by cache key
+    '''
+    oldest = time.time() - _settings['shortener_ttl'] * DAY
+    with _lock:
+        for key, value in states.items():
+            if value['time'] >= oldest:
+                _short_urls[key] = value
+            else:
+                _changes[key] = None
+
+
+def pop_changes():
+    '''
+    Return the short URLs to store (None for those to remove), by cache
+    key, and forget about them
+    '''
+    with _lock:
+        to_return = dict(_changes)
+        _changes.clear()
+
+    return to_return
+
+
+def _get_shortener(options):
+    '''
+    Return the shortener instance for options (with _lock held)
+    :param options: tuple of (name, value) items
+    '''
+    if options not in _shorteners:
+        # Default
+        short_options = {'timeout': 3}
+        short_options.update(options)
+        _shorteners[options] = pyshorteners.Shortener(**short_options)
+
+    return _shorteners[options]
+
+
+def shorten(service, options, url):
+    '''
+    Shorten url with service, and return the result. If anything goes awry,
+    return the unmodified URL.
+    :param service:
+    :param options: tuple of (name, value) items
+    :param url:
+    '''
+    key = cache_key(service, options, url)
+    with _lock:
+        if key in _short_urls:
+            return _short_urls[key]['url']
+        if _failures.get(service, 0) > time.time():
+            return url
+        shortener = _get_shortener(options)
+
+    try:
+        # Verify a legal choice
+        # pylint: disable=no-member
+        assert service in shortener.available_shorteners
+        # pylint: enable=no-member
+        to_return = getattr(shortener, service).short(url)
+    # pylint: disable=broad-except
+    except Exception as exception:
+        # Shortening attempt failed somehow (we don't care how, except
+        # for messaging purposes) - revert to non-shortened link, and leave
+        # the service alone for a while
+
+        if isinstance(exception, AssertionError):
+            all_shorteners = ' '.join(shortener.available_shorteners)
+            logging.error('URL shortener %s is unimplemented!', service)
+            logging.info('Available URL shorteners: %s', all_shorteners)
+        else:
+            logging.error('Cannot shorten URL %s with %s: %s',
+                          url, service, str(exception))
+        with _lock:
+            _failures[service] = time.time() + _settings['shortener_retry']
+
+        return url
+    # pylint: enable=broad-except
+
+    # Sanity check!
+    if len(to_return) > len(url):
+        # Not shorter?  You're fired!
+        logging.error('Cannot shorten URL %s with %s: it produced a longer '
+                      'URL', url, service)
+        return url
+
+    with _lock:
+        _short_urls[key] = _changes[key] = {'url': to_return,
+                                            'time': time.time()}
+
+    return to_return
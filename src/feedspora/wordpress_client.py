@@ -11,6 +11,7 @@ from wordpress_xmlrpc import Client, WordPressPost
 from wordpress_xmlrpc.compat import xmlrpc_client
 from wordpress_xmlrpc.methods import media, posts
 
+from feedspora import http_session
 from feedspora.generic_client import GenericClient
 
 
@@ -37,7 +38,7 @@ class WPClient(GenericClient):
         Retrieve URL content and parse it w/ readability if it's HTML
         :param url:
         '''
-        request = requests.get(url)
+        request = http_session.get(url)
         content = ''
 
         # pylint: disable=no-member
@@ -58,16 +59,16 @@ class WPClient(GenericClient):
         Return dict output for testing purposes
         :param kwargs:
         '''
+        options = self.get_options(kwargs['feed'])
 
         return {
             "client": self._config['name'],
-            "title": self.resolve_option(kwargs['feed'], 'post_prefix') + \
-                     kwargs['entry'].title + \
-                     self.resolve_option(kwargs['feed'], 'post_suffix'),
+            "title": options.post_prefix + kwargs['entry'].title + \
+                     options.post_suffix,
             "post_tag": self.filter_tags(kwargs['feed'], kwargs['entry']),
             "media_path": kwargs['media_path'],
             "content": kwargs['content'],
-            "url": self.shorten_url(kwargs['feed'], kwargs['entry'].link)
+            "url": self.shorten_link(kwargs['feed'], kwargs['entry'])
         }
 
     def post(self, feed, entry):
@@ -76,6 +77,7 @@ class WPClient(GenericClient):
         :param feed:
         :param entry:
         '''
+        options = self.get_options(feed)
 
         def upload_media(media_path):
             '''
@@ -102,17 +104,16 @@ class WPClient(GenericClient):
            self._config['post_link_content']:
             article_content = self.get_content(entry.link)
         else:
-            if self.resolve_option(feed, 'post_include_content') and \
-               entry.content:
-                article_content = self.strip_html(feed, entry.content)
+            if options.post_include_content and entry.content:
+                article_content = self.strip_entry_html(feed, entry)
 
         post_content = r"Source: <a href='{}'>{}</a><hr\>{}".format(
-            self.shorten_url(feed, entry.link),
+            self.shorten_link(feed, entry),
             urlparse(entry.link).netloc, article_content)
 
         # Resolve media, if appropriate and possible
         media_path = None
-        if self.resolve_option(feed, 'post_include_media') and entry.media_url:
+        if options.post_include_media and entry.media_url:
             # Need to download image from that URL in order to post it!
             media_path = self.download_media(entry.media_url)
 
@@ -121,7 +122,7 @@ class WPClient(GenericClient):
             content = article_content
             if 'post_link_content' in self._config and \
                self._config['post_link_content']:
-                content = "From "+self.shorten_url(feed, entry.link)
+                content = "From "+self.shorten_link(feed, entry)
 
             self.accumulate_testing_output(
                 self.get_dict_output(feed=feed, entry=entry, content=content,
@@ -134,9 +135,8 @@ class WPClient(GenericClient):
 
             # get text with readability
             post = WordPressPost()
-            post.title = self.resolve_option(feed, 'post_prefix') + \
-                         entry.title + \
-                         self.resolve_option(feed, 'post_suffix')
+            post.title = options.post_prefix + entry.title + \
+                         options.post_suffix
             post.content = post_content
             post.terms_names = {
                 'post_tag': self.filter_tags(feed, entry),
@@ -0,0 +1,213 @@
+"""
+Test the circuit breakers of the clients and feed hosts
+"""
+
+import pytest
+import requests
+import requests_cache
+import responses
+
+from helpers import make_runner
+
+from feedspora.circuit_breaker import CLOSED, HALF_OPEN, OPEN, \
+    CircuitBreakers, CircuitOpen
+from feedspora.generic_client import GenericClient
+from feedspora.generic_feed import FeedSporaEntry, GenericFeed
+from feedspora.media_cache import MediaError
+
+FEED_URL = "http://aurelien.latitude77.org/feed.rss"
+MEDIA_URL = "http://aurelien.latitude77.org/image.png"
+
+
+class FakeClock:
+    """
+    Clock only moving when told to
+    """
+
+    def __init__(self):
+        self.now = 1000000
+
+    def __call__(self):
+        return self.now
+
+
+def test_circuit_breaker():
+    """
+    A breaker opens after breaker_threshold failures in a row, skips calls
+    for breaker_cooldown seconds, then lets a single call through
+    """
+    clock = FakeClock()
+    breakers = CircuitBreakers({'breaker_threshold': 2,
+                                'breaker_cooldown': 60}, clock)
+    breakers.failed('client test')
+    breakers.succeeded('client test')
+    breakers.failed('client test')
+    breakers.check('client test')
+    breakers.failed('client test')
+    clock.now += 20
+    with pytest.raises(CircuitOpen) as error:
+        breakers.check('client test')
+    assert error.value.retry_after == 40
+
+    # Half-open: a single call, opening the breaker again if it fails
+    clock.now += 40
+    breakers.check('client test')
+    with pytest.raises(CircuitOpen):
+        breakers.check('client test')
+    breakers.failed('client test')
+    with pytest.raises(CircuitOpen):
+        breakers.check('client test')
+
+    # Closed once a call succeeds
+    clock.now += 60
+    breakers.check('client test')
+    breakers.succeeded('client test')
+    breakers.check('client test')
+
+    state = breakers.get_states()['client test']
+    assert state['state'] == CLOSED
+    assert (state['trips'], state['skipped'], state['failures_total'],
+            state['successes_total']) == (2, 3, 4, 2)
+
+    # Breakers aren't shared between instances
+    assert CircuitBreakers().get_states() == {}
+
+
+def test_circuit_breaker_states():
+    """
+    Breakers are restored in a later run, a half-open one letting a call
+    through again
+    """
+    breakers = CircuitBreakers({'breaker_threshold': 1})
+    breakers.failed('host example.org')
+    breakers.failed('host example.net')
+    states = breakers.get_states()
+    states['host example.net']['state'] = HALF_OPEN
+
+    breakers = CircuitBreakers()
+    breakers.load_states(states)
+    assert breakers.pop_changes() == {}
+    with pytest.raises(CircuitOpen):
+        breakers.check('host example.org')
+    breakers.check('host example.net')
+
+    # Only the breakers used since they were loaded are saved again
+    assert sorted(breakers.pop_changes()) == ['host example.net',
+                                              'host example.org']
+    assert breakers.pop_changes() == {}
+    breakers.succeeded('host example.net')
+    assert breakers.pop_changes()['host example.net']['state'] == CLOSED
+
+
+class FailingClient(GenericClient):
+    """
+    Client failing to post
+    """
+    posts = 0
+
+    def post(self, feed, entry):
+        self.posts += 1
+        raise requests.exceptions.ConnectionError('Network is down')
+
+
+def test_client_breaker():
+    """
+    Posts to a failing client are skipped right away once its breaker is
+    open
+    """
+    client = FailingClient()
+    client.set_common_opts({'name': 'failing'})
+    client.set_circuit_breakers(CircuitBreakers({'breaker_threshold': 2}))
+    feed = GenericFeed({'path': 'feed.rss'})
+
+    for _ in range(2):
+        with pytest.raises(requests.exceptions.ConnectionError):
+            client.post_within_limits(FeedSporaEntry(), feed)
+    with pytest.raises(CircuitOpen):
+        client.post_within_limits(FeedSporaEntry(), feed)
+    assert client.posts == 2
+
+
+class MediaClient(GenericClient):
+    """
+    Client failing to download the media of its posts
+    """
+
+    def post(self, feed, entry):
+        return self.download_media(MEDIA_URL)
+
+
+# pylint: disable=no-member
+@responses.activate
+# pylint: enable=no-member
+def test_client_breaker_media():
+    """
+    Only the errors of the client API count as failures of its breaker
+    """
+    client = MediaClient()
+    client.set_common_opts({'name': 'media'})
+    client.set_circuit_breakers(CircuitBreakers({'breaker_threshold': 1}))
+    feed = GenericFeed({'path': 'feed.rss'})
+    responses.add(responses.GET, MEDIA_URL,
+                  body=requests.exceptions.ConnectionError('Host is down'))
+
+    with requests_cache.disabled():
+        for _ in range(2):
+            with pytest.raises(MediaError):
+                client.post_within_limits(FeedSporaEntry(), feed)
+    assert client.get_circuit_breakers().get_states()['client media'][
+        'state'] == CLOSED
+
+
+# pylint: disable=no-member
+@responses.activate
+# pylint: enable=no-member
+def test_feed_host_breaker():
+    """
+    Feeds of a failing host are skipped right away once its breaker is open
+    """
+    breakers = CircuitBreakers({'breaker_threshold': 2})
+    responses.add(responses.GET, FEED_URL,
+                  body=requests.exceptions.ConnectionError('Host is down'))
+
+    with requests_cache.disabled():
+        for _ in range(3):
+            feed = GenericFeed({'path': FEED_URL})
+            feed.set_circuit_breakers(breakers)
+            assert feed.feed_generator() is None
+    assert len(responses.calls) == 2
+    assert breakers.get_states()['host aurelien.latitude77.org'][
+        'skipped'] == 1
+
+    # Server errors count as failures too, and only skip the feed
+    breakers = CircuitBreakers({'breaker_threshold': 1})
+    responses.replace(responses.GET, FEED_URL, status=503)
+    with requests_cache.disabled():
+        feed = GenericFeed({'path': FEED_URL})
+        feed.set_circuit_breakers(breakers)
+        assert feed.feed_generator() is None
+    assert breakers.get_states()['host aurelien.latitude77.org'][
+        'state'] == OPEN
+
+
+def test_runner_breakers(tmp_path):
+    """
+    The runner shares its breakers with its clients and feeds, and keeps
+    them from one run to the next
+    """
+    runner = make_runner(tmp_path / "breakers.db", {'breaker_threshold': 1})
+    client = FailingClient()
+    client.set_common_opts({'name': 'failing'})
+    feed = GenericFeed({'path': FEED_URL})
+    runner.connect_client(client)
+    runner.connect_feed(feed)
+
+    runner._load_breakers()
+    assert client.get_circuit_breakers() is feed.get_circuit_breakers()
+    client.get_circuit_breakers().failed('client failing')
+    runner._save_breakers()
+
+    runner._load_breakers()
+    with pytest.raises(CircuitOpen):
+        client.post_within_limits(FeedSporaEntry(), feed)
+    assert client.posts == 0
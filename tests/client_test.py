@@ -5,12 +5,15 @@ import json
 import re
 
 import pytest
+import tweepy
 
 from feedspora.diaspora_client import DiaspyClient
 from feedspora.facebook_client import FacebookClient
+from feedspora.generic_client import GenericClient
 from feedspora.generic_feed import GenericFeed
 from feedspora.linkedin_client import LinkedInClient
 from feedspora.mastodon_client import MastodonClient
+from feedspora.rate_limiter import RateLimited
 from feedspora.shaarpy_client import ShaarpyClient
 from feedspora.tweepy_client import TweepyClient
 from feedspora.wordpress_client import WPClient
@@ -20,9 +23,8 @@ from feedspora.wordpress_client import WPClient
 def entry_generator():
     feed_path = 'feed.atom'
     generic_feed = GenericFeed(feed_path)
-    soup = generic_feed.retrieve_feed_soup(feed_path)
 
-    return generic_feed.parse_atom(soup)
+    return generic_feed.retrieve_feed_entries(feed_path)
 
 
 @pytest.fixture
@@ -92,6 +94,10 @@ def test_DiaspyClient(entry_generator, expected):
 def test_TweepyClient(entry_generator, expected):
     def new_init(obj):
         class fake_provider():
+            class last_response():
+                headers = {'x-rate-limit-remaining': '299',
+                           'x-rate-limit-reset': '0'}
+
             def update_status(self, text):
                 return {'text': text}
 
@@ -131,9 +137,41 @@ def test_TweepyClient(entry_generator, expected):
     TweepyClient.__init__ = old_init
 
 
+def test_TweepyClient_rate_limited(entry_generator):
+    def new_init(obj):
+        class fake_response():
+            headers = {'retry-after': '120',
+                       'x-rate-limit-reset': '0'}
+
+        class fake_provider():
+            def update_status(self, text):
+                raise tweepy.RateLimitError('Rate limit exceeded',
+                                            response=fake_response())
+
+        obj._config = {'name': 'Twitter'}
+        obj._api = fake_provider()
+        obj._link_cost = 23
+        obj._max_len = 280
+        obj.set_common_opts({})
+
+    old_init = TweepyClient.__init__
+    TweepyClient.__init__ = new_init
+    client = TweepyClient()
+    TweepyClient.__init__ = old_init
+
+    entry = next(iter(entry_generator))
+    with pytest.raises(RateLimited) as error:
+        client.post(None, entry)
+    assert error.value.retry_after == 120
+    assert 119 < client.get_rate_limiter().acquire() <= 120
+
+
 def test_MastodonClient(entry_generator, expected):
     def new_init(obj):
         class fake_provider():
+            ratelimit_remaining = 299
+            ratelimit_reset = 0
+
             def media_post(self, media_path=None):
                 return {'id': '0', 'media_path': media_path}
 
@@ -249,3 +287,58 @@ def test_FacebookClient(entry_generator, expected):
     FacebookClient.__init__ = new_init
     check(FacebookClient(), entry_generator, expected, check_entry)
     FacebookClient.__init__ = old_init
+
+
+def test_render_cache(entry_generator):
+    """
+    Clients with the same options share what they render out of an entry
+    """
+    stripped = []
+
+    class CountingClient(GenericClient):
+        def __init__(self, config):
+            self._config = config
+            self.set_common_opts(config)
+
+        def strip_html(self, feed, before_strip, maxlen=None):
+            stripped.append(self._config['name'])
+            return super().strip_html(feed, before_strip, maxlen)
+
+    clients = [CountingClient({'name': 'client1'}),
+               CountingClient({'name': 'client2'}),
+               CountingClient({'name': 'client3',
+                               'tag_filter_opts': 'ignore_content'})]
+    entry = [entry for entry in entry_generator if entry.content][0]
+
+    texts = [client.strip_entry_html(None, entry) for client in clients]
+    assert texts[0] == texts[1]
+    assert stripped == ['client1', 'client3']
+
+    tags = clients[0].filter_tags(None, entry)
+    tags.append('modified')
+    assert clients[1].filter_tags(None, entry) == tags[:-1]
+
+
+def test_compile_options():
+    """
+    Client options are resolved against feed options, and validated
+    """
+    client = GenericClient()
+    client.set_common_opts({'name': 'client', 'max_tags': 3,
+                            'tag_filter_opts': 'ignore_title,case-sensitive',
+                            'url_shortener': 'TinyURL'})
+    feed = GenericFeed({'path': 'feed.atom', 'max_tags': 5,
+                        'post_prefix': 'FEED: '})
+
+    options = client.get_options(feed)
+    assert options.max_tags == 5
+    assert options.post_prefix == 'FEED: '
+    assert options.ignore_title and options.case_sensitive
+    assert not options.ignore_content
+    assert options.url_shortener == 'tinyurl'
+    assert client.get_options(feed) is options
+    assert client.get_options(None).max_tags == 3
+
+    with pytest.raises(ValueError):
+        client.compile_options(GenericFeed({'path': 'feed.atom',
+                                            'max_tags': 'all'}))
@@ -0,0 +1,111 @@
+"""
+Test the database of published entries
+"""
+
+import pytest
+
+from helpers import FakeClient, make_entry, make_runner
+
+from feedspora.feedspora_runner import FeedSpora
+from feedspora.generic_feed import GenericFeed
+from feedspora.state_store import entry_digest
+
+
+@pytest.mark.parametrize("state_store", ["sqlite", "log"])
+def test_load_published_entries(tmp_path, state_store):
+    """
+    Published identifiers are preloaded and kept up to date in memory
+    """
+    runner = make_runner(tmp_path / "preload.db",
+                         {'state_store': state_store})
+    clients = [FakeClient('client1'), FakeClient('client2')]
+    for client in clients:
+        runner.connect_client(client)
+    entries = [make_entry('link%d' % i, 'date%d' % i) for i in range(1200)]
+
+    for entry in entries[::2]:
+        runner.add_to_published_entries(entry, clients[0])
+    runner.add_to_published_entries(entries[1], clients[1])
+
+    # Loaded with several batched queries
+    runner.load_published_entries(entries)
+
+    assert [runner.is_already_published(entry, clients[0])
+            for entry in entries[:4]] == [True, False, True, False]
+    assert [runner.is_already_published(entry, clients[1])
+            for entry in entries[:4]] == [False, True, False, False]
+
+    runner.add_to_published_entries(entries[3], clients[0])
+    assert runner.is_already_published(entries[3], clients[0])
+
+
+def test_commit_published_entries(tmp_path):
+    """
+    Published entries are written in batches of commit_interval entries,
+    and the pending ones are committed on request
+    """
+    runner = make_runner(tmp_path / "commit.db", {'commit_interval': 3})
+    client = FakeClient('client1')
+    runner.connect_client(client)
+    entries = [make_entry('link%d' % i) for i in range(4)]
+
+    def count_stored():
+        return len(runner._store.contains_many(
+            ('client1', runner.entry_identifier(entry))
+            for entry in entries))
+
+    for entry in entries:
+        runner.add_to_published_entries(entry, client)
+    assert count_stored() == 3
+
+    runner.commit_published_entries()
+    assert count_stored() == 4
+
+
+@pytest.mark.parametrize("name", ["commit_interval", "fetch_workers",
+                                  "fetch_per_host", "post_workers"])
+@pytest.mark.parametrize("value", [0, -1, 1.5, "2", True])
+def test_invalid_settings(name, value):
+    """
+    Counts of entries and workers must be positive integers
+    """
+    with pytest.raises(ValueError, match=name):
+        FeedSpora().set_settings({name: value})
+
+
+def test_http_pool_size():
+    """
+    The HTTP connection pool holds a connection for each feed of a host
+    retrieved at once
+    """
+    FeedSpora().set_settings({'fetch_per_host': 4, 'http_pool_size': 4})
+    with pytest.raises(ValueError, match='http_pool_size'):
+        FeedSpora().set_settings({'fetch_per_host': 5})
+    with pytest.raises(ValueError, match='http_pool_size'):
+        FeedSpora().set_settings({'http_pool_size': 1})
+
+
+def test_entry_identity():
+    """
+    Entries are identified according to the entry_identity feed option
+    """
+    runner = FeedSpora()
+    entry = make_entry('link', 'date')
+    entry.guid = 'guid'
+
+    def identifier(entry_identity):
+        feed = GenericFeed({'path': 'feed.atom',
+                            'entry_identity': entry_identity})
+        return runner.entry_identifier(entry, feed)
+
+    assert runner.entry_identifier(entry) == entry_digest('link date')
+    assert identifier('link_date') == entry_digest('link date')
+    assert identifier('link') == entry_digest('link')
+    assert identifier('guid') == entry_digest('guid')
+    assert len(identifier('guid')) == 16
+
+    # Fall back on link and date for entries without a GUID
+    entry.guid = None
+    assert identifier('guid') == entry_digest('link date')
+
+
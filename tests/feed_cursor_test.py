@@ -0,0 +1,38 @@
+"""
+Test the cursors of the feeds
+"""
+
+from helpers import FakeClient, make_runner
+
+from feedspora.generic_feed import GenericFeed, parse_date
+
+
+def test_feed_cursor(tmp_path):
+    """
+    The feed cursor only advances up to the first entry left to publish,
+    and older entries are then skipped
+    """
+    runner = make_runner(tmp_path / "cursor.db")
+    client = FakeClient('client1')
+    runner.connect_client(client)
+    feed = GenericFeed({'path': 'feed.rss', 'cursor': True})
+    entries = feed.retrieve_feed_entries('feed.rss')
+
+    # Every entry is published, except the 5th newest one
+    runner.load_published_entries(entries, feed)
+    for entry in entries[:-5] + entries[-4:]:
+        runner.add_to_published_entries(entry, client, feed)
+    runner._save_feed_cursor(feed, entries)
+
+    feed = GenericFeed({'path': 'feed.rss', 'cursor': True})
+    runner._load_feed_cursor(feed)
+    assert feed.get_cursor() == parse_date(entries[-6].published_date)
+    assert [entry.link for entry in feed.feed_generator()] == \
+        [entry.link for entry in entries[-5:]]
+    assert feed.is_partially_read()
+
+    # Not relevant to other clients
+    runner.connect_client(FakeClient('client2'))
+    feed = GenericFeed({'path': 'feed.rss', 'cursor': True})
+    runner._load_feed_cursor(feed)
+    assert feed.get_cursor() is None
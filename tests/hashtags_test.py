@@ -0,0 +1,50 @@
+"""
+Test the splitting of the hashtags ending a text
+"""
+
+from feedspora.hashtags import split_ending_tags
+
+
+def test_split_ending_tags():
+    """
+    Ending tags are removed along with the whitespace before them, and
+    returned in order without duplicates
+    """
+    assert split_ending_tags('Some text #one #two\t#one') == \
+        ('Some text', ['two', 'one'])
+    assert split_ending_tags('Some text #one\n #two\n') == \
+        ('Some text\n', ['one', 'two'])
+    assert split_ending_tags('#only #tags') == ('', ['only', 'tags'])
+    assert split_ending_tags('Some #inline text') == ('Some #inline text', [])
+    assert split_ending_tags('Some text#glued') == ('Some text#glued', [])
+    assert split_ending_tags('Some text #not-a-tag') == \
+        ('Some text #not-a-tag', [])
+    assert split_ending_tags('') == ('', [])
+
+
+class CountingStr(str):
+    """
+    String counting the characters read from it one at a time
+    """
+    reads = 0
+
+    def __getitem__(self, key):
+        if isinstance(key, int):
+            CountingStr.reads += 1
+        return super().__getitem__(key)
+
+
+def test_split_ending_tags_single_scan():
+    """
+    Content is scanned once, whatever the number of ending tags
+    """
+    assert split_ending_tags('Some text' + ' #tag' * 20000) == \
+        ('Some text', ['tag'])
+    for number in (10, 10000):
+        content = CountingStr('Some text' + ' #tag%d' % number * number)
+        CountingStr.reads = 0
+        assert split_ending_tags(content) == \
+            ('Some text', ['tag%d' % number])
+        # Each character is read at most twice (checked, then the one
+        # ending a run of word characters or whitespace)
+        assert CountingStr.reads <= 2 * len(content)
@@ -4,6 +4,8 @@ from pathlib import Path
 from unittest.mock import patch
 
 from feedspora.__main__ import main
+from feedspora.feedspora_runner import FeedSpora
+from feedspora.generic_feed import FeedSporaEntry
 
 def list_cmp(a_list, b_list):
     """
@@ -89,3 +91,81 @@ def check_feed(capsys, feedtype):
 
     if dbfile.exists():
         dbfile.unlink()
+
+
+def make_runner(db_file, settings=None):
+    """
+    Return a FeedSpora instance with an initialized state store
+    """
+    runner = FeedSpora()
+    runner.set_settings(settings)
+    runner.set_db_file(str(db_file))
+    runner._init_db()
+
+    return runner
+
+
+class FakeClient:
+    """
+    Minimal client, only providing its name
+    """
+
+    def __init__(self, name):
+        self._config = {'name': name}
+
+    def get_config(self):
+        """
+        Return the client configuration
+        """
+        return self._config
+
+
+class PostingClient(FakeClient):
+    """
+    Client recording the entries it posted, or failing. With a barrier, it
+    waits for the other posts to reach it before posting.
+    """
+
+    def __init__(self, name, fail=False, delay=0, barrier=None):
+        super().__init__(name)
+        self._config['max_posts'] = 0
+        self.fail = fail
+        self.delay = delay
+        self.barrier = barrier
+        self.posted = []
+        self.entries = []
+
+    def get_send_delay(self):
+        """
+        Return the delay between posts
+        """
+        return self.delay
+
+    def post_within_limits(self, entry_to_post, feed):
+        """
+        Post the entry, or fail
+        """
+        if self.barrier:
+            self.barrier.wait()
+        if self.fail:
+            raise RuntimeError('Failed')
+        self.posted.append(entry_to_post.link)
+        self.entries.append(entry_to_post)
+        return True
+
+    def seeding_published_db(self, entry_count, feed, feed_count):
+        """
+        Never seed the database
+        """
+        return False
+
+
+def make_entry(link, published_date=None):
+    """
+    Return a FeedSporaEntry with the specified link and date
+    """
+    entry = FeedSporaEntry()
+    entry.link = link
+    entry.published_date = published_date
+
+    return entry
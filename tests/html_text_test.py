@@ -0,0 +1,89 @@
+"""
+Test the conversion of HTML contents to text
+"""
+
+import html
+
+import lxml.html
+
+from feedspora.generic_client import GenericClient
+from feedspora.generic_feed import GenericFeed
+from feedspora.html_text import html_to_text, parse_html_text, strip_markup
+
+
+def test_html_to_text():
+    """
+    The text is the one of the document lxml would build, but for the
+    whitespace around line breaks and blocks
+    """
+    for path in ('feed.atom', 'feed.rss', 'content_tags.rss'):
+        feed = GenericFeed({'path': path})
+        for entry in feed.retrieve_feed_entries(path):
+            if entry.content:
+                assert html_to_text(entry.content).split() == \
+                    lxml.html.fromstring(entry.content).text_content().split()
+
+    assert html_to_text('') == ''
+    assert html_to_text('<!-- nothing -->') == ''
+
+
+def test_html_to_text_spacing():
+    """
+    Line breaks and blocks are turned into newlines
+    """
+    assert html_to_text('<p>One <b>two</b> </p>\n<p>Three<br>four<br/><br>'
+                        'five</p><ul><li>six</li> <li>seven</li></ul>'
+                        '<div>eight</div>nine') == \
+        'One two\n\nThree\nfour\n\nfive\n\nsix\nseven\n\neight\nnine'
+    assert html_to_text('<br><p>Text</p><br>') == 'Text'
+    assert strip_markup('&lt;p&gt;Fish&lt;/p&gt;&lt;p&gt;chips&lt;/p&gt;') == \
+        ('Fish\n\nchips', True)
+
+
+def test_strip_markup():
+    """
+    Escaped HTML is parsed again, until it no longer looks like markup
+    """
+    assert strip_markup('&lt;p&gt;Fish &amp;amp; chips&lt;/p&gt;') == \
+        ('Fish & chips', True)
+    assert strip_markup(' Fish and chips\n') == ('Fish and chips', True)
+    assert strip_markup('<3 & more') == ('<3 & more', True)
+
+
+def test_strip_markup_maxlen():
+    """
+    With maxlen, escaped HTML is only parsed up to what is needed, and the
+    beginning of the text is returned
+    """
+    paragraph = '<p>Some <em>text</em> &amp; more</p>\n'
+    content = html.escape(paragraph * 1000)
+    text = strip_markup(content)[0]
+
+    beginning, complete = strip_markup(content, 100)
+    assert not complete
+    assert len(beginning) > 100
+    assert len(beginning) < len(text)
+    assert text.startswith(beginning)
+
+    # The text parsed so far is all the parser is sure of
+    assert parse_html_text('<p>Some <em', complete=False) == \
+        ('Some ', False)
+
+
+def test_strip_html_maxlen():
+    """
+    The beginning of the content returned with maxlen is never one the tags
+    ending the content would take away
+    """
+    client = GenericClient()
+    client.set_common_opts({})
+    contents = [html.escape('<p>Some text</p>\n' * 100),
+                html.escape('<p>Some text</p>' + ' #tag' * 100),
+                html.escape('<p>Some text #not #the #end</p> more text' * 20)]
+
+    for content in contents:
+        text = client.strip_html(None, content)
+        for maxlen in (5, 50, 500):
+            beginning = client.strip_html(None, content, maxlen)
+            assert text.startswith(beginning)
+            assert len(beginning) > maxlen or beginning == text
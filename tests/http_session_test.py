@@ -0,0 +1,36 @@
+"""
+Test the shared HTTP session
+"""
+
+import requests_cache
+import responses
+
+from feedspora import http_session
+
+
+# pylint: disable=no-member
+@responses.activate
+# pylint: enable=no-member
+def test_shared_session():
+    """
+    Requests share a session, with the configured User-Agent
+    """
+    url = "http://aurelien.latitude77.org/feed.atom"
+    responses.add(responses.GET, url, body='feed', status=200)
+
+    # Other tests may have installed a global requests cache
+    with requests_cache.disabled():
+        http_session.configure({'user_agent': 'FeedSpora'})
+        session = http_session.get_session()
+        assert http_session.get(url).text == 'feed'
+        assert http_session.get_session() is session
+        assert responses.calls[0].request.headers['User-Agent'] == \
+            'FeedSpora'
+
+        # Settings not specified are reset to their defaults
+        http_session.configure(None)
+        assert http_session.get_session() is not session
+        http_session.get(url)
+        assert responses.calls[1].request.headers['User-Agent'] == \
+            http_session.USER_AGENT
+        http_session.close()
@@ -0,0 +1,82 @@
+"""
+Test the media cache
+"""
+
+import os
+
+import requests_cache
+import responses
+
+from feedspora import media_cache
+from feedspora.generic_client import GenericClient
+
+IMAGE_URL = "http://aurelien.latitude77.org/images/picture.png"
+COPY_URL = "http://aurelien.latitude77.org/copy"
+
+
+# pylint: disable=no-member
+@responses.activate
+# pylint: enable=no-member
+def test_media_cache(tmp_path, monkeypatch):
+    """
+    Media are downloaded once per run, revalidated in later runs, and
+    stored once per content
+    """
+    monkeypatch.setenv('MEDIA_DIR', str(tmp_path))
+    responses.add(responses.GET, IMAGE_URL, body=b'picture',
+                  headers={'ETag': '"v1"'})
+    responses.add(responses.GET, IMAGE_URL, status=304)
+    responses.add(responses.GET, COPY_URL, body=b'picture',
+                  headers={'Content-Disposition': 'filename="../copy.png"'})
+
+    # Other tests may have installed a global requests cache
+    with requests_cache.disabled():
+        media_cache.configure(None)
+        path = media_cache.fetch(IMAGE_URL)
+        assert os.path.basename(path) == 'picture.png'
+        with open(path, 'rb') as media_file:
+            assert media_file.read() == b'picture'
+        assert media_cache.fetch(IMAGE_URL) == path
+        assert len(responses.calls) == 1
+
+        # Same content, other URL
+        assert media_cache.fetch(COPY_URL) == path
+
+        # Next run
+        media_cache.close()
+        assert media_cache.fetch(IMAGE_URL) == path
+        assert responses.calls[2].request.headers['If-None-Match'] == '"v1"'
+
+        # When testing, the path doesn't depend on the content
+        client = GenericClient()
+        client.set_testing_root({})
+        assert client.download_media(IMAGE_URL) == \
+            os.path.join(str(tmp_path), 'picture.png')
+        media_cache.close()
+
+
+# pylint: disable=no-member
+@responses.activate
+# pylint: enable=no-member
+def test_media_cache_limits(tmp_path, monkeypatch):
+    """
+    Media larger than media_max_size are ignored, and the least recently
+    used ones are evicted beyond media_cache_size
+    """
+    monkeypatch.setenv('MEDIA_DIR', str(tmp_path))
+    megabyte = b'x' * media_cache.MEGABYTE
+    urls = [IMAGE_URL.replace('.png', '%d.png' % number)
+            for number in range(3)]
+    large_url = IMAGE_URL.replace('.png', '-large.png')
+    for number, url in enumerate(urls):
+        responses.add(responses.GET, url, body=megabyte[1:] + b'%d' % number)
+    responses.add(responses.GET, large_url, body=megabyte * 2)
+
+    with requests_cache.disabled():
+        media_cache.configure({'media_cache_size': 2, 'media_max_size': 1})
+        assert media_cache.fetch(large_url) is None
+        paths = [media_cache.fetch(url) for url in urls]
+        media_cache.close()
+
+    assert [os.path.exists(path) for path in paths] == [False, True, True]
+    media_cache.configure(None)
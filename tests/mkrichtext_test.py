@@ -1,10 +1,12 @@
 #!/usr/bin/env python
 
 import random
+import re
 import string
 
 import pytest
 
+from feedspora import hashtags
 from feedspora.generic_client import GenericClient
 
 
@@ -114,3 +116,60 @@ def test_mkrichtext_tags():
         expected = testcases[input]['expected']
         output = GenericClient()._mkrichtext(input, tags, 500)
         assert output == expected
+
+
+def test_mkrichtext_single_pass(testcases):
+    '''
+    Test that tags looked up in a single pass give the same text as with
+    one regular expression per tag
+    '''
+    # Large tag vocabularies
+    text = ' '.join(testcases)
+    words = [re.sub(r'[\-\.]', '', word)
+             for tags in testcases.values() for word in tags]
+    assert hashtags.add_hashtags(text, words, '_|') == \
+        hashtags._add_hashtags_regex(text, words, '_|')
+
+    chars = 'aAbB#, .()[]{}\'"/!?:-\n_|é'
+    for _ in range(2000):
+        text = ''.join(random.choice(chars)
+                       for _ in range(random.randint(0, 25)))
+        tags = [''.join(random.choice('aAbB.-é')
+                        for _ in range(random.randint(1, 3)))
+                for _ in range(random.randint(0, 4))]
+        testcases[text] = tags
+
+    for (text, tags) in testcases.items():
+        words = [re.sub(r'[\-\.]', '', word) for word in tags]
+        assert hashtags.add_hashtags(text, tags, '_|') == \
+            hashtags._add_hashtags_regex(text, words, '_|')
+
+
+def test_mkrichtext_fold(monkeypatch):
+    '''
+    Test that texts with punctuation, symbols and non-Latin letters are
+    looked up in a single pass, and that characters folded differently by
+    re.IGNORECASE give the same text either way
+    '''
+    chars = 'aIiSsKk #,.’—…\U0001f600éΔδ' \
+        'жµμİıſ\u212a\u212båςσ'
+    for _ in range(2000):
+        text = ''.join(random.choice(chars)
+                       for _ in range(random.randint(0, 25)))
+        tags = [''.join(random.choice(chars.replace(' #,.', ''))
+                        for _ in range(random.randint(1, 3)))
+                for _ in range(random.randint(0, 4))]
+        assert hashtags.add_hashtags(text, tags, '_|') == \
+            hashtags._add_hashtags_regex(text, tags, '_|')
+
+    text = 'L’été — Δελφοί et café… \U0001f600'
+    tags = ['café', 'Δελφοί', 'ete']
+    expected = hashtags._add_hashtags_regex(text, tags, ' |')
+    assert expected[0] == 'L’été — #Δελφοί et café… \U0001f600 | ' \
+        '#café #ete'
+
+    def no_regex(text, words, separator):
+        raise AssertionError("Regular expressions used for %r" % text)
+
+    monkeypatch.setattr(hashtags, '_add_hashtags_regex', no_regex)
+    assert hashtags.add_hashtags(text, tags, ' |') == expected
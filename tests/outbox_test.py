@@ -0,0 +1,153 @@
+"""
+Test the outbox of failed posts
+"""
+
+import time
+
+from helpers import PostingClient, make_entry, make_runner
+
+from feedspora.generic_feed import GenericFeed
+from feedspora.outbox import DEAD_LETTERS, OUTBOX, Outbox
+from feedspora.state_store import DAY, STATE_STORES
+
+SETTINGS = {'outbox_backoff': 60, 'outbox_max_attempts': 3}
+
+
+def test_outbox(tmp_path):
+    """
+    Failed posts are attempted again with an exponential backoff, kept
+    from one run to the next, then dead-lettered
+    """
+    store = STATE_STORES['sqlite'](str(tmp_path / 'outbox.db'))
+    store.open()
+    outbox = Outbox(store, SETTINGS)
+    post = {'client': 'client', 'feed': 'feed.rss', 'entry': {}}
+
+    start = time.time()
+    outbox.failed('key', post, RuntimeError('Failed'))
+    assert 'key' in outbox
+    assert outbox.due(10) == []
+    waiting = store.get_state(OUTBOX, 'key')
+    assert waiting['attempts'] == 1
+    assert waiting['error'] == 'Failed'
+    assert 60 <= waiting['next_attempt'] - start < 61
+
+    outbox.failed('key', waiting, RuntimeError('Failed again'))
+    assert 120 <= store.get_state(OUTBOX, 'key')['next_attempt'] - start \
+        < 121
+
+    # Next runs
+    outbox = Outbox(store, dict(SETTINGS, outbox_backoff=0))
+    outbox.failed('other', post, RuntimeError('Failed'))
+    assert [key for key, _ in outbox.due(1)] == ['other']
+    outbox.remove('other')
+    assert store.get_state(OUTBOX, 'other') is None
+
+    outbox = Outbox(store, SETTINGS)
+    outbox.failed('key', store.get_state(OUTBOX, 'key'),
+                  RuntimeError('Failed at last'))
+    assert 'key' not in outbox
+    assert outbox.is_dead('key')
+    assert not outbox.is_dead('other')
+    assert store.get_all_states(OUTBOX) == {}
+    assert store.get_state(DEAD_LETTERS, 'key')['attempts'] == 3
+    assert Outbox(store, SETTINGS).is_dead('key')
+    store.close()
+
+
+def test_deliver_outbox(tmp_path):
+    """
+    Failed posts are left to the outbox, and only attempted again from it,
+    with the entry as it was
+    """
+    runner = make_runner(tmp_path / "outbox.db", {'outbox_backoff': 0})
+    clients = [PostingClient('client'), PostingClient('failing', fail=True)]
+    for client in clients:
+        runner.connect_client(client)
+    feed = GenericFeed({'path': 'feed.rss'})
+    runner.connect_feed(feed)
+    entry = make_entry('link0')
+    entry.title = 'Title'
+    entry.tags = {'title': [], 'content': ['tag'], 'category': []}
+
+    runner._outbox = Outbox(runner._store, runner._settings)
+    runner._publish_entry(entry, 1, feed, 1)
+    runner._publish_entry(entry, 1, feed, 1)
+    assert len(runner._outbox) == 1
+    assert clients[0].posted == ['link0']
+
+    # Delivered from the outbox once the client is back
+    clients[1].fail = False
+    runner._outbox = Outbox(runner._store, runner._settings)
+    runner._deliver_outbox()
+    assert len(runner._outbox) == 0
+    assert clients[1].posted == ['link0']
+    assert clients[1].entries[0].tags == entry.tags
+    assert runner.is_already_published(entry, clients[1], feed)
+
+
+def test_deliver_published(tmp_path):
+    """
+    Posts published meanwhile are removed from the outbox, whatever entries
+    were loaded last
+    """
+    runner = make_runner(tmp_path / "published.db", {'outbox_backoff': 0})
+    client = PostingClient('failing', fail=True)
+    runner.connect_client(client)
+    feed = GenericFeed({'path': 'feed.rss'})
+    runner.connect_feed(feed)
+    entry = make_entry('link0')
+
+    runner._outbox = Outbox(runner._store, runner._settings)
+    runner._publish_entry(entry, 1, feed, 1)
+    assert len(runner._outbox) == 1
+    runner._store.add_many([('failing', runner.entry_identifier(entry, feed),
+                             None)])
+    runner.load_published_entries([make_entry('link1')], feed)
+
+    client.fail = False
+    runner._deliver_outbox()
+    assert len(runner._outbox) == 0
+    assert client.posted == []
+
+
+def test_dead_letters(tmp_path):
+    """
+    Dead-lettered posts aren't attempted again in later runs
+    """
+    runner = make_runner(tmp_path / "dead.db", {'outbox_max_attempts': 1})
+    clients = [PostingClient('client'), PostingClient('failing', fail=True)]
+    for client in clients:
+        runner.connect_client(client)
+    feed = GenericFeed({'path': 'feed.rss'})
+    runner.connect_feed(feed)
+    entry = make_entry('link0')
+
+    runner._outbox = Outbox(runner._store, runner._settings)
+    runner._publish_entry(entry, 1, feed, 1)
+    assert len(runner._outbox) == 0
+    assert len(runner._store.get_all_states(DEAD_LETTERS)) == 1
+
+    # Next run: the feed is read again, and the client is back
+    clients[1].fail = False
+    runner._outbox = Outbox(runner._store, runner._settings)
+    runner._publish_entry(entry, 1, feed, 1)
+    runner._deliver_outbox()
+    assert clients[1].posted == []
+    assert not runner.is_already_published(entry, clients[1], feed)
+
+    # Taken care of, as far as the feed is concerned
+    assert runner.is_published_everywhere(entry, feed)
+
+    # Forgotten with the old published entries, unless still in its feed
+    key, post = runner._store.get_all_states(DEAD_LETTERS).popitem()
+    runner._store.set_state(DEAD_LETTERS, key,
+                            dict(post, dead_since=time.time() - 2 * DAY))
+    runner._feed_windows = {runner.feed_identifier(feed):
+                            {runner.entry_identifier(entry, feed)}}
+    runner._prune_store(1)
+    assert runner._outbox.is_dead(key)
+    runner._feed_windows = {}
+    runner._prune_store(1)
+    assert not runner._outbox.is_dead(key)
+    assert runner._store.get_all_states(DEAD_LETTERS) == {}
@@ -2,15 +2,17 @@
 Test Atom/RSS feed retrieval and parsing
 """
 
+import requests_cache
 import responses
 
+from feedspora import http_session
 from feedspora.generic_feed import GenericFeed
 
 
 # pylint: disable=no-member
 @responses.activate
 # pylint: enable=no-member
-def test_retrieve_feed_soup():
+def test_retrieve_feed_entries():
     """
     Test file/url retrieval
     """
@@ -31,7 +33,7 @@ def test_retrieve_feed_soup():
 
     for source in sources:
         generic_feed = GenericFeed(source)
-        generic_feed.retrieve_feed_soup(source)
+        assert generic_feed.retrieve_feed_entries(source)
 
 
 def test_atom_parser():
@@ -40,9 +42,9 @@ def test_atom_parser():
     """
     filename = "feed.atom"
     generic_feed = GenericFeed(filename)
-    soup = generic_feed.retrieve_feed_soup(filename)
-    generated = generic_feed.parse_atom(soup)
-    assert [_ for _ in generated]
+    entries = generic_feed.retrieve_feed_entries(filename)
+    assert entries
+    assert all(entry.link.startswith('http') for entry in entries)
 
 
 def test_rss_parser():
@@ -51,6 +53,97 @@ def test_rss_parser():
     """
     filename = "feed.rss"
     generic_feed = GenericFeed(filename)
-    soup = generic_feed.retrieve_feed_soup(filename)
-    generated = generic_feed.parse_rss(soup)
-    assert [_ for _ in generated]
+    entries = generic_feed.retrieve_feed_entries(filename)
+    assert entries
+    assert all(entry.link.startswith('http') for entry in entries)
+
+
+# pylint: disable=no-member
+@responses.activate
+# pylint: enable=no-member
+def test_conditional_retrieval():
+    """
+    Test that unchanged feeds are not parsed again
+    """
+    url = "http://aurelien.latitude77.org/feed.atom"
+    with open("feed.atom") as fhandler:
+        body = fhandler.read()
+    responses.add(responses.GET, url, body=body, status=200,
+                  headers={'ETag': '"v1"'})
+    responses.add(responses.GET, url, status=304)
+    responses.add(responses.GET, url, body=body, status=200)
+
+    # Other tests may have installed a global requests cache
+    with requests_cache.disabled():
+        http_session.close()
+        generic_feed = GenericFeed(url)
+        assert generic_feed.retrieve_feed_entries(url) is not None
+        validators = generic_feed.get_fetched_validators()
+        assert validators['etag'] == '"v1"'
+
+        # Server answers 304 to the conditional request
+        generic_feed.set_validators(validators)
+        assert generic_feed.retrieve_feed_entries(url) is None
+        assert generic_feed.is_unchanged()
+        assert responses.calls[1].request.headers['If-None-Match'] == '"v1"'
+
+        # Server ignores the conditional request, but the content is the
+        # same
+        assert generic_feed.retrieve_feed_entries(url) is None
+        assert generic_feed.is_unchanged()
+        http_session.close()
+
+    # Local files are compared too
+    generic_feed = GenericFeed("feed.atom")
+    assert generic_feed.feed_generator() is not None
+    generic_feed.set_validators(generic_feed.get_fetched_validators())
+    assert generic_feed.feed_generator() is None
+
+
+def test_stop_after_published():
+    """
+    Test that scanning stops after a run of published entries
+    """
+    entries = GenericFeed("feed.rss").retrieve_feed_entries("feed.rss")
+    # The 2 newest entries are new, the next 3 ones were published
+    published = {entry.link for entry in entries[-5:-2]}
+
+    generic_feed = GenericFeed({'path': "feed.rss",
+                                'stop_after_published': 2})
+    scanned = list(generic_feed.feed_generator(
+        lambda entry: entry.link in published))
+    assert [entry.link for entry in scanned] == \
+        [entry.link for entry in entries[-4:]]
+    assert generic_feed.is_partially_read()
+
+    # Without the option, the whole feed is read
+    generic_feed = GenericFeed("feed.rss")
+    scanned = list(generic_feed.feed_generator(
+        lambda entry: entry.link in published))
+    assert len(scanned) == len(entries)
+    assert not generic_feed.is_partially_read()
+
+
+def test_lazy_entry_fields():
+    """
+    Test that derived entry fields are only computed once, when needed
+    """
+    generic_feed = GenericFeed("content_tags.rss")
+    calls = []
+    get_tag_lists = generic_feed.get_tag_lists
+
+    def counting_get_tag_lists(*args):
+        calls.append(args)
+        return get_tag_lists(*args)
+    generic_feed.get_tag_lists = counting_get_tag_lists
+
+    entry = generic_feed.retrieve_feed_entries("content_tags.rss")[-1]
+    assert not calls
+    assert not hasattr(entry, '__dict__')
+
+    assert entry.tags['category'] == ['T-Shirt']
+    assert 'MontyPythonsFlyingCircus' in entry.tags['content']
+    assert len(calls) == 1
+    assert entry.text.startswith('#MontyPythonsFlyingCircus')
+    assert entry.media_url == \
+        'https://www.wildkidz.com/getImage.php?idx=926'
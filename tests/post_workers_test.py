@@ -0,0 +1,77 @@
+"""
+Test posting entries to all clients concurrently
+"""
+
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from helpers import PostingClient, make_entry, make_runner
+
+from feedspora.generic_feed import FeedSporaEntry, GenericFeed
+
+
+def test_post_workers(tmp_path):
+    """
+    Entries are posted to all clients concurrently, one entry after the
+    other, and recorded in the state store
+    """
+    runner = make_runner(tmp_path / "fanout.db", {'post_workers': 4})
+    # Posts only go through once all clients are posting at the same time
+    barrier = threading.Barrier(4, timeout=10)
+    clients = [PostingClient('client%d' % i, barrier=barrier)
+               for i in range(3)] + \
+        [PostingClient('failing', fail=True, barrier=barrier)]
+    for client in clients:
+        runner.connect_client(client)
+    feed = GenericFeed({'path': 'feed.rss'})
+    entries = [make_entry('link%d' % i) for i in range(2)]
+
+    runner._post_executor = ThreadPoolExecutor(max_workers=4)
+    for count, entry in enumerate(entries):
+        runner._publish_entry(entry, count + 1, feed, count + 1)
+    runner._post_executor.shutdown()
+
+    assert not barrier.broken
+    assert [client.posted for client in clients] == \
+        [['link0', 'link1']] * 3 + [[]]
+    assert feed.get_posts_done() == 2
+    assert [runner.is_already_published(entry, client, feed)
+            for entry in entries for client in clients] == \
+        [True, True, True, False] * 2
+
+
+class ImageFeed(GenericFeed):
+    """
+    Feed counting the lookups of entry images, each waiting for another
+    """
+
+    def __init__(self):
+        super().__init__({'path': 'feed.rss'})
+        self.lookups = 0
+        self.looking_up = threading.Event()
+
+    def find_rss_image_url(self, media_sources, content, link):
+        """
+        Return the image, after giving another client time to ask for it
+        """
+        self.lookups += 1
+        self.looking_up.set()
+        threading.Event().wait(0.1)
+        return 'http://example.org/image.png'
+
+
+def test_media_url_once(tmp_path):
+    """
+    Clients posting an entry concurrently find its image only once
+    """
+    feed = ImageFeed()
+    entry = FeedSporaEntry(feed, media_sources={})
+
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        first = executor.submit(lambda: entry.media_url)
+        feed.looking_up.wait(10)
+        second = executor.submit(lambda: entry.media_url)
+
+    assert first.result() == second.result() == \
+        'http://example.org/image.png'
+    assert feed.lookups == 1
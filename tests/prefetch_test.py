@@ -0,0 +1,110 @@
+"""
+Test retrieving the feeds concurrently
+"""
+
+import threading
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+
+from feedspora.feedspora_runner import FeedSpora
+from feedspora.generic_feed import GenericFeed
+
+
+class HostTracker:
+    """
+    Record the retrievals of feeds, and the highest number of concurrent
+    retrievals by host. Retrievals are held until released.
+    """
+
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.started = []
+        self.running = {}
+        self.peak = {}
+        self.released = threading.Event()
+
+    def fetch(self, feed):
+        """
+        Retrieve a feed, once released
+        """
+        host = urllib.parse.urlparse(feed.get_path()).netloc
+        with self.condition:
+            self.started.append(feed)
+            self.running[host] = self.running.get(host, 0) + 1
+            self.peak[host] = max(self.peak.get(host, 0), self.running[host])
+            self.condition.notify_all()
+        self.released.wait(10)
+        with self.condition:
+            self.running[host] -= 1
+
+
+class FakeFeed(GenericFeed):
+    """
+    Feed retrieved through a HostTracker
+    """
+
+    def __init__(self, config, tracker):
+        super().__init__(config)
+        self.tracker = tracker
+
+    def prefetch(self):
+        self.tracker.fetch(self)
+
+
+def make_runner(tracker, settings, count):
+    """
+    Return a runner with count feeds, spread over two hosts
+    """
+    runner = FeedSpora()
+    runner.set_settings(settings)
+    for i in range(count):
+        runner.connect_feed(FakeFeed(
+            {'path': 'https://host%d.org/feed%d' % (i % 2, i)}, tracker))
+
+    return runner
+
+
+def test_prefetch_per_host():
+    """
+    Feeds are retrieved concurrently, at most fetch_per_host at a time from
+    the same host
+    """
+    tracker = HostTracker()
+    runner = make_runner(tracker, {'fetch_workers': 6, 'fetch_per_host': 2},
+                         6)
+    processed = []
+
+    with ThreadPoolExecutor(max_workers=6) as executor:
+        consumer = threading.Thread(
+            target=lambda: processed.extend(runner._prefetch_feeds(executor)))
+        consumer.start()
+        with tracker.condition:
+            assert tracker.condition.wait_for(
+                lambda: len(tracker.peak) == 2 and
+                min(tracker.peak.values()) >= 2, timeout=10)
+            # Without the limit, the third feed of each host is retrieved
+            # right away
+            tracker.condition.wait_for(
+                lambda: max(tracker.peak.values()) > 2, timeout=0.5)
+        tracker.released.set()
+        consumer.join(10)
+
+    assert tracker.peak == {'host0.org': 2, 'host1.org': 2}
+    assert processed == runner._feed
+
+
+def test_prefetch_ahead():
+    """
+    At most fetch_workers feeds are retrieved ahead of the one processed
+    """
+    tracker = HostTracker()
+    tracker.released.set()
+    runner = make_runner(tracker, {'fetch_workers': 2, 'fetch_per_host': 2},
+                         6)
+
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        for count, feed in enumerate(runner._prefetch_feeds(executor)):
+            assert feed is runner._feed[count]
+            assert len(tracker.started) <= count + 2
+
+    assert len(tracker.started) == 6
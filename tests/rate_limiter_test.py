@@ -0,0 +1,186 @@
+"""
+Test the rate limiters of the clients
+"""
+
+import time
+
+import pytest
+
+from helpers import PostingClient, make_entry, make_runner
+
+from feedspora.generic_client import GenericClient
+from feedspora.outbox import Outbox
+from feedspora.generic_feed import FeedSporaEntry, GenericFeed
+from feedspora.rate_limiter import DEFAULT_RETRY_AFTER, RateLimited, \
+    RateLimiter
+
+
+class FakeClock:
+    """
+    Clock only moving when told to
+    """
+
+    def __init__(self):
+        self.now = 1000000
+
+    def __call__(self):
+        return self.now
+
+
+def test_rate_limiter():
+    """
+    Tokens are taken up to the burst, then earned at the configured rate
+    """
+    clock = FakeClock()
+    limiter = RateLimiter(3600, 2, clock)
+    assert [limiter.acquire() for _ in range(2)] == [0, 0]
+    assert limiter.acquire() == 1
+    clock.now += 0.5
+    assert limiter.acquire() == 0.5
+    clock.now += 0.5
+    assert limiter.acquire() == 0
+
+    # No limit
+    limiter = RateLimiter(0, 1, clock)
+    assert [limiter.acquire() for _ in range(100)] == [0] * 100
+
+
+def test_rate_limiter_adaptive():
+    """
+    The remote API information holds posts back until its limit resets
+    """
+    clock = FakeClock()
+    limiter = RateLimiter(0, 1, clock)
+    limiter.update(remaining=0, reset=clock.now + 60)
+    assert limiter.acquire() == 60
+    clock.now += 60
+    assert limiter.acquire() == 0
+
+    limiter = RateLimiter(3600, 10, clock)
+    limiter.update(remaining=1, reset=clock.now + 60)
+    assert limiter.acquire() == 0
+    assert limiter.acquire() == 1
+
+    limiter = RateLimiter(0, 1, clock)
+    limiter.update(retry_after=30)
+    assert limiter.acquire() == 30
+
+
+def test_rate_limiter_state():
+    """
+    The state of a bucket is restored, and tokens earned meanwhile
+    """
+    clock = FakeClock()
+    limiter = RateLimiter(3600, 5, clock)
+    for _ in range(5):
+        limiter.acquire()
+    limiter.update(retry_after=10)
+    state = limiter.get_state()
+
+    restored = RateLimiter(3600, 5, clock)
+    restored.set_state(dict(state, time=state['time'] - 2,
+                            blocked_until=0))
+    assert [restored.acquire() for _ in range(2)] == [0, 0]
+    assert restored.acquire() == 1
+
+    restored.set_state(state)
+    assert restored.acquire() == 10
+
+
+class CountingClient(GenericClient):
+    """
+    Client counting its posts
+    """
+    posts = 0
+
+    def post(self, feed, entry):
+        self.posts += 1
+        return True
+
+
+def test_post_within_limits():
+    """
+    Posts beyond the rate limit are rejected before being sent
+    """
+    client = CountingClient()
+    client.set_common_opts({'name': 'client', 'rate_limit': 60,
+                            'rate_limit_burst': 2})
+    feed = GenericFeed({'path': 'feed.rss'})
+
+    assert client.post_within_limits(FeedSporaEntry(), feed)
+    assert client.post_within_limits(FeedSporaEntry(), feed)
+    with pytest.raises(RateLimited) as error:
+        client.post_within_limits(FeedSporaEntry(), feed)
+    assert 0 < error.value.retry_after <= 60
+    assert client.posts == 2
+
+    # Rejected by the remote API
+    error = client.rate_limited(RuntimeError('Too many requests'))
+    assert error.retry_after == DEFAULT_RETRY_AFTER
+    assert client.get_rate_limiter().acquire() > DEFAULT_RETRY_AFTER - 1
+
+    client = CountingClient()
+    client.set_common_opts({'name': 'client', 'rate_limit': -1})
+    with pytest.raises(ValueError):
+        client.get_rate_limiter()
+
+
+class RateLimitedClient(PostingClient):
+    """
+    Client whose rate limit is always reached
+    """
+
+    def post_within_limits(self, entry_to_post, feed):
+        """
+        Reject the post
+        """
+        raise RateLimited('Rate limit reached', 60)
+
+
+def test_rate_limited(tmp_path):
+    """
+    Posts rejected because of a rate limit are postponed in the outbox,
+    without counting an attempt
+    """
+    runner = make_runner(tmp_path / "rate.db", {'outbox_max_attempts': 1})
+    client = RateLimitedClient('client')
+    runner.connect_client(client)
+    feed = GenericFeed({'path': 'feed.rss'})
+    runner._outbox = Outbox(runner._store, runner._settings)
+
+    start = time.time()
+    runner._publish_entry(make_entry('link0'), 1, feed, 1)
+    post = runner._store.get_all_states('outbox').popitem()[1]
+    assert post['attempts'] == 0
+    assert 60 <= post['next_attempt'] - start < 61
+    assert runner._outbox.due(10) == []
+    assert not runner.is_already_published(make_entry('link0'), client,
+                                           feed)
+
+
+def test_save_rate_limits(tmp_path):
+    """
+    Only the rate limiters used since they were last saved are written
+    """
+    runner = make_runner(tmp_path / "rate.db")
+    clients = [CountingClient(), CountingClient()]
+    for index, client in enumerate(clients):
+        client.set_common_opts({'name': 'client%d' % (index + 1),
+                                'rate_limit': 60})
+        runner.connect_client(client)
+    written = []
+    set_states = runner._store.set_states
+    runner._store.set_states = lambda namespace, values: (
+        written.append(dict(values)), set_states(namespace, values))
+
+    runner._load_rate_limits()
+    runner._save_rate_limits()
+    assert written == [{}]
+    clients[0].get_rate_limiter().acquire()
+    runner._save_rate_limits()
+    runner._save_rate_limits()
+    assert [list(values) for values in written] == [[], ['client1'], []]
+
+    # Restored in the next run
+    runner._load_rate_limits()
+    assert runner._rate_limits['client1'] == written[1]['client1']
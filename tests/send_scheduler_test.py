@@ -0,0 +1,125 @@
+"""
+Test the send scheduler
+"""
+
+import functools
+import threading
+
+from helpers import PostingClient, make_entry, make_runner
+
+from feedspora import feedspora_runner
+from feedspora.generic_feed import GenericFeed
+from feedspora.send_scheduler import SendScheduler
+
+
+class FakeClock:
+    """
+    Clock only moving forward when waiting, recording the waits
+    """
+
+    def __init__(self):
+        self.now = 0
+        self.waits = []
+
+    def time(self):
+        """
+        Return the current time
+        """
+        return self.now
+
+    def wait(self, seconds):
+        """
+        Move forward by seconds
+        """
+        self.waits.append(seconds)
+        self.now += seconds
+
+
+def test_send_scheduler():
+    """
+    Posts are sent in order, the delay only following successful ones,
+    without holding up the caller
+    """
+    clock = FakeClock()
+    release = threading.Event()
+    sent = []
+
+    def post(number):
+        release.wait(10)
+        sent.append((number, clock.time()))
+        if number == 1:
+            raise RuntimeError('Failed')
+        return number != 2
+
+    scheduler = SendScheduler('client', 0.2, clock.time, clock.wait)
+    # Scheduled while the first post is held up
+    futures = [scheduler.schedule(post, number) for number in range(5)]
+    release.set()
+    scheduler.close()
+
+    assert [number for number, _ in sent] == list(range(5))
+    assert isinstance(futures[1].exception(), RuntimeError)
+    assert [future.result() for future in futures[2:]] == [False, True, True]
+    # Delays after posts 0, 3: none after the failed and unsuccessful ones
+    assert clock.waits == [0.2, 0.2]
+    assert [when for _, when in sent] == [0, 0.2, 0.2, 0.2, 0.4]
+
+
+def test_send_scheduler_cancel():
+    """
+    Posts not sent yet are cancelled, the one being sent isn't
+    """
+    started = threading.Event()
+    release = threading.Event()
+
+    def post():
+        started.set()
+        release.wait(10)
+        return True
+
+    scheduler = SendScheduler('client', 3600)
+    futures = [scheduler.schedule(post) for _ in range(3)]
+    started.wait(10)
+    closing = threading.Thread(target=scheduler.close,
+                               kwargs={'cancel': True})
+    closing.start()
+    # Closed while the first post is being sent
+    scheduler._stop.wait(10)
+    release.set()
+    closing.join()
+
+    assert futures[0].result()
+    assert all(future.cancelled() for future in futures[1:])
+
+
+def test_send_delay(tmp_path, monkeypatch):
+    """
+    Posts to a client with a delay are left to its scheduler, other clients
+    don't wait for them, and they are recorded once sent
+    """
+    clock = FakeClock()
+    monkeypatch.setattr(feedspora_runner, 'SendScheduler',
+                        functools.partial(SendScheduler, clock=clock.time,
+                                          wait=clock.wait))
+    runner = make_runner(tmp_path / "delay.db")
+    release = threading.Event()
+    clients = [PostingClient('client'),
+               PostingClient('delayed', delay=1, barrier=release)]
+    for client in clients:
+        runner.connect_client(client)
+    feed = GenericFeed({'path': 'feed.rss'})
+    entries = [make_entry('link%d' % i) for i in range(3)]
+
+    runner._start_schedulers()
+    for count, entry in enumerate(entries):
+        runner._publish_entry(entry, count + 1, feed, count + 1)
+    assert clients[0].posted == ['link0', 'link1', 'link2']
+    assert clients[1].posted == []
+    assert not runner.is_already_published(entries[0], clients[1], feed)
+
+    release.set()
+    runner._close_schedulers()
+    assert clock.waits == [1, 1]
+    assert clients[1].posted == ['link0', 'link1', 'link2']
+    assert all(runner.is_already_published(entry, clients[1], feed)
+               for entry in entries)
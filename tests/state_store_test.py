@@ -0,0 +1,273 @@
+"""
+Test the state store backends
+"""
+
+import os
+import sqlite3
+import time
+
+import pytest
+
+from feedspora.feedspora_runner import FeedSpora
+from feedspora.state_store import (STATE_STORES, LogStateStore,
+                                   SQLiteStateStore, entry_digest)
+
+
+@pytest.fixture(params=sorted(STATE_STORES))
+def store_class(request):
+    """
+    Each state store backend
+    """
+    return STATE_STORES[request.param]
+
+
+def test_contains_many(tmp_path, store_class):
+    """
+    Published items are found, and survive reopening the store
+    """
+    path = str(tmp_path / "state")
+    store = store_class(path)
+    store.open()
+    store.add_many([('client1', entry_digest('a'), None),
+                    ('client2', entry_digest('b'), None)])
+    store.add_many([('client1', entry_digest('a'), None)])
+    store.close()
+
+    store = store_class(path)
+    store.open()
+    queried = [(client_id, entry_digest(identity))
+               for client_id in ('client1', 'client2', 'client3')
+               for identity in ('a', 'b', 'c')]
+    assert store.contains_many(queried) == {('client1', entry_digest('a')),
+                                            ('client2', entry_digest('b'))}
+    assert store.contains_many([]) == set()
+    store.close()
+
+
+def test_new_db(tmp_path):
+    """
+    A new database is created with the current schema
+    """
+    store = SQLiteStateStore(str(tmp_path / "new.db"))
+    store.open()
+
+    assert store.get_schema_version() == 4
+    conn = sqlite3.connect(store.get_path())
+    assert ('posts_client_entry', ) in conn.execute(
+        "SELECT name FROM sqlite_master WHERE type='index'").fetchall()
+
+
+def test_migrate_legacy_db(tmp_path):
+    """
+    Files created before the schema was versioned are migrated in place:
+    duplicates are removed, and identifiers replaced by their digest
+    """
+    db_file = str(tmp_path / "legacy.db")
+    conn = sqlite3.connect(db_file)
+    conn.execute("CREATE table posts (id INTEGER PRIMARY KEY, "
+                 "feedspora_id, client_id TEXT)")
+    conn.executemany("INSERT INTO posts (feedspora_id, client_id) "
+                     "values (?,?)",
+                     [('link1 date1', 'client1'),
+                      ('link1 date1', 'client1'),
+                      ('link1 date1', 'client2'),
+                      ('link2 date2', 'client1')])
+    conn.commit()
+    conn.close()
+
+    store = SQLiteStateStore(db_file)
+    store.open()
+
+    assert store.get_schema_version() == 4
+    conn = sqlite3.connect(db_file)
+    assert conn.execute("SELECT feedspora_id, client_id FROM posts "
+                        "WHERE published_at IS NOT NULL "
+                        "ORDER BY id").fetchall() == [
+                            (entry_digest('link1 date1'), 'client1'),
+                            (entry_digest('link1 date1'), 'client2'),
+                            (entry_digest('link2 date2'), 'client1')]
+    store.close()
+
+    # Migrating again is a no-op
+    store = SQLiteStateStore(db_file)
+    store.open()
+    assert store.get_schema_version() == 4
+
+
+def test_truncated_log(tmp_path):
+    """
+    A record truncated by a crash is discarded, previous ones are kept
+    """
+    path = str(tmp_path / "state.log")
+    store = LogStateStore(path)
+    store.open()
+    store.add_many([('client1', entry_digest('a'), None)])
+    store.add_many([('client1', entry_digest('b'), None)])
+    store.close()
+
+    with open(path, 'r+b') as log_file:
+        log_file.truncate(os.path.getsize(path) - 3)
+
+    store = LogStateStore(path)
+    store.open()
+    assert store.contains_many([('client1', entry_digest('a')),
+                                ('client1', entry_digest('b'))]) == \
+        {('client1', entry_digest('a'))}
+    store.add_many([('client1', entry_digest('c'), None)])
+    store.close()
+
+    store = LogStateStore(path)
+    store.open()
+    assert ('client1', entry_digest('c')) in store.contains_many(
+        [('client1', entry_digest('c'))])
+
+
+def test_shared_log(tmp_path):
+    """
+    Records appended by another process aren't lost when the log is
+    rewritten, nor appended to the replaced log afterwards
+    """
+    path = str(tmp_path / "state.log")
+    stores = [LogStateStore(path), LogStateStore(path)]
+    for store in stores:
+        store.open()
+    stores[1].add_many([('client1', entry_digest('a'), None)])
+    stores[1].set_state('ns', 'key1', 1)
+    stores[0].compact()
+    stores[1].add_many([('client1', entry_digest('b'), None)])
+    stores[1].set_state('ns', 'key2', 2)
+    for store in stores:
+        store.close()
+
+    store = LogStateStore(path)
+    store.open()
+    assert len(store.contains_many([('client1', entry_digest('a')),
+                                    ('client1', entry_digest('b'))])) == 2
+    assert store.get_all_states('ns') == {'key1': 1, 'key2': 2}
+    store.close()
+
+
+def test_prune(tmp_path, store_class):
+    """
+    Pruning forgets old entries, or entries no longer in their feed, but
+    keeps the ones which are explicitly kept
+    """
+    path = str(tmp_path / "state")
+    feed1, feed2 = entry_digest('feed1'), entry_digest('feed2')
+    keys = {identity: entry_digest(identity) for identity in 'abcde'}
+    store = store_class(path)
+    store.open()
+    store.add_many([('client1', keys['a'], feed1),
+                    ('client1', keys['b'], feed1),
+                    ('client1', keys['c'], feed2),
+                    ('client1', keys['d'], None),
+                    ('client2', keys['a'], feed1)])
+
+    def published():
+        return {(client_id, identity)
+                for client_id, identity in [
+                    ('client1', 'a'), ('client1', 'b'), ('client1', 'c'),
+                    ('client1', 'd'), ('client1', 'e'), ('client2', 'a')]
+                if store.contains_many([(client_id, keys[identity])])}
+
+    # Nothing is old enough
+    assert store.prune_older_than(time.time() - 60) == 0
+
+    # Window of feed1 only holds entry 'a' now
+    assert store.prune_feed_window(feed1, {keys['a'], keys['e']}) == 1
+    assert published() == {('client1', 'a'), ('client1', 'c'),
+                           ('client1', 'd'), ('client2', 'a')}
+
+    # Everything is old, but 'a' is still in a feed, and feed2 is kept
+    assert store.prune_older_than(time.time() + 60, keep_keys={keys['a']},
+                                  keep_feeds={feed2}) == 1
+    assert published() == {('client1', 'a'), ('client1', 'c'),
+                           ('client2', 'a')}
+
+    store.compact()
+    store.add_many([('client1', keys['e'], feed2)])
+    store.close()
+
+    store = store_class(path)
+    store.open()
+    assert published() == {('client1', 'a'), ('client1', 'c'),
+                           ('client1', 'e'), ('client2', 'a')}
+    store.close()
+
+
+def test_state(tmp_path, store_class):
+    """
+    Key/value state is stored by namespace, and survives reopening the store
+    """
+    path = str(tmp_path / "state")
+    store = store_class(path)
+    store.open()
+    store.set_state('ns1', 'key1', {'etag': 'abc', 'clients': ['a', 'b']})
+    store.set_state('ns1', 'key2', 'value2')
+    store.set_state('ns2', 'key1', 42)
+    store.set_state('ns1', 'key2', None)
+    store.close()
+
+    store = store_class(path)
+    store.open()
+    assert store.get_state('ns1', 'key1') == {'etag': 'abc',
+                                              'clients': ['a', 'b']}
+    assert store.get_state('ns1', 'key2') is None
+    assert store.get_state('ns1', 'key3', 'default') == 'default'
+    assert store.get_all_states('ns2') == {'key1': 42}
+    store.compact()
+    store.set_state('ns2', 'key2', 43)
+    store.close()
+
+    store = store_class(path)
+    store.open()
+    assert store.get_all_states('ns2') == {'key1': 42, 'key2': 43}
+    store.close()
+
+
+def test_set_states(tmp_path, store_class):
+    """
+    Several values are stored (or removed) at once
+    """
+    path = str(tmp_path / "state")
+    store = store_class(path)
+    store.open()
+    store.set_states('ns', {'key1': 1, 'key2': 2, 'key3': 3})
+    store.set_states('ns', {'key1': None, 'key2': 'two'})
+    store.set_states('ns', {})
+    store.close()
+
+    store = store_class(path)
+    store.open()
+    assert store.get_all_states('ns') == {'key2': 'two', 'key3': 3}
+    store.close()
+
+
+def test_switch_backend(tmp_path):
+    """
+    Each backend has its own file, and a new one starts from the state of
+    the other backend
+    """
+    db_file = str(tmp_path / "feed.db")
+    runner = FeedSpora()
+    runner.set_db_file(db_file)
+    runner.set_settings({'state_store': 'sqlite'})
+    runner._init_db()
+    runner._store.add_many([('client1', entry_digest('a'), b'feed')])
+    runner._store.set_state('ns', 'key', 'value')
+    runner._store.close()
+
+    runner.set_settings({'state_store': 'log'})
+    runner._init_db()
+    assert runner._store.get_path() == str(tmp_path / "feed.log")
+    assert runner._store.contains_many([('client1', entry_digest('a'))])
+    assert runner._store.export_items()[0][2] == b'feed'
+    assert runner._store.get_state('ns', 'key') == 'value'
+    runner._store.add_many([('client1', entry_digest('b'), None)])
+    runner._store.close()
+
+    # The SQLite database is left as it was
+    runner.set_settings({'state_store': 'sqlite'})
+    runner._init_db()
+    assert not runner._store.contains_many([('client1', entry_digest('b'))])
+    runner._store.close()
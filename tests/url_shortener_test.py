@@ -0,0 +1,76 @@
+"""
+Test the shared URL shortener
+"""
+
+import time
+
+from feedspora import url_shortener
+from feedspora.state_store import DAY, STATE_STORES
+
+
+class FakeShortener:
+    """
+    Shortener counting the instances created and URLs shortened, failing
+    with the 'failing' service
+    """
+    available_shorteners = ['tinyurl', 'failing']
+    instances = 0
+    shortened = []
+
+    def __init__(self, **kwargs):
+        FakeShortener.instances += 1
+        self.tinyurl = self
+        self.failing = self
+
+    def short(self, url):
+        """
+        Return a short URL, unless the service is failing
+        """
+        FakeShortener.shortened.append(url)
+        if url.startswith('fail'):
+            raise TimeoutError('Timed out')
+        return 'short'
+
+
+def test_shorten(tmp_path, monkeypatch):
+    """
+    Short URLs are cached and stored, and failing services left alone
+    """
+    monkeypatch.setattr(url_shortener.pyshorteners, 'Shortener',
+                        FakeShortener)
+    url_shortener.configure(None)
+    long_url = 'http://aurelien.latitude77.org/some/long/path'
+
+    assert url_shortener.shorten('tinyurl', (), long_url) == 'short'
+    assert url_shortener.shorten('tinyurl', (), long_url) == 'short'
+    assert url_shortener.shorten('tinyurl', (), long_url + '/2') == 'short'
+    assert url_shortener.shorten('unknown', (), long_url) == long_url
+    assert FakeShortener.shortened == [long_url, long_url + '/2']
+    assert FakeShortener.instances == 1
+
+    # Not shared with another account
+    options = (('api_key', 'secret'),)
+    assert url_shortener.shorten('tinyurl', options, long_url) == 'short'
+    assert FakeShortener.shortened[-1] == long_url
+    assert FakeShortener.instances == 2
+    assert 'secret' not in url_shortener.cache_key('tinyurl', options,
+                                                   long_url)
+
+    # Not used again for a while once it failed
+    assert url_shortener.shorten('failing', (), 'failing') == 'failing'
+    assert url_shortener.shorten('failing', (), long_url) == long_url
+    assert FakeShortener.shortened[-1] == 'failing'
+
+    # Stored, then loaded for later runs, unless too old
+    store = STATE_STORES['sqlite'](str(tmp_path / 'shortener.db'))
+    store.open()
+    store.set_states('short_urls', url_shortener.pop_changes())
+    store.set_state('short_urls', 'tinyurl old',
+                    {'url': 'short', 'time': time.time() - 31 * DAY})
+    url_shortener.configure(None)
+    url_shortener.load_cache(store.get_all_states('short_urls'))
+    store.close()
+
+    assert url_shortener.shorten('tinyurl', (), long_url) == 'short'
+    assert FakeShortener.shortened[-1] == 'failing'
+    assert url_shortener.pop_changes() == {'tinyurl old': None}